@@ -304,8 +304,7 @@ class Camera(ABC):
         Set the stop event and join the write runner.
         """
         self.stop.set()
-        time.sleep(1)
-        # TODO: use join and close (possible issue due to h5 files)
+        # the process ends when it has written the queued frames
         self.camera_process.join()
 
     @staticmethod
@@ -531,12 +530,13 @@ class PicameraOutput:
 
     def annotate_timestamp(self, request: Any) -> None:
         """Annotate the frame with a timestamp."""
-        timestamp = f"{self.timer.elapsed_time()}"
+        tmst = self.timer.elapsed_us() / 1000  # ms with microsecond resolution
+        timestamp = f"{int(tmst)}"
         with MappedArray(request, "main") as frame:
             cv2.putText(
                 frame.array, timestamp, self.position, self.font, 1.0, self.color
             )
-            self.frame_queue.put((timestamp,))
+            self.frame_queue.put((tmst,))
             if self.post_process.is_set():
                 self.process_queue.put((timestamp, frame.array))
 
@@ -110,6 +110,11 @@ class Grating(Stimulus, dj.Manual):
 
         self.timer.start()
 
+    def prefetch(self, curr_cond, stim_period=''):
+        if curr_cond['temporal_freq'] != 0:
+            key = dict(curr_cond, filename=self._get_filename(curr_cond))
+            self.exp.logger.prefetch([dict(schema='stimulus', table='Grating.Movie', key=key, fields=['clip'])])
+
     def present(self):
         if self.timer.elapsed_time() > self.curr_cond['duration']:
             self.in_operation = False
@@ -50,6 +50,11 @@ class Images(Stimulus, dj.Manual):
         self.in_operation = True
         self.timer.start()
 
+    def prefetch(self, curr_cond, stim_period=''):
+        self.exp.logger.prefetch([
+            dict(schema='stimulus', table='Image', key=curr_cond, fields=('image',)),
+            dict(schema='stimulus', table='ImageClass.Info', key=curr_cond, fields=('image_height', 'image_width'))])
+
     def present(self):
         if self.curr_cond['pre_blank_period'] > 0 and self.timer.elapsed_time() < self.curr_cond['pre_blank_period']:
             #blank the screen
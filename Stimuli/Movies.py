@@ -37,6 +37,11 @@ class Movies(Stimulus, dj.Manual):
         self.in_operation = True
         self.timer.start()
 
+    def prefetch(self, curr_cond, stim_period=''):
+        self.exp.logger.prefetch([
+            dict(schema='stimulus', table='Movie.Clip', key=curr_cond, fields=('clip',)),
+            dict(schema='stimulus', table='Movie', key=curr_cond, fields=('frame_rate', 'frame_height', 'frame_width'))])
+
     def present(self):
         if self.timer.elapsed_time() < self.curr_cond['movie_duration']:
             surface = pygame.image.frombuffer(self.vid.get_next_data(), self.vsize, "RGB")
@@ -1,4 +1,5 @@
 import itertools
+import logging
 import time
 from dataclasses import dataclass, field
 
@@ -9,9 +10,14 @@ from scipy import stats
 from sklearn.metrics import roc_auc_score
 
 from core.Logger import behavior, experiment, mice, stimulus
-from utils.helper_functions import factorize, generate_conf_list, make_hash
+from utils.helper_functions import (chunks, count_conditions, factorize, generate_conf_list, hash_changes,
+                                    ifactorize, make_hash)
+from utils.Metrics import REGISTRY
 from utils.Timer import Timer
 
+STATE_LOOP = REGISTRY.counter("ethopy_state_loop_iterations_total",
+                              "Iterations of the state machine loop per state", ["state"])
+
 
 class State:
     state_timer, __shared_state = Timer(), {}
@@ -42,6 +48,9 @@ class ExperimentClass:
     curr_state, curr_trial, total_reward, cur_block, flip_count, states, stim, sync = '', 0, 0, 0, 0, dict(), False, False
     un_choices, blocks, iter, curr_cond, block_h, stims, response, resp_ready = [], [], [], dict(), [], dict(), [], False
     required_fields, default_key, conditions, cond_tables, quit, in_operation, cur_block_sz = [], dict(), [], [], False, False, 0
+    conditions_chunk = 1000  # number of conditions that are generated and logged together
+    # entering these states ends a trial (see end_trial), experiments whose trials end in other states override it
+    trial_end_states = ['InterTrial', 'Offtime']
 
     # move from State to State using a template method.
     class StateMachine:
@@ -58,7 +67,10 @@ class ExperimentClass:
                 if self.currentState != self.futureState:
                     self.currentState.exit()
                     self.currentState = self.futureState
+                    if self.currentState.name() in self.currentState.trial_end_states:
+                        self.currentState.end_trial()
                     self.currentState.entry()
+                STATE_LOOP.inc(self.currentState.__class__.__name__)
                 self.currentState.run()
                 self.futureState = self.states[self.currentState.next()]
             self.currentState.exit()
@@ -112,36 +124,46 @@ class ExperimentClass:
             self.stims[stim_name] = stim_class
         conditions.update({'stimulus_class': stim_name})
 
-        # Create conditions with permutation of variables
+        # Create conditions with permutation of variables, they are generated and logged in chunks as they are consumed
         if not stim_periods:
-            conditions = self.stims[stim_name].make_conditions(factorize(conditions))
+            conditions = ifactorize(conditions)
         else:
-            cond = {}
-            for i in range(len(stim_periods)):
-                cond[stim_periods[i]] = self.stims[stim_name].make_conditions(conditions=factorize(conditions[stim_periods[i]]))
-                conditions[stim_periods[i]] = []
-            all_cond = [cond[stim_periods[i]] for i in range(len(stim_periods))]
-            for comb in list(itertools.product(*all_cond)):
-                for i in range(len(stim_periods)): conditions[stim_periods[i]].append(comb[i])
-            conditions = factorize(conditions)
-        conditions = self.log_conditions(**self.beh.make_conditions(conditions))
-
-        # Verify all required fields are set
-        for cond in conditions:
-            assert np.all([field in cond for field in self.required_fields])
-            cond.update({**self.default_key, **self.params, **cond, 'experiment_class': self.cond_tables[0]})
-
-        # Generate correct table name and Log conditions
-        cond_tables = ['Condition.' + table for table in self.cond_tables]
-        conditions = self.log_conditions(conditions, condition_tables=['Condition'] + cond_tables)
-        return conditions
+            # each period key ranges over its own conditions, in the key order of the conditions
+            conditions = ifactorize({**conditions, **{
+                period: self.stims[stim_name].make_conditions(conditions=factorize(conditions[period]))
+                for period in stim_periods}})
+        return self._log_chunks(stim_name, conditions, ['Condition.' + table for table in self.cond_tables],
+                                stim_periods)
+
+    def _log_chunks(self, stim_name, conditions, cond_tables, stim_periods):
+        """Logs the conditions one chunk at a time and yields each chunk once it is logged."""
+        for chunk in chunks(conditions, self.conditions_chunk):
+            if not stim_periods:
+                chunk = self.stims[stim_name].make_conditions(chunk)
+            chunk = self.log_conditions(**self.beh.make_conditions(chunk))
+
+            # Verify all required fields are set
+            for cond in chunk:
+                assert np.all([field in cond for field in self.required_fields])
+                cond.update({**self.default_key, **self.params, **cond, 'experiment_class': self.cond_tables[0]})
+
+            # Log conditions in the tables of the experiment
+            yield from self.log_conditions(chunk, condition_tables=['Condition'] + cond_tables)
+
+    @staticmethod
+    def count_conditions(conditions, stim_periods=None):
+        """Returns the number of conditions that make_conditions generates, without generating them."""
+        count = count_conditions({k: v for k, v in conditions.items() if k not in (stim_periods or [])})
+        for period in stim_periods or []:
+            count *= count_conditions(conditions[period])
+        return count
 
     def push_conditions(self, conditions):
-        self.conditions = conditions
+        self.conditions = list(conditions)
         resp_cond = self.params['resp_cond'] if 'resp_cond' in self.params else 'response_port'
         self.blocks = np.array([cond['difficulty'] for cond in self.conditions])
-        if np.all([resp_cond in cond for cond in conditions]):
-            self.choices = np.array([make_hash([d[resp_cond], d['difficulty']]) for d in conditions])
+        if np.all([resp_cond in cond for cond in self.conditions]):
+            self.choices = np.array([make_hash([d[resp_cond], d['difficulty']]) for d in self.conditions])
             self.un_choices, un_idx = np.unique(self.choices, axis=0, return_index=True)
             self.un_blocks = self.blocks[un_idx]
         # select random condition for first trial initialization
@@ -169,30 +191,70 @@ class ExperimentClass:
         if not self.in_operation:
             self.in_operation = True
 
+    def end_trial(self):
+        """ Commits the rows of the trial, syncs the hot store and prefetches the next trial, if they are enabled """
+        if self.logger.trial_transactions: self.logger.end_trial()
+        if self.logger.hot_store: self.logger.sync_hot_store()
+        if self.logger.prefetch_enabled: self.prefetch_next_trial()
+
+    def prefetch_next_trial(self):
+        """ Starts reading the stimulus data of the next condition if the trial selection already knows it """
+        if not isinstance(self.curr_cond, dict): return
+        if self.curr_cond.get('trial_selection') == 'fixed' and len(self.conditions):
+            cond = self.conditions[0]
+        elif self.curr_cond.get('trial_selection') == 'block' and np.size(self.iter):
+            cond = self.conditions[self.iter[0]]
+        else: return
+        if cond.get('stimulus_class') not in self.stims: return
+        periods = [period for period, value in cond.items() if isinstance(value, dict)]
+        for period in periods or ['']:
+            self.stims[cond['stimulus_class']].prefetch(cond, period)
+
     def name(self): return type(self).__name__
 
     def log_conditions(self, conditions, condition_tables=['Condition'], schema='experiment', hsh='cond_hash', priority=2):
-        fields_key, hash_dict = list(), dict()
+        """Hashes the conditions and inserts the new ones with one bulk put per condition table and chunk."""
+        tables = []
+        fields_key = set()
         for ctable in condition_tables:
-            fields_key += list(self.logger.get_table_keys(schema, ctable))
-        for cond in conditions:
-            insert_priority = priority
-            key = {sel_key: cond[sel_key] for sel_key in fields_key if sel_key != hsh and sel_key in cond}  # find all dependant fields and generate hash
-            cond.update({hsh: make_hash(key)})
-            hash_dict[cond[hsh]] = cond[hsh]
-            for ctable in condition_tables:  # insert dependant condition tables
-                core = [field for field in self.logger.get_table_keys(schema, ctable, key_type='primary') if field != hsh]
-                fields = [field for field in self.logger.get_table_keys(schema, ctable)]
-                if not np.all([np.any(np.array(k) == list(cond.keys())) for k in fields]):
-                    if self.logger.manual_run: print('skipping ', ctable)
-                    continue  # only insert complete tuples
-                if core and hasattr(cond[core[0]], '__iter__'):
-                    for idx, pcond in enumerate(cond[core[0]]):
-                        cond_key = {k: cond[k] if type(cond[k]) in [int, float, str] else cond[k][idx] for k in fields}
-                        self.logger.put(table=ctable, tuple=cond_key, schema=schema, priority=insert_priority)
-                else: self.logger.put(table=ctable, tuple=cond.copy(), schema=schema, priority=insert_priority)
-                insert_priority += 1
-        return conditions
+            fields = self.logger.get_table_keys(schema, ctable)
+            core = [field for field in self.logger.get_table_keys(schema, ctable, key_type='primary')
+                    if field != hsh]
+            fields_key.update(fields)
+            tables.append((ctable, fields, set(fields), core))
+        fields_key.discard(hsh)
+        logged = []
+        for chunk in chunks(conditions, self.conditions_chunk):
+            keys = [{k: cond[k] for k in fields_key if k in cond} for cond in chunk]
+            if self.logger.hash_migration:
+                for old_hash, new_hash in hash_changes(keys):
+                    logging.warning('%s %s of the %s conditions changes to %s', hsh, old_hash, schema, new_hash)
+            memo = dict()  # encodings of the values shared by the conditions
+            for cond, key in zip(chunk, keys):  # find all dependant fields and generate hash
+                cond.update({hsh: make_hash(key, memo)})
+            hashes = list({cond[hsh] for cond in chunk})
+            for idx, (ctable, fields, field_set, core) in enumerate(tables):
+                existing = set()
+                if hashes and hsh in field_set:
+                    existing = set(self.logger.get(schema=schema, table=ctable,
+                                                   key=[{hsh: h} for h in hashes], fields=[hsh]))
+                rows = []
+                for cond in chunk:  # insert dependant condition tables
+                    if not field_set <= cond.keys():
+                        if self.logger.manual_run: print('skipping ', ctable)
+                        continue  # only insert complete tuples
+                    if cond[hsh] in existing:
+                        continue
+                    if core and hasattr(cond[core[0]], '__iter__'):
+                        for i, _ in enumerate(cond[core[0]]):
+                            rows.append({k: cond[k] if type(cond[k]) in [int, float, str] else cond[k][i]
+                                         for k in fields})
+                    else:
+                        rows.append(cond.copy())
+                if rows:
+                    self.logger.put(table=ctable, tuple=rows, schema=schema, priority=priority + idx)
+            logged += chunk
+        return logged
 
     def _anti_bias(self, choice_h, un_choices):
         choice_h = np.array([make_hash(c) for c in choice_h[-self.curr_cond['bias_window']:]])
@@ -320,6 +382,28 @@ class Session(dj.Manual):
         timestamp=CURRENT_TIMESTAMP : timestamp  
         """
 
+    class Epoch(dj.Part):
+        definition = """
+        # Wall clock time of the start of the session timer
+        -> Session
+        ---
+        epoch_us                    : bigint             # unix time of time 0 of the session (us)
+        """
+
+    class Degraded(dj.Part):
+        definition = """
+        # Period in which the rows of a table were shed because of the backlog of the logger
+        -> Session
+        table_name                  : varchar(64)        # schema.table of the rows
+        start_time                  : int                # time from session start (ms)
+        ---
+        stop_time                   : int                # time from session start (ms)
+        policy                      : enum('sample','divert','drop')
+        rows                        : int                # rows logged in the period
+        kept                        : int                # rows inserted in the table
+        filename=null               : varchar(255)       # HDF5 file of the diverted rows
+        """
+
 
 @experiment.schema
 class Condition(dj.Manual):
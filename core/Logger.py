@@ -6,30 +6,41 @@ controlling the flow of data from source to target locations, and supporting bot
 and automatic running modes. The Logger class manages threads for data insertion and setup
 status updates.
 """
+import functools
+import heapq
 import importlib
-import inspect
+import itertools
 import json
 import logging
 import os
 import pathlib
 import platform
 import pprint
+import random
 import socket
 import subprocess
+import sys
 import threading
 import time
-from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
+from dataclasses import replace as datareplace
 from dataclasses import field as datafield
+from dataclasses import fields as datafields
 from datetime import datetime
 from os import environ
-from queue import PriorityQueue
+from queue import Empty, PriorityQueue
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import datajoint as dj
 import numpy as np
 
-from utils.helper_functions import create_virtual_modules, rgetattr
+from core.Storage import (ConnectionSupervisor, DataJointBackend, HotStore, LookupCache,
+                          SessionOverlay, SQLiteBackend)
+from utils.helper_functions import create_virtual_modules, make_hash
+from utils.Journal import DeadLetters, Journal
+from utils import Metrics
 from utils.logging import setup_logging
 from utils.Timer import Timer
 from utils.Writer import Writer
@@ -54,6 +65,17 @@ environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
 # Schema mappings
 SCHEMATA = config["SCHEMATA"]
 
+# Storage of the data, "datajoint" for the database or "sqlite" for a local file
+STORAGE = config.get("storage", "datajoint")
+SQLITE_PATH = config.get(
+    "sqlite_path", os.path.join(os.path.expanduser("~"), "EthoPy_Files", "ethopy.sqlite")
+)
+# Definition hashes of the checked tables, the unchanged tables are not checked at startup
+SCHEMA_CACHE_PATH = config.get(
+    "schema_cache_path",
+    os.path.join(os.path.expanduser("~"), "EthoPy_Files", "schema_cache.json"),
+)
+
 VERSION = "0.1"
 
 
@@ -61,7 +83,10 @@ def set_connection():
     """
     Establishes connections to database, creates virtual modules based on the provided
     schemata and assigns them to global variables. It also initializes the `public_conn`
-    global variable.
+    and `public_backend` global variables.
+
+    With the "sqlite" storage no server is needed, the modules declare their tables in the
+    local SQLite file and public_conn is None.
 
     Globals:
         experiment: The virtual module for experiment.
@@ -70,12 +95,20 @@ def set_connection():
         recording: The virtual module for recording.
         mice: The virtual module for mice.
         public_conn: The connection object for public access.
+        public_backend: The storage backend for public access.
 
     Returns:
         None
     """
-    global experiment, stimulus, behavior, interface, recording, mice, public_conn
-    virtual_modules, public_conn = create_virtual_modules(SCHEMATA)
+    global experiment, stimulus, behavior, interface, recording, mice, public_conn, public_backend
+    if STORAGE == "sqlite":
+        public_conn = None
+        public_backend = SQLiteBackend(SQLITE_PATH, SCHEMATA)
+        virtual_modules = public_backend.modules
+    else:
+        virtual_modules, public_conn = create_virtual_modules(SCHEMATA,
+                                                              cache_path=SCHEMA_CACHE_PATH)
+        public_backend = DataJointBackend(virtual_modules, public_conn)
     experiment = virtual_modules["experiment"]
     stimulus = virtual_modules["stimulus"]
     behavior = virtual_modules["behavior"]
@@ -86,6 +119,66 @@ def set_connection():
 
 set_connection()
 
+# health metrics of the Logger, served with utils.Metrics.serve if metrics_port is set
+INSERT_SECONDS = Metrics.REGISTRY.histogram(
+    "ethopy_insert_seconds", "Time to insert a group of items of a table", ["table"])
+INSERTED_ROWS = Metrics.REGISTRY.counter(
+    "ethopy_inserted_rows_total", "Rows inserted or updated per table", ["table"])
+INSERT_RETRIES = Metrics.REGISTRY.counter(
+    "ethopy_insert_retries_total", "Inserts that failed and were queued again", ["table"])
+INSERT_FAILURES = Metrics.REGISTRY.counter(
+    "ethopy_insert_failures_total",
+    "Items that failed permanently and were written to the dead-letter file", ["table"])
+COALESCED_ITEMS = Metrics.REGISTRY.counter(
+    "ethopy_coalesced_items_total", "Queued items merged into a pending item of the same row",
+    ["table"])
+SHED_ROWS = Metrics.REGISTRY.counter(
+    "ethopy_shed_rows_total", "Rows that were sampled out, diverted or dropped because of the "
+    "backlog", ["table", "policy"])
+BATCH_ITEMS = Metrics.REGISTRY.histogram(
+    "ethopy_batch_items", "Number of items in an inserted batch", buckets=Metrics.SIZE_BUCKETS)
+RECONNECTS = Metrics.REGISTRY.counter(
+    "ethopy_reconnects_total", "Reconnections to the database after the connection was lost")
+SESSION_START_SECONDS = Metrics.REGISTRY.gauge(
+    "ethopy_session_start_seconds", "Time from the start of the process to the end of each "
+    "phase of the start of the last session", ["phase"])
+
+# MySQL errors that pass when the insert is tried again: too many connections, lock wait
+# timeout, deadlock, cannot connect, server has gone away, lost connection
+TRANSIENT_ERROR_CODES = {1040, 1205, 1213, 2003, 2006, 2013, 2055}
+
+
+def is_transient(error: BaseException) -> bool:
+    """Returns True if an insert error is caused by the connection or a lock and not the data."""
+    while error is not None:
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True
+        if type(error).__name__ == "LostConnectionError":
+            return True
+        if error.args and isinstance(error.args[0], int) and error.args[0] in TRANSIENT_ERROR_CODES:
+            return True
+        message = str(error).lower()
+        if "database is locked" in message or "lost connection" in message:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# the start of the process, approximated by the import of the Logger
+PROCESS_START = time.perf_counter()
+
+
+@functools.lru_cache(maxsize=None)
+def git_hash() -> str:
+    """Returns the short git hash of the code, resolved once per process."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError) as error:
+        logging.warning("Cannot resolve the git hash: %s", error)
+        return ""
+
 
 class Logger:
     """
@@ -107,37 +200,123 @@ class Logger:
         manual_run (bool): Flag indicating if the experiment is run manually.
         setup_status (str): Current status of the setup (e.g. 'running', 'ready').
         private_conn (Connection): Connection for internal database communication.
+        backend (DataJointBackend|SQLiteBackend): Storage backend of the private connection.
         writer (Writer): Writer class instance for handling data writing.
         rec_fliptimes (bool): Flag indicating if flip times should be recorded.
+        log_time_us (bool): Flag indicating if `log` adds the time in microseconds (time_us).
+        hash_migration (bool): Flag indicating if the condition hashes that differ from the
+        legacy repr hashes are reported.
+        first_trial_pending (bool): Flag indicating if the time to the first trial of the session
+        is still to be reported.
         trial_key (dict): Dictionary containing identifiers for the current trial.
         setup_info (dict): Dictionary containing setup information.
         datasets (dict): Dictionary containing datasets.
         lock (bool): Lock flag for thread synchronization.
-        queue (PriorityQueue): Queue for managing data insertion order.
+        queue (LaneQueue): Queue for managing data insertion order.
+        trial_transactions (bool): Flag indicating if the rows of the trial_tables are kept in
+        memory during a trial and committed in one transaction at its end.
+        trial_buffer (List[dict]): The put arguments of the rows of the current trial.
+        backpressure (dict): The shedding policies of the non-critical tables by name.
+        backpressure_watermark (int): Number of items not yet inserted above which the tables
+        with a policy are shed, until the backlog is below half of it.
+        degraded (Dict[str, DegradedPeriod]): The open degraded periods by table.
+        hot_store (HotStore): Local store of the hot_tables that is synced to the database in
+        the background, None if it is disabled.
+        hot_tables (List[str]): Tables that are written in the hot store.
+        overlay (SessionOverlay): The rows of the session-scoped tables that are written in the
+        session, including the queued ones, `get` reads the session from it.
+        coalesce_tables (List[str]): Tables whose pending replace and update items of the same
+        row are merged in the queue.
         ping_timer (Timer): Timer for managing pings.
+        keepalive_timer (Timer): Timer since the last ping written in the Control table.
+        keepalive_period (float): Time in milliseconds after which an unchanged ping is
+        written in the Control table.
+        control_ping (dict): The values of the last ping written in the Control table.
         logger_timer (Timer): Timer for managing logging intervals.
         total_reward (int): Total reward accumulated.
         curr_state (str): Current state of the logger.
         thread_exception (Exception): Exception caught in threads, if any.
+        retry_items (list): Heap of the failed items that wait for their backoff delay.
+        dead_letters (DeadLetters): File of the items that failed permanently.
+        failure_policy (str): "continue" or "abort" the session when an item fails permanently.
         source_path (str): Path where data are saved.
         target_path (str): Path where data will be moved after the session ends.
         thread_end (Event): Event to signal thread termination.
         thread_lock (Lock): Lock for thread synchronization.
         inserter_thread (Thread): Thread for inserting data into the database.
+        workers (List[InserterWorker]): The inserter workers, the first one uses the backend of
+        the Logger and a single worker also uses its queue.
+        dispatch_condition (Condition): Condition that guards the pending items of the workers.
         getter_thread (Thread): Thread for periodically updating setup status.
+        control_backend (DataJointBackend|SQLiteBackend): Storage backend of the Control sync,
+        with its own connection.
+        control_sync_period (float): Time in seconds between reads of the setup status.
+        status_synced (Event): Event that is cleared while a status change is committed.
+        batch_size (int): Maximum number of queued items inserted in one batch.
+        batch_time (float): Maximum time in milliseconds spent collecting one batch.
+        batch_linger (float): Time in milliseconds the inserter waits for more items before it
+        inserts a batch, 0 inserts whatever is in the queue immediately.
+        spilled_futures (dict): Futures of the items that are kept only in the journal by their
+        journal id.
+        journal (Journal): On-disk journal of the queued items that are not yet in the
+        database, None if it is disabled.
+        queue_limit (int): Number of queued items above which new items are kept only in the
+        journal.
+        cache (LookupCache): Cache of the Lookup and Part tables read with `get`.
+        read_connections (int): Number of threads of the read pool of get_async and prefetch,
+        from 1 to MAX_READ_CONNECTIONS. Each thread opens its own database connection at its
+        first read.
+        prefetch_enabled (bool): Flag indicating if prefetch starts reads, e.g. of the stimulus
+        of the next trial during the InterTrial. It is set with "prefetch" in local_conf.
+        metrics_server (ThreadingHTTPServer): Server of the metrics, None if it is disabled.
 
     Methods:
         __init__(protocol=False): Initializes the Logger instance.
         _check_if_raspberry_pi(): Checks if the current machine is a Raspberry Pi.
         _resolve_protocol_parameters(protocol): Resolves protocol parameters.
         _set_path_from_local_conf(key, default): Sets path from local configuration.
-        _initialize_schemata(): Initializes database schemata.
+        _connect_backend(): Creates the storage backend of the private connection.
         _inserter(): Inserts data into the database.
         _log_setup_info(setup, status): Logs setup information.
         _get_setup_status(): Get setup status.
     """
     DEFAULT_SOURCE_PATH = os.path.join(os.path.expanduser("~"), "EthoPy_Files/")
     DEFAULT_TARGET_PATH = False
+    DEFAULT_BATCH_SIZE = 200
+    DEFAULT_BATCH_TIME = 50  # ms
+    DEFAULT_BATCH_LINGER = 0  # ms
+    IDLE_TIMEOUT = 0.5  # s, how often an idle inserter checks for the thread_end event
+    DEFAULT_QUEUE_LIMIT = 10000
+    DEFAULT_CACHE_TTL = 300  # s
+    DEFAULT_KEEPALIVE_PERIOD = 30000  # ms
+    DEFAULT_RETRY_DELAY = 500  # ms, delay of the first retry of a failed insert
+    DEFAULT_RETRY_MAX_DELAY = 60000  # ms
+    DEFAULT_PERMANENT_RETRIES = 1  # retries of an item that failed with a data error
+    DEFAULT_SHUTDOWN_DEADLINE = 30  # s, time cleanup waits for the queue before it returns
+    DEFAULT_CONTROL_SYNC_PERIOD = 1  # s, period of the status reads of the Control table
+    DEFAULT_CACHE_EXCLUDE = ["experiment.Control"]
+    DEFAULT_COALESCE_TABLES = ["experiment.Control"]
+    # tables of the rows of a trial, the part tables of a table are included
+    DEFAULT_TRIAL_TABLES = ["experiment.Trial", "behavior.Activity", "behavior.Rewards",
+                            "behavior.BehCondition.Trial", "stimulus.StimCondition.Trial"]
+    DEFAULT_TRIAL_BUFFER_LIMIT = 5000  # rows, a trial with more rows is committed in parts
+    # policies of the tables that are shed above the watermark, the other tables always go
+    # to the queue: "drop", "divert" to an HDF5 file or "sample" one of every keep items.
+    # No table is shed unless its policy is set with "backpressure" in local_conf, e.g.
+    # {"behavior.Activity.Proximity": "divert",
+    #  "behavior.Activity.Position": {"policy": "sample", "keep": 10}}
+    DEFAULT_BACKPRESSURE = {}
+    DEFAULT_BACKPRESSURE_WATERMARK = 5000  # items not yet inserted
+    # tables that are written in the local hot store, the part tables of a table are included
+    DEFAULT_HOT_TABLES = ["behavior.Activity", "experiment.Trial.StateOnset"]
+    DEFAULT_HOT_SYNC_BATCH = 5000  # rows synced to the database in one transaction
+    DEFAULT_OVERLAY_TABLES = ["recording.Recording"]
+    DEFAULT_READ_CONNECTIONS = 2  # connections of the reads of get_async and prefetch
+    MAX_READ_CONNECTIONS = 4  # every read thread opens its own database connection
+    DEFAULT_PREFETCH_LIMIT = 16  # prefetched reads kept until a get takes them
+    DEFAULT_CONNECTION_CHECK_PERIOD = 5  # s, period of the pings of the database
+    DEFAULT_RECONNECT_DELAY = 1  # s, delay of the first reconnection attempt
+    DEFAULT_RECONNECT_MAX_DELAY = 60  # s
 
     def __init__(self, protocol=False):
         self.setup = socket.gethostname()
@@ -154,39 +333,206 @@ class Logger:
         self.setup_status = 'running' if self.manual_run else 'ready'
 
         # separate connection for internal communication
-        self._schemata, self.private_conn = create_virtual_modules(
-            SCHEMATA, create_tables=False, create_schema=False
-        )
+        self.backend = self._connect_backend()
+        self.private_conn = self.backend.connection
 
         self.writer = Writer
         self.rec_fliptimes = True
+        # add the elapsed time in microseconds to the logged tuples, it is inserted only in
+        # the tables that have a time_us column (e.g. time_us=null : bigint)
+        self.log_time_us = config.get("log_time_us", False)
+        self.hash_migration = config.get("hash_migration", False)
+        self.first_trial_pending = False
         self.trial_key = {'animal_id': 0, 'session': 1, 'trial_idx': 0}
         self.setup_info = {}
         self.datasets = {}
+        self.closing_datasets = []  # writers that finish writing and copying in the background
+        self.shutdown_deadline = config.get("shutdown_deadline", self.DEFAULT_SHUTDOWN_DEADLINE)
+        # rows of the trial tables wait in the trial_buffer until end_trial is called
+        self.trial_transactions = config.get("trial_transactions", False)
+        self.trial_tables = config.get("trial_tables", self.DEFAULT_TRIAL_TABLES)
+        self.trial_buffer_limit = config.get("trial_buffer_limit",
+                                             self.DEFAULT_TRIAL_BUFFER_LIMIT)
+        self.trial_buffer = []
+        self.trial_buffer_lock = threading.Lock()
+        # above the watermark the rows of the non-critical tables are shed, every degraded
+        # period is recorded in Session.Degraded
+        self.backpressure = config.get("backpressure", self.DEFAULT_BACKPRESSURE)
+        self.backpressure_watermark = config.get("backpressure_watermark",
+                                                 self.DEFAULT_BACKPRESSURE_WATERMARK)
+        self.degraded = {}
+        self.diverted = {}  # the writers of the diverted rows by table
+        self.backpressure_lock = threading.Lock()
         self.lock = False
-        self.queue = PriorityQueue()
+        self.queue = LaneQueue(coalesce=True)
         self.ping_timer = Timer()
+        self.keepalive_timer = Timer()
+        self.keepalive_period = config.get("control_keepalive_period",
+                                           self.DEFAULT_KEEPALIVE_PERIOD)
+        self.control_ping = {}
         self.logger_timer = Timer()
         self.total_reward = 0
         self.curr_state = ""
         self.thread_exception = None
-        self.update_status = threading.Event()
-        self.update_status.clear()
+        # set while no status change is being committed, the Control sync waits on it so
+        # that it does not read back the old status
+        self.status_synced = threading.Event()
+        self.status_synced.set()
+        self.status_version = 0
 
         # source path is the local path that data are saved
         self.source_path = self._set_path_from_local_conf("source_path", self.DEFAULT_SOURCE_PATH)
         # target path is the path that data will be moved after the session ends
         self.target_path = self._set_path_from_local_conf("target_path", self.DEFAULT_TARGET_PATH)
 
-        # inserter_thread read the queue and insert the data in the database
+        # limits of the batches that the inserter_thread sends to the database
+        self.batch_size = config.get("insert_batch_size", self.DEFAULT_BATCH_SIZE)
+        self.batch_time = config.get("insert_batch_time", self.DEFAULT_BATCH_TIME)
+        self.batch_linger = config.get("insert_batch_linger", self.DEFAULT_BATCH_LINGER)
+
+        # failed inserts are retried with exponential backoff and jitter, items that fail
+        # permanently are written to the dead-letter file and the session goes on unless the
+        # insert_failure_policy is "abort"
+        self.retry_delay = config.get("insert_retry_delay", self.DEFAULT_RETRY_DELAY)
+        self.retry_max_delay = config.get("insert_retry_max_delay", self.DEFAULT_RETRY_MAX_DELAY)
+        self.permanent_retries = config.get("insert_permanent_retries",
+                                            self.DEFAULT_PERMANENT_RETRIES)
+        self.failure_policy = config.get("insert_failure_policy", "continue")
+        self.retry_items = []  # heap of (due time, sequence, item)
+        self.retry_sequence = itertools.count()
+        self.retry_lock = threading.Lock()
+        self.dead_letters = DeadLetters(
+            config.get("dead_letter_path", os.path.join(self.source_path, "dead_letter.log")))
+
+        # with the hot_store the rows of the hot_tables are written in a local file and synced
+        # to the database in the background between trials and at the end of the session
+        self.hot_store = None
+        self.hot_tables = config.get("hot_tables", self.DEFAULT_HOT_TABLES)
+        self.hot_sync_batch = config.get("hot_sync_batch", self.DEFAULT_HOT_SYNC_BATCH)
+        self.hot_sync_request = threading.Event()
+        # the last trial of each session that is committed, the rows of the hot store of the
+        # session are synced only up to it so that their Trial rows are inserted first
+        self.committed_trials = {}
+        self.committed_trials_lock = threading.Lock()
+        if config.get("hot_store", False):
+            self.hot_store = HotStore(
+                config.get("hot_store_path", os.path.join(self.source_path, "hot_store.sqlite")),
+                SCHEMATA)
+            self.hot_sync_request.set()  # the rows of a previous run
+
+        self._table_keys = {}  # headings and primary keys by (schema, table, primary)
+        # only the newest pending row of these tables is written, their keys are read here so
+        # that put does not query the database from the other threads
+        self.coalesce_tables = config.get("coalesce_tables", self.DEFAULT_COALESCE_TABLES)
+        for name in self.coalesce_tables:
+            try:
+                self.get_table_keys(*name.split("."), key_type="primary")
+            except Exception as error:
+                logging.warning("No primary key of %s to coalesce its items: %s", name, error)
+        # the reads of the sessions of these tables are served from memory and see the
+        # rows that are still queued
+        self.overlay = SessionOverlay()
+        for name in config.get("overlay_tables", self.DEFAULT_OVERLAY_TABLES):
+            schema, table = name.split(".", 1)
+            try:
+                self.overlay.add_table(schema, table, self.get_table_keys(schema, table),
+                                       self.get_table_keys(schema, table, key_type="primary"))
+            except Exception as error:
+                logging.warning("No heading of %s for the session overlay: %s", name, error)
+        self.recording_lock = threading.Lock()
+        self.last_rec_idx = {}  # the last rec_idx of the sessions
+
+        # journal of the queued items, unacknowledged items of a previous run are replayed
+        self.queue_limit = config.get("queue_limit", self.DEFAULT_QUEUE_LIMIT)
+        self.journal = None
+        self.spilled_futures = {}
+        if config.get("journal", True):
+            self.journal = Journal(
+                os.path.join(self.source_path, "journal"),
+                fsync_period=config.get("journal_fsync_period", 1.0),
+            )
+            self._replay_journal()
+
+        # cache of the static tables, Control changes from outside and is always read
+        self.cache = LookupCache(
+            ttl=config.get("cache_ttl", self.DEFAULT_CACHE_TTL),
+            exclude=config.get("cache_exclude", self.DEFAULT_CACHE_EXCLUDE),
+        )
+
+        # get_async and prefetch read in a pool of threads, each with its own connection that
+        # is opened at its first read, a get takes the result of a matching prefetched read
+        self.read_connections = config.get("read_connections", self.DEFAULT_READ_CONNECTIONS)
+        if not 1 <= self.read_connections <= self.MAX_READ_CONNECTIONS:
+            logging.warning("read_connections must be between 1 and %d, it is set to %d",
+                            self.MAX_READ_CONNECTIONS, self.DEFAULT_READ_CONNECTIONS)
+            self.read_connections = self.DEFAULT_READ_CONNECTIONS
+        self.read_pool = ThreadPoolExecutor(max_workers=self.read_connections,
+                                            thread_name_prefix="reader")
+        self.read_backends = threading.local()
+        self.prefetch_enabled = config.get("prefetch", False)
+        self.prefetch_limit = config.get("prefetch_limit", self.DEFAULT_PREFETCH_LIMIT)
+        self.prefetched = {}  # futures of the prefetched reads by signature
+        self.prefetch_lock = threading.Lock()
+
+        # metrics of the queues, served on a local HTTP endpoint if metrics_port is set
+        Metrics.REGISTRY.gauge("ethopy_queue_items", "Items waiting to be inserted per priority",
+                               ["priority"], callback=self._queue_depths)
+        if self.hot_store:
+            Metrics.REGISTRY.gauge("ethopy_hot_store_rows", "Rows of the hot store that are not "
+                                   "yet synced to the database",
+                                   callback=lambda: {(): self.hot_store.pending()})
+        Metrics.REGISTRY.gauge("ethopy_writer_backlog", "Values waiting to be written in the "
+                               "HDF5 files", callback=self._writer_backlog)
+        self.metrics_server = None
+        if config.get("metrics_port"):
+            self.metrics_server = Metrics.serve(config["metrics_port"],
+                                                config.get("metrics_host", "127.0.0.1"))
+
+        # the supervisor pings the database on its own connection and reopens the lost
+        # connections in the background, meanwhile the items wait in the queue and the reads
+        # are served from the cache
+        self.supervisor = ConnectionSupervisor(
+            self._connect_backend(),
+            check_period=config.get("connection_check_period",
+                                    self.DEFAULT_CONNECTION_CHECK_PERIOD),
+            retry_delay=config.get("reconnect_delay", self.DEFAULT_RECONNECT_DELAY),
+            retry_max_delay=config.get("reconnect_max_delay", self.DEFAULT_RECONNECT_MAX_DELAY),
+            on_reconnect=self._on_reconnect,
+        )
+        self.supervisor.add(public_backend)
+        Metrics.REGISTRY.gauge("ethopy_database_connected", "1 while the database is reachable",
+                               callback=lambda: {(): int(self.supervisor.connected.is_set())})
+
+        # inserter_thread read the queue and insert the data in the database, with more
+        # workers it routes the items to the workers that have their own connections
         self.thread_end, self.thread_lock = threading.Event(), threading.Lock()
+        n_workers = config.get("inserter_workers", 1)
+        self.workers = [InserterWorker(self.queue if n_workers == 1 else LaneQueue(),
+                                       self.backend, self.thread_lock)]
+        for _ in range(n_workers - 1):
+            self.workers.append(
+                InserterWorker(LaneQueue(), self._connect_backend(), threading.Lock())
+            )
+        for worker in self.workers:
+            self.supervisor.add(worker.backend, worker.lock)
+        self.supervisor.start()
+        self.dispatch_condition = threading.Condition()
+        self._dependencies, self._children = {}, {}
         self.inserter_thread = threading.Thread(target=self._inserter)
         self.inserter_thread.start()
+        if self.hot_store:
+            self.hot_sync_thread = threading.Thread(target=self._sync_hot_store)
+            self.hot_sync_thread.start()
 
         # _log_setup_info needs to run after the inserter_thread is started
         self._log_setup_info(self.setup, self.setup_status)
 
-        # before starting the getter thread we need to _log_setup_info
+        # before starting the getter thread we need to _log_setup_info, it reads the Control
+        # table on its own connection so it does not wait for the inserts
+        self.control_backend = self._connect_backend()
+        self.supervisor.add(self.control_backend)
+        self.control_sync_period = config.get("control_sync_period",
+                                              self.DEFAULT_CONTROL_SYNC_PERIOD)
         self.update_thread = threading.Thread(target=self._sync_control_table)
         self.update_thread.start()
         self.logger_timer.start()
@@ -274,11 +620,11 @@ class Logger:
         self._protocol_path = protocol_path
 
     def _find_protocol_path(self, task_idx=None):
-        """find the protocol path from the task index"""
+        """find the protocol path from the task index, it is read before the caches exist"""
         if task_idx:
-            task_query = experiment.Task() & dict(task_idx=task_idx)
-            if len(task_query) > 0:
-                return task_query.fetch1("task")
+            tasks = public_backend.fetch("experiment", "Task", dict(task_idx=task_idx), ["task"])
+            if len(tasks) > 0:
+                return tasks[0]
             else:
                 error_msg = f"There is no task_idx:{task_idx} in the tables Tasks"
                 logging.info(error_msg)
@@ -286,13 +632,18 @@ class Logger:
         else:
             return False
 
-    def _initialize_schemata(self) -> Dict[str, dj.VirtualModule]:
-        return {
-            schema: dj.create_virtual_module(
-                schema, value, connection=self.private_conn
-            )
-            for schema, value in SCHEMATA.items()
-        }
+    def _connect_backend(self) -> Union[DataJointBackend, SQLiteBackend]:
+        """
+        Creates the storage backend of the private connection.
+
+        With the DataJoint storage it opens a new connection, with the SQLite storage the
+        public backend is shared since SQLite serializes the access to the file.
+        """
+        if STORAGE == "sqlite":
+            return public_backend
+        return DataJointBackend(
+            *create_virtual_modules(SCHEMATA, create_tables=False, create_schema=False)
+        )
 
     def _check_if_raspberry_pi(self) -> bool:
         system = platform.uname()
@@ -327,86 +678,436 @@ class Logger:
             extra_schema (Dict[str, Any]): The additional schema to set up.
         """
         for schema, value in extra_schema.items():
-            globals()[schema] = dj.create_virtual_module(
-                schema, value, create_tables=True, create_schema=True
-            )
-            self._schemata.update(
-                {
-                    schema: dj.create_virtual_module(
-                        schema, value, connection=self.private_conn
-                    )
-                }
-            )
+            globals()[schema] = public_backend.add_schema(schema, value, create=True)
+            for worker in self.workers:
+                if worker.backend is not public_backend:
+                    worker.backend.add_schema(schema, value)
 
-    def put(self, **kwargs: Any) -> None:
+    def put(self, **kwargs: Any) -> Future:
         """
         Put an item in the queue.
 
         This method creates a `PrioritizedItem` from the given keyword arguments and puts it into
-        the queue. After putting an item in the queue, it checks the 'block' attribute of the item.
-        If 'block' is False, it marks the item as processed by calling `task_done()`. This is useful
-        in scenarios where items are processed asynchronously, and the queue needs to be notified
-        that a task is complete. If 'block' is True, it waits for all items in the queue to be
-        processed by calling `join()`.
+        the queue. The tuple of the item is a dict, or a list of dicts with the same fields
+        that are inserted together with one multi-row insert. The fields of more items can be
+        given as items, they are inserted after the item in the same transaction. If the journal
+        is enabled the item is first appended to the journal, and if the queue has more than
+        `queue_limit` items a non-blocking item is kept only in the journal until there is room
+        in the queue, an item that has a journal_id is already journaled (e.g. replayed).
+        Replace and update items of a row of the coalesce_tables are merged
+        into the pending item of the same row, if there is one. Above the
+        backpressure_watermark the items of the tables with a backpressure policy may be
+        shed, their future is resolved at once. With the hot_store the items of the
+        hot_tables are inserted in the local file at once. The replayed items of the journal are
+        never shed or moved to the hot_store, they are inserted from the queue.
+        The returned future resolves when the inserter has committed the item in the database,
+        or with the exception if the item failed to be inserted twice. If 'block' is True, it
+        waits for the future and raises the exception of the insert.
 
         Args:
             **kwargs (Any): The keyword arguments used to create a `PrioritizedItem` and put it in the
         queue.
+
+        Returns:
+            Future: The future of the insert of the item.
         """
         item = PrioritizedItem(**kwargs)
+        item.future = Future()
+        replayed = item.journal_id is not None
+        if self.backpressure and not replayed and self._shed(item):
+            item.future.set_result(None)
+            return item.future
+        parts = [item] + [PrioritizedItem(**fields) for fields in item.items or []]
+        for rows in parts:
+            self.overlay.apply(rows.schema, rows.table, rows.rows,
+                               replace=rows.replace, update=rows.update)
+        if self.hot_store:
+            trials = [row for rows in parts if (rows.schema, rows.table) == ("experiment", "Trial")
+                      and not rows.update for row in rows.rows]
+            if trials:
+                item.future.add_done_callback(functools.partial(self._commit_trials, trials))
+        if self.hot_store and not replayed and self._is_hot(item):
+            try:
+                self.hot_store.insert(item.schema, item.table, item.rows,
+                                      ignore_extra_fields=item.ignore_extra_fields)
+            except Exception as error:
+                logging.warning("Failed to insert in the hot store %s: %s", item.table, error)
+            else:
+                item.future.set_result(None)
+                return item.future
+        item.coalesce_key = self._coalesce_key(item)
+        if self.journal:
+            spill = not item.block and self.queue.qsize() >= self.queue_limit
+            try:
+                if item.journal_id is None:
+                    item.journal_id = self.journal.append(item.journal_fields(), spill=spill)
+                elif spill:
+                    self.journal.spill(item.journal_id)
+            except Exception as error:
+                logging.warning("Failed to journal item of %s: %s", item.table, error)
+            else:
+                if spill:
+                    self.spilled_futures[item.journal_id] = item.future
+                    return item.future
         self.queue.put(item)
-        if not item.block:
-            self.queue.task_done()
-        else:
-            self.queue.join()
+        if item.block:
+            item.future.result()
+        return item.future
 
-    def _insert_item(self, item, table):
+    def _shed(self, item: "PrioritizedItem") -> bool:
         """
-        Inserts an item into the specified table.
+        Applies the backpressure policy of the table of an item.
+
+        When the backlog reaches the backpressure_watermark a degraded period of the table
+        starts, in which its items are sampled, diverted to an HDF5 file or dropped. The
+        period ends when the inserter has brought the backlog below half of the watermark.
+        Blocking, validated and composite items are never shed.
+
+        Args:
+            item (PrioritizedItem): The item that is put.
+
+        Returns:
+            bool: True if the item does not go to the queue.
+        """
+        name = f"{item.schema}.{item.table}"
+        policy = self.backpressure.get(name)
+        if policy is None or item.block or item.validate or item.items:
+            return False
+        policy = {"policy": policy} if isinstance(policy, str) else policy
+        with self.backpressure_lock:
+            period = self.degraded.get(name)
+            if period is None:
+                backlog = self.queue_size()
+                if backlog < self.backpressure_watermark:
+                    return False
+                logging.warning("Backlog of %d items, the rows of %s are shed (%s)",
+                                backlog, name, policy["policy"])
+                period = self.degraded[name] = DegradedPeriod(
+                    key={k: self.trial_key[k] for k in ("animal_id", "session")},
+                    policy=policy["policy"], start_time=self.logger_timer.elapsed_time())
+            period.items += 1
+            period.rows += len(item.rows)
+            if period.policy == "sample" and (period.items - 1) % policy.get("keep", 10) == 0:
+                period.kept += len(item.rows)
+                return False
+            if period.policy == "divert":
+                self._divert(name, period, item.rows)
+        SHED_ROWS.inc(name, period.policy, value=len(item.rows))
+        return True
+
+    def _divert(self, name: str, period: "DegradedPeriod", rows: List[Dict[str, Any]]) -> None:
+        """
+        Appends rows to the dataset of their table in an HDF5 file of the session, the fields
+        and types of the dataset are those of the scalar fields of the first diverted row.
+        """
+        if name not in self.diverted:
+            fields = [k for k, v in rows[0].items() if np.isscalar(v)]
+            dtype = np.dtype([(k, "S255" if isinstance(rows[0][k], str)
+                               else np.asarray(rows[0][k]).dtype) for k in fields])
+            self.diverted[name] = (self.createDataset(name, dtype, log=False), fields)
+        writer, fields = self.diverted[name]
+        period.filename = os.path.basename(writer.datapath)
+        for row in rows:
+            writer.append(name, tuple(row.get(k, 0) for k in fields))
+
+    def _recover_backpressure(self, force: bool = False) -> None:
+        """
+        Ends the degraded periods when the backlog is below half of the backpressure_watermark,
+        or all of them if force, and records them in Session.Degraded.
+        """
+        if not self.degraded:
+            return
+        if not force and self.queue_size() >= self.backpressure_watermark // 2:
+            return
+        with self.backpressure_lock:
+            periods, self.degraded = self.degraded, {}
+        stop_time = self.logger_timer.elapsed_time()
+        for name, period in periods.items():
+            logging.info("The rows of %s are inserted again, %d of %d rows were kept",
+                         name, period.kept, period.rows)
+            self.put(table="Session.Degraded", priority=1, tuple={
+                **period.key, "table_name": name, "start_time": period.start_time,
+                "stop_time": stop_time, "policy": period.policy, "rows": period.rows,
+                "kept": period.kept, "filename": period.filename})
+
+    def _coalesce_key(self, item: "PrioritizedItem") -> Optional[Tuple]:
+        """
+        Returns the key of the row of an item that can be merged with the pending items of
+        the same row, None if the item is inserted as it is.
+        """
+        name = f"{item.schema}.{item.table}"
+        if (
+            name not in self.coalesce_tables
+            or not (item.replace or item.update)
+            or item.block or item.validate or item.items
+            or not isinstance(item.tuple, dict)
+        ):
+            return None
+        primary_key = self._table_keys.get((item.schema, item.table, True))
+        if not primary_key or not set(primary_key) <= set(item.tuple):
+            return None
+        return (name, item.replace, item.update, item.ignore_extra_fields,
+                tuple(item.tuple[k] for k in primary_key))
+
+    def _replay_journal(self) -> None:
+        """
+        Puts in the queue the items of the journal of a previous run that were never
+        committed in the database.
+        """
+        for journal_id, item_fields in self.journal.replay():
+            self.put(**{**item_fields, "block": False, "validate": False,
+                        "journal_id": journal_id})
+
+    def _unspill_journal(self) -> None:
+        """
+        Moves items that are kept only in the journal back to the queue when the queue
+        is below half of the queue_limit.
+        """
+        room = self.queue_limit // 2 - self.queue.qsize()
+        if not self.journal.spilled or room <= 0:
+            return
+        for journal_id, item_fields in self.journal.unspill(room):
+            item = PrioritizedItem(**item_fields)
+            item.journal_id = journal_id
+            item.future = self.spilled_futures.pop(journal_id, None)
+            self.queue.put(item)
+
+    def _acknowledge(self, items: List["PrioritizedItem"]) -> None:
+        """
+        Checkpoints in the journal the items that are committed in the database, drops the
+        cached rows of their tables and resolves their futures.
+
+        Args:
+            items (List[PrioritizedItem]): The committed items.
+        """
+        if self.journal:
+            self.journal.ack([journal_id for item in items for journal_id in item.journal_ids])
+        tables = {(item.schema, item.table) for item in items}
+        tables.update((fields.get("schema", "experiment"), fields["table"])
+                      for item in items for fields in item.items or [])
+        for schema, table in tables:
+            self.cache.invalidate(schema, table)
+        for item in items:
+            if item.future and not item.future.done():
+                item.future.set_result(None)
+
+    @staticmethod
+    def _update_item(item, backend):
+        """
+        Updates in place the attributes of the tuple of an update item, the primary key
+        attributes of the tuple select the row.
+
+        Args:
+            item: The item with the primary key and the new values.
+            backend: The storage backend of the inserter worker.
+        """
+        primary_key = backend.primary_key(item.schema, item.table)
+        heading = backend.heading(item.schema, item.table)
+        key = {k: v for k, v in item.tuple.items() if k in primary_key}
+        values = {k: v for k, v in item.tuple.items() if k not in primary_key
+                  and (k in heading or not item.ignore_extra_fields)}
+        backend.update(item.schema, item.table, key, values)
+
+    def _insert_item(self, item, backend):
+        """
+        Inserts an item into its table, or updates the row if it is an update item. The items
+        of a composite item are inserted with it in one transaction.
 
         Args:
             item: The item to be inserted.
-            table: The table to insert the item into.
+            backend: The storage backend of the inserter worker.
 
         Returns:
             None
         """
-        table.insert1(
-            item.tuple,
-            ignore_extra_fields=item.ignore_extra_fields,
-            skip_duplicates=False if item.replace else True,
+        if item.items:
+            with backend.transaction():
+                self._insert_item(datareplace(item, items=None), backend)
+                for fields in item.items:
+                    self._insert_item(PrioritizedItem(**fields), backend)
+            return
+        if item.update:
+            self._update_item(item, backend)
+            return
+        backend.insert(
+            item.schema,
+            item.table,
+            item.rows,
             replace=item.replace,
+            ignore_extra_fields=item.ignore_extra_fields,
         )
 
-    def _validate_item(self, item, table):
+    def _insert_batch(self, items, backend):
         """
-        Validates an item against a table.
+        Inserts the tuples of a group of items into their table with a single
+        multi-row insert inside a transaction.
+
+        All items of the group share the same table, replace, update and ignore_extra_fields
+        options, update items are applied one by one in the same transaction.
+
+        Args:
+            items (List[PrioritizedItem]): The items to be inserted.
+            backend: The storage backend of the inserter worker.
+        """
+        with backend.transaction():
+            if items[0].update:
+                for item in items:
+                    self._update_item(item, backend)
+                return
+            backend.insert(
+                items[0].schema,
+                items[0].table,
+                [row for item in items for row in item.rows],
+                replace=items[0].replace,
+                ignore_extra_fields=items[0].ignore_extra_fields,
+            )
+
+    def _insert_items(self, items, backend):
         """
-        if item.validate:  # validate tuple exists in database
-            key = {k: v for (k, v) in item.tuple.items() if k in table.primary_key}
-            if "status" in item.tuple.keys():
-                key["status"] = item.tuple["status"]
-            while not len(table & key) > 0:
-                time.sleep(0.5)
+        Inserts a group of items and isolates the failing ones.
+
+        If the batch insert fails the group is split in two halves that are inserted
+        separately, until the item that causes the error is found and handled alone. An item
+        with a list of rows is split in the same way, so a bad row (e.g. of a chunk of
+        conditions) does not fail the other rows.
 
-    def _handle_insert_error(self, item, table, exception, queue):
+        Args:
+            items (List[PrioritizedItem]): The items to be inserted.
+            backend: The storage backend of the inserter worker.
         """
-        Handles an error by logging the error message, set the item.error=True, increase priority
-        and add the item again in the queue for re-trying to insert later.
+        table = f"{items[0].schema}.{items[0].table}"
+        try:
+            start = time.perf_counter()
+            if len(items) == 1:
+                self._insert_item(items[0], backend)
+            else:
+                self._insert_batch(items, backend)
+            INSERT_SECONDS.observe(time.perf_counter() - start, table)
+            INSERTED_ROWS.inc(table, value=sum(len(item.rows) for item in items))
+            self._acknowledge(items)
+        except Exception as insert_error:
+            if is_transient(insert_error):
+                self.supervisor.report_lost(backend)
+            elif len(items) == 1 and self._can_split(items[0]):
+                self._insert_items(self._split_item(items[0]), backend)
+                return
+            if len(items) == 1 or is_transient(insert_error):
+                # a connection error fails all the items, they are retried later together
+                for item in items:
+                    self._handle_failed_item(item, table, insert_error)
+            else:
+                half = len(items) // 2
+                self._insert_items(items[:half], backend)
+                self._insert_items(items[half:], backend)
+
+    @staticmethod
+    def _can_split(item: "PrioritizedItem") -> bool:
+        """Returns True if the rows of an item can be inserted separately."""
+        return len(item.rows) > 1 and not item.update and not item.items
+
+    def _split_item(self, item: "PrioritizedItem") -> List["PrioritizedItem"]:
+        """
+        Splits an item into two items with half of its rows each. The halves replace the item
+        in the journal and its future resolves when both are inserted, or with the first
+        exception.
+        """
+        half = len(item.rows) // 2
+        halves = [datareplace(item, tuple=rows, journal_id=None, superseded=None,
+                              coalesce_key=None, future=Future())
+                  for rows in (item.rows[:half], item.rows[half:])]
+        if self.journal:
+            for part in halves:
+                part.journal_id = self.journal.append(part.journal_fields())
+            self.journal.ack(item.journal_ids)
+        if item.future:
+            remaining, lock = [len(halves)], threading.Lock()
+
+            def resolve(future: Future) -> None:
+                with lock:
+                    remaining[0] -= 1
+                    if item.future.done():
+                        return
+                    if future.exception() is not None:
+                        item.future.set_exception(future.exception())
+                    elif not remaining[0]:
+                        item.future.set_result(None)
+
+            for part in halves:
+                part.future.add_done_callback(resolve)
+        return halves
+
+    def _handle_insert_error(self, item, table, exception):
+        """
+        Handles an error by logging the error message, set the item.error=True and schedule
+        the item to be put again in the queue after an exponential backoff with jitter.
 
         Args:
-            item : Description of parameter `item`.
-            table : Description of parameter `table`.
+            item (PrioritizedItem): The item that failed to be inserted.
+            table (str): The name of the table of the item.
             exception (Exception): The exception that was raised.
-            thread_end : Description of parameter `thread_end`.
-            queue : Description of parameter `queue`.
         """
+        delay = min(self.retry_max_delay, self.retry_delay * 2 ** item.retries) / 1000
+        delay = delay / 2 + random.uniform(0, delay / 2)
         logging.warning(
-            "Failed to insert:\n%s in %s\n With error:%s\nWill retry later",
-            item.tuple, table, exception, exc_info=True,)
+            "Failed to insert:\n%s in %s\n With error:%s\nWill retry in %.1f s",
+            item.tuple, table, exception, delay, exc_info=item.retries == 0)
+        INSERT_RETRIES.inc(table)
         item.error = True
-        item.priority = item.priority + 2
-        queue.put(item)
+        item.retries += 1
+        with self.retry_lock:
+            heapq.heappush(self.retry_items,
+                           (time.monotonic() + delay, next(self.retry_sequence), item))
+
+    def _release_retries(self) -> None:
+        """Puts back in the queue the failed items whose backoff delay has passed."""
+        now = time.monotonic()
+        with self.retry_lock:
+            while self.retry_items and self.retry_items[0][0] <= now:
+                self.queue.put(heapq.heappop(self.retry_items)[2])
+
+    def _on_reconnect(self) -> None:
+        """
+        Retries the failed items and syncs the hot store at once after a reconnection, the
+        next ping writes all the fields of the Control table again.
+        """
+        RECONNECTS.inc()
+        self.control_ping = {}
+        with self.retry_lock:
+            self.retry_items = [(0, sequence, item) for _, sequence, item in self.retry_items]
+            heapq.heapify(self.retry_items)
+        if self.hot_store:
+            self.hot_sync_request.set()
+
+    def _handle_failed_item(self, item, table, exception):
+        """
+        Retries an item that failed to be inserted. Transient errors (e.g. lost connection)
+        are always retried, other errors permanent_retries times. Then the item is written to
+        the dead-letter file and, if the insert_failure_policy is "abort", the threads are
+        signaled to end and the exception is stored.
+
+        Args:
+            item (PrioritizedItem): The item that failed to be inserted.
+            table (str): The name of the table of the item.
+            exception (Exception): The exception that was raised.
+        """
+        if is_transient(exception) or item.retries < self.permanent_retries:
+            self._handle_insert_error(item, table, exception)
+            return
+        INSERT_FAILURES.inc(table)
+        logging.error("Failed to insert:\n %s in %s With error:\n %s\nIt is written to %s",
+                      item.tuple, table, exception, self.dead_letters.filename, exc_info=True)
+        try:
+            self.dead_letters.append(item.journal_fields(), exception)
+        except Exception as error:
+            logging.error("Failed to write the dead-letter file: %s", error)
+        else:
+            if self.journal:
+                self.journal.ack(item.journal_ids)
+        if item.future and not item.future.done():
+            item.future.set_exception(exception)
+        if self.failure_policy == "abort":
+            self.thread_exception = exception
+            self.thread_end.set()
 
     @contextmanager
     def acquire_lock(self, lock):
@@ -426,100 +1127,304 @@ class Logger:
         finally:
             lock.release()
 
+    def _get_batch(self, queue: "LaneQueue") -> List["PrioritizedItem"]:
+        """
+        Collects a batch of items from a queue.
+
+        Blocks until an item is in the queue, so the inserter wakes up as soon as something
+        is put, and returns an empty batch if nothing arrives within IDLE_TIMEOUT.
+        Then more items are taken until the batch has batch_size items, batch_time
+        milliseconds have passed or the queue is empty for longer than batch_linger
+        milliseconds. A blocking or validated item ends the batch, so that it is inserted
+        without waiting and after all the items that were in front of it in the queue.
+
+        Args:
+            queue (LaneQueue): The queue of the inserter worker.
+
+        Returns:
+            List[PrioritizedItem]: The items of the batch in the order they left the queue.
+        """
+        try:
+            item = queue.get(timeout=self.IDLE_TIMEOUT)
+        except Empty:
+            return []
+        batch = [item]
+        batch_timer = Timer()
+        while (
+            not (item.block or item.validate)
+            and len(batch) < self.batch_size
+            and batch_timer.elapsed_time() < self.batch_time
+        ):
+            linger = (self.batch_linger - batch_timer.elapsed_time()) / 1000
+            try:
+                item = queue.get(timeout=linger) if linger > 0 else queue.get_nowait()
+            except Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _flush(self, batch: List["PrioritizedItem"], backend) -> None:
+        """
+        Inserts a batch of items in the database.
+
+        The items are grouped by (schema, table, replace, ignore_extra_fields, fields) and each
+        group is inserted with one multi-row insert. Groups are inserted in the order of their
+        first item in the batch, and a new group of a parent table (e.g. Trial) closes the
+        groups of its child tables (e.g. Trial.StateOnset), so their later items start new
+        groups after it and every row is inserted after the parent rows that were in front of
+        it. Blocking or validated items are inserted alone after the rest of the batch, so
+        their futures confirm the commit of everything that was in front of them.
+
+        Args:
+            batch (List[PrioritizedItem]): The items to be inserted.
+            backend: The storage backend of the inserter worker.
+        """
+        groups, open_groups = [], {}  # open_groups: group key -> (group, parent tables)
+        for item in batch:
+            if item.block or item.validate:
+                continue
+            # an item with a list of rows or composite is inserted alone
+            fields = (frozenset(item.tuple) if isinstance(item.tuple, dict) and not item.items
+                      else id(item))
+            group_key = (item.schema, item.table, item.replace, item.update,
+                         item.ignore_extra_fields, fields)
+            if group_key not in open_groups:
+                name, parents = self._table_dependencies(item, backend)
+                open_groups = {key: group for key, group in open_groups.items()
+                               if name not in group[1]}
+                open_groups[group_key] = ([], parents)
+                groups.append(open_groups[group_key][0])
+            open_groups[group_key][0].append(item)
+        for items in groups:
+            self._insert_items(items, backend)
+
+        for item in batch:
+            if not (item.block or item.validate):
+                continue
+            table = f"{item.schema}.{item.table}"
+            try:
+                start = time.perf_counter()
+                self._insert_item(item, backend)
+                INSERT_SECONDS.observe(time.perf_counter() - start, table)
+                INSERTED_ROWS.inc(table, value=len(item.rows))
+                self._acknowledge([item])
+            except Exception as insert_error:
+                self._handle_failed_item(item, table, insert_error)
+
+    def _process(self, worker: "InserterWorker") -> None:
+        """
+        Collects a batch of items from the queue of a worker, acquires the lock of the worker
+        and inserts the batch with one multi-row insert per table.
+        If an error occurs during the insertion, the failing item is isolated and handled.
+        After the insertion, it releases the lock and marks the items as done.
+
+        Args:
+            worker (InserterWorker): The inserter worker.
+        """
+        if not self.supervisor.connected.wait(self.IDLE_TIMEOUT):
+            return  # the items wait in the queue until the supervisor reconnects
+        batch = self._get_batch(worker.queue)
+        if not batch:
+            return
+        BATCH_ITEMS.observe(len(batch))
+        with self.acquire_lock(worker.lock):
+            self._flush(batch, worker.backend)
+        if len(self.workers) > 1:
+            self._release(worker, batch)
+        for _ in batch:
+            worker.queue.task_done()
+
+    def _table_dependencies(self, item: "PrioritizedItem",
+                            backend=None) -> Tuple[str, List[str]]:
+        """
+        Returns the full name of the table of an item and the full names of its parent
+        tables, read once per table with the backend of the calling worker, or by default
+        with the backend of the first worker.
+        """
+        if (item.schema, item.table) not in self._dependencies:
+            # the backend of the first worker is used by its inserter thread
+            with nullcontext() if backend else self.acquire_lock(self.thread_lock):
+                try:
+                    name = (backend or self.backend).full_name(item.schema, item.table)
+                    parents = (backend or self.backend).parents(item.schema, item.table)
+                except Exception as error:
+                    logging.debug("No dependencies of %s: %s", item.table, error)
+                    name, parents = f"{item.schema}.{item.table}", []
+            self._dependencies[(item.schema, item.table)] = (name, parents)
+            for parent in parents:
+                self._children.setdefault(parent, set()).add(name)
+        return self._dependencies[(item.schema, item.table)]
+
+    def _dispatch(self, item: "PrioritizedItem") -> None:
+        """
+        Routes an item to the queue of an inserter worker.
+
+        An item goes to the worker that has pending items of its table or of its parent
+        tables, so that the rows of a table keep their order and parent rows (e.g. Trial)
+        are committed before the rows that reference them (e.g. Trial.StateOnset). If these
+        pending items are in different workers it waits until only one of them has pending
+        items. Otherwise it prefers the worker with pending items of its child tables and
+        then the least loaded worker, so independent tables are inserted in parallel.
+
+        Args:
+            item (PrioritizedItem): The item to be routed.
+        """
+        name, parents = self._table_dependencies(item)
+        with self.dispatch_condition:
+            while True:
+                required = [worker for worker in self.workers
+                            if any(worker.pending.get(table) for table in [name, *parents])]
+                if len(required) <= 1 or self.thread_end.is_set():
+                    break
+                self.dispatch_condition.wait(self.IDLE_TIMEOUT)
+            if required:
+                worker = required[0]
+            else:
+                children = self._children.get(name, ())
+                preferred = [worker for worker in self.workers
+                             if any(worker.pending.get(table) for table in children)]
+                worker = preferred[0] if preferred else min(
+                    self.workers, key=lambda worker: worker.queue.qsize())
+            worker.pending[name] = worker.pending.get(name, 0) + 1
+        worker.queue.put(item)
+
+    def _release(self, worker: "InserterWorker", batch: List["PrioritizedItem"]) -> None:
+        """Marks the items of a processed batch as no longer pending in their worker."""
+        with self.dispatch_condition:
+            for item in batch:
+                name = self._dependencies[(item.schema, item.table)][0]
+                worker.pending[name] -= 1
+                if not worker.pending[name]:
+                    del worker.pending[name]
+            self.dispatch_condition.notify_all()
+
+    def _insert_worker(self, worker: "InserterWorker") -> None:
+        """Inserts the items of the queue of a worker until the thread_end event is set."""
+        while not self.thread_end.is_set():
+            self._process(worker)
+
     def _inserter(self):
         """
         This method continuously inserts items from the queue into their respective tables in
         the database.
 
-        It runs in a loop until the thread_end event is set. In each iteration, it checks if
-        the queue is empty. If it is, it sleeps for 0.5 seconds and then continues to the next
-        iteration.
-        If the queue is not empty, it gets an item from the queue, acquires the thread lock,
-        and tries to insert the item into it's table.
-        If an error occurs during the insertion, it handles the error. After the insertion,
-        it releases the thread lock. If the item was marked to block, it marks the task as done.
+        It runs in a loop until the thread_end event is set. With a single inserter worker, in
+        each iteration it collects a batch of items from the queue and inserts it. With more
+        workers, it routes the items of the queue to the workers, which insert them in their
+        own threads with their own connections.
+        The journal is synced to the disk periodically and items that were kept only in the
+        journal are moved back to the queue when there is room.
 
         Returns:
             None
         """
+        if len(self.workers) > 1:
+            for worker in self.workers:
+                worker.thread = threading.Thread(target=self._insert_worker, args=(worker,))
+                worker.thread.start()
         while not self.thread_end.is_set():
-            if self.queue.empty():
-                time.sleep(0.5)
-                continue
-            item = self.queue.get()
-            table = rgetattr(self._schemata[item.schema], item.table)
-            with self.acquire_lock(self.thread_lock):
+            if len(self.workers) == 1:
+                self._process(self.workers[0])
+            else:
                 try:
-                    self._insert_item(item, table)
-                    self._validate_item(item, table)
-                except Exception as insert_error:
-                    if item.error:
-                        self.thread_end.set()
-                        logging.error("Second time failed to insert:\n %s in %s With error:\n %s",
-                                      item.tuple, table, insert_error, exc_info=True)
-                        self.thread_exception = insert_error
-                        break
-                    self._handle_insert_error(item, table, insert_error, self.queue)
-            if item.block:
-                self.queue.task_done()
+                    item = self.queue.get(timeout=self.IDLE_TIMEOUT)
+                except Empty:
+                    pass
+                else:
+                    self._dispatch(item)
+                    self.queue.task_done()
+            self._release_retries()
+            self._recover_backpressure()
+            if self.journal:
+                self.journal.sync()
+                self._unspill_journal()
+        for worker in self.workers:
+            if worker.thread:
+                worker.thread.join()
+        if self.journal:
+            self.journal.sync(force=True)
 
     def _sync_control_table(self, update_period: float = 5000) -> None:
         """
         Synchronize the Control table by continuously fetching the setup status
         from the experiment schema and periodically updating the setup info.
 
-        Runs in a loop until the thread_end event is set.
+        Runs every control_sync_period seconds on its own connection until the thread_end
+        event is set, a cycle that is late is skipped. While a status change is committed
+        it waits on the status_synced event. While the database is not connected the status
+        is not read and connection errors do not end the session.
 
         Args:
             update_period (float): Time in milliseconds between Control table updates.
         """
-        while not self.thread_end.is_set():
-            with self.thread_lock:
-                if self.update_status.is_set():
-                    continue
-                try:
+        next_sync = time.monotonic()
+        while not self.thread_end.wait(max(0, next_sync - time.monotonic())):
+            next_sync = max(next_sync + self.control_sync_period, time.monotonic())
+            if not self.status_synced.wait(self.control_sync_period):
+                continue
+            try:
+                if self.supervisor.connected.is_set():
                     self._fetch_setup_info()
-                    self._update_setup_info(update_period)
-                except Exception as error:
-                    logging.exception("Error during Control table sync: %s", error)
-                    self.thread_exception = error
-
-            time.sleep(1)  # Cycle once a second
+                self._update_setup_info(update_period)
+            except Exception as error:
+                if is_transient(error):
+                    logging.warning("Failed to read the Control table: %s", error)
+                    self.supervisor.report_lost(self.control_backend)
+                    continue
+                logging.exception("Error during Control table sync: %s", error)
+                self.thread_exception = error
 
     def _fetch_setup_info(self) -> None:
-        self.setup_info = (
-            self._schemata["experiment"].Control() & {"setup": self.setup}
-        ).fetch1()
-        self.setup_status = self.setup_info["status"]
+        """
+        Reads the status of the setup from the Control table, the whole row is read only
+        when the status has changed. A read that overlaps a status change is discarded.
+        """
+        version = self.status_version
+        key = {"setup": self.setup}
+        status = self.control_backend.fetch1("experiment", "Control", key, ["status"])
+        if status != self.setup_status or not self.setup_info:
+            setup_info = self.control_backend.fetch1("experiment", "Control", key)
+            if self.status_synced.is_set() and version == self.status_version:
+                self.setup_info = setup_info
+                self.setup_status = setup_info["status"]
 
     def _update_setup_info(self, update_period: float) -> None:
         """
         Update the setup information if the elapsed time exceeds the update period.
 
         This method checks if the elapsed time since the last ping exceeds the given
-        update period. If it does, it resets the ping timer and updates the setup
-        information with the current state, queue size, trial index, total liquid reward,
-        and the current timestamp. The updated information is then stored in the "Control"
-        table with a priority of 1.
+        update period. If it does, it resets the ping timer and compares the current state,
+        queue size, trial index and total liquid reward with the values of the last ping.
+        Only the changed values and the current timestamp are updated in the "Control" table
+        with a priority of 1. If nothing has changed the ping is skipped, unless
+        keepalive_period has passed since the last ping.
         """
         if self.ping_timer.elapsed_time() >= update_period:
             self.ping_timer.start()
             info = {
-                "last_ping": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "queue_size": self.queue.qsize(),
+                "queue_size": self.queue_size(),
                 "trials": self.trial_key["trial_idx"],
                 "total_liquid": self.total_reward,
                 "state": self.curr_state,
             }
-            self.setup_info.update(info)
-            self.put(table="Control", tuple=self.setup_info, replace=True, priority=1)
+            changed = {k: v for k, v in info.items() if self.control_ping.get(k) != v}
+            if not changed and self.keepalive_timer.elapsed_time() < self.keepalive_period:
+                return
+            self.keepalive_timer.start()
+            changed["last_ping"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.control_ping.update(changed)
+            self.setup_info.update(changed)
+            self.put(table="Control", tuple={"setup": self.setup, **changed}, update=True,
+                     priority=1)
 
     def log(self, table, data=None, **kwargs):
         """
         This method logs the given data into the specified table in the experiment database.
 
-        It first gets the elapsed time from the logger timer and adds it to the data dictionary.
-        It then puts the data into the specified table.
+        It first gets the elapsed time from the logger timer and adds it to the data dictionary,
+        in milliseconds as time and if log_time_us is set also in microseconds as time_us.
+        It then puts the data into the specified table. With trial_transactions the rows of the
+        trial_tables are kept in the trial_buffer and committed together by end_trial.
 
         Args:
             table (str): The name of the table in the experiment database.
@@ -529,13 +1434,121 @@ class Logger:
         Returns:
             float: The elapsed time from the logger timer.
         """
-        tmst = self.logger_timer.elapsed_time()
+        tmst_us = self.logger_timer.elapsed_us()
+        tmst = tmst_us // 1000
         data = data or {}  # if data is None or False use an empty dictionary
-        self.put(table=table, tuple={**self.trial_key, "time": tmst, **data}, **kwargs)
+        if self.log_time_us:
+            data = {"time_us": tmst_us, **data}
+        fields = dict(table=table, tuple={**self.trial_key, "time": tmst, **data}, **kwargs)
+        if (self.trial_transactions and self._is_trial_row(fields)
+                and not (self.hot_store and self._is_hot(PrioritizedItem(**fields)))):
+            with self.trial_buffer_lock:
+                self.trial_buffer.append(fields)
+                full = len(self.trial_buffer) >= self.trial_buffer_limit
+            if full:
+                self.end_trial()
+        else:
+            self.put(**fields)
         if table == "Trial.StateOnset":
             logging.info("State: %s", data["state"])
         return tmst
 
+    @staticmethod
+    def _in_tables(name: str, tables: List[str]) -> bool:
+        """Checks if a table or its master table is in a list of tables."""
+        return any(name == table or name.startswith(table + ".") for table in tables)
+
+    def _is_trial_row(self, fields: Dict[str, Any]) -> bool:
+        """Checks if the put arguments of a row are of a table of the trial_tables."""
+        if fields.get("block") or fields.get("validate"):
+            return False
+        return self._in_tables(f'{fields.get("schema", "experiment")}.{fields["table"]}',
+                               self.trial_tables)
+
+    def _is_hot(self, item: "PrioritizedItem") -> bool:
+        """Checks if an item is inserted in the hot store."""
+        if item.block or item.validate or item.items or item.replace or item.update:
+            return False
+        return self._in_tables(f"{item.schema}.{item.table}", self.hot_tables)
+
+    def sync_hot_store(self) -> None:
+        """Requests a sync of the hot store, e.g. between trials."""
+        self.hot_sync_request.set()
+
+    def _commit_trials(self, rows: List[Dict[str, Any]], future: Future) -> None:
+        """Records the trials of the Trial rows of an item once the item is committed."""
+        if future.exception() is not None:
+            return
+        with self.committed_trials_lock:
+            for row in rows:
+                key = (row["animal_id"], row["session"])
+                self.committed_trials[key] = max(self.committed_trials.get(key, 0), row["trial_idx"])
+
+    def _is_hot_row_ready(self, row: Dict[str, Any]) -> bool:
+        """
+        Checks if a row of the hot store can be synced. The rows of the current session wait
+        until their trial is committed, the rows of a previous run are synced at once.
+        """
+        if "trial_idx" not in row:
+            return True
+        key = (row.get("animal_id"), row.get("session"))
+        if key != (self.trial_key["animal_id"], self.trial_key["session"]):
+            return True
+        with self.committed_trials_lock:
+            return row["trial_idx"] <= self.committed_trials.get(key, 0)
+
+    def _sync_hot_store(self) -> None:
+        """
+        Moves the rows of the hot store to the database on its own connection when a sync is
+        requested, until the thread_end event is set. Only the rows of committed trials are
+        synced, a sync that fails is tried again at the next request.
+        """
+        backend = self._connect_backend()
+        self.supervisor.add(backend)
+        while not self.thread_end.is_set():
+            if not self.supervisor.connected.wait(self.IDLE_TIMEOUT) \
+                    or not self.hot_sync_request.wait(self.IDLE_TIMEOUT):
+                continue
+            self.hot_sync_request.clear()
+            try:
+                start = time.perf_counter()
+                synced = self.hot_store.sync(backend, self.hot_sync_batch,
+                                             ready=self._is_hot_row_ready)
+                if synced:
+                    logging.info("Synced %d rows of the hot store in %.2f s",
+                                 synced, time.perf_counter() - start)
+            except Exception as error:
+                logging.warning("Failed to sync the hot store: %s", error)
+                if is_transient(error):
+                    self.supervisor.report_lost(backend)
+
+    def end_trial(self) -> Optional[Future]:
+        """
+        Commits the rows of the trial_buffer in one transaction.
+
+        The rows are ordered by priority, so parent tables come before their part tables, and
+        the rows of the same table and fields are inserted with one multi-row insert. They are
+        put as one composite item, which is journaled only from now on.
+
+        Returns:
+            Future: The future of the insert of the rows, None if the buffer is empty.
+        """
+        with self.trial_buffer_lock:
+            buffer, self.trial_buffer = self.trial_buffer, []
+        if not buffer:
+            return None
+        groups = {}
+        for fields in sorted(buffer, key=lambda fields: fields.get("priority", 50)):
+            key = (fields.get("schema", "experiment"), fields["table"],
+                   fields.get("replace", False), fields.get("ignore_extra_fields", True),
+                   frozenset(fields["tuple"]))
+            if key in groups:
+                groups[key]["tuple"].append(fields["tuple"])
+            else:
+                groups[key] = {**fields, "tuple": [fields["tuple"]]}
+        first, *items = groups.values()
+        return self.put(**first, items=items)
+
     def _log_setup_info(self, setup, setup_status='running'):
         """
         This method logs the setup information into the Control table in the experiment database.
@@ -554,8 +1567,8 @@ class Logger:
         Returns:
             None
         """
-        rel = experiment.Control() & dict(setup=setup)
-        key = rel.fetch1() if np.size(rel.fetch()) else dict(setup=setup)
+        rows = self.get(table="Control", key=dict(setup=setup), as_dict=True)
+        key = rows[0] if len(rows) else dict(setup=setup)
         key = {**key, "ip": self.get_ip(), "status": setup_status}
         self.put(
             table="Control",
@@ -566,9 +1579,10 @@ class Logger:
             validate=True,
         )
 
-    def _get_last_session(self):
+    def _get_last_session(self, animal_id: Optional[int] = None):
         """
         This method fetches the last session for a given animal_id from the experiment.Session.
+        If animal_id is not given, the animal_id of the Control table is used.
 
         It first fetches all sessions for the given animal_id. If no sessions are found,
         it returns 0.
@@ -578,62 +1592,92 @@ class Logger:
         Returns:
             int: The last session number or 0 if no sessions are found.
         """
-        last_sessions = (
-            experiment.Session() & dict(animal_id=self.get_setup_info("animal_id"))
-        ).fetch("session")
+        if animal_id is None:
+            animal_id = self.get_setup_info("animal_id")
+        last_sessions = self.get(
+            table="Session", key=dict(animal_id=animal_id),
+            fields=["session"],
+        )
         return 0 if np.size(last_sessions) == 0 else np.max(last_sessions)
 
     def log_session(self, params: Dict[str, Any], log_protocol: bool = False) -> None:
         """
         Logs a session with the given parameters and optionally logs the protocol.
 
+        The Session row, the protocol, the configuration of the setup and the update of the
+        Control table are put as one composite item, so they are committed in a single
+        transaction with a single wait for the inserter.
+
         Args:
             params (Dict[str, Any]): Parameters for the session.
             log_protocol (bool): Whether to log the protocol information.
         """
-        # Initializes session parameters and logs the session start.
-        self._init_session_params(params)
+        # the degraded periods of the previous session end with it
+        self._recover_backpressure(force=True)
+        self.overlay.clear()
+
+        # Initializes session parameters
+        session_key = self._init_session_params(params)
+
+        # read the setup configuration once for the whole session
+        self.cache.invalidate()
+        if "setup_conf_idx" in params:
+            self.prefetch_setup_configuration(params["setup_conf_idx"])
 
         # Save the protocol file, name and the git_hash in the database.
-        if log_protocol:
-            self._log_protocol_details()
+        items = [self._log_protocol_details()] if log_protocol else []
 
         # update the configuration tables of behavior/stimulus schemas
-        self._log_session_configs(params)
+        items += self._log_session_configs(params)
 
         #  Init the informations(e.g. trial_id=0, session) in control table
-        self._init_control_table(params)
+        items.append(self._init_control_table(params))
+
+        # Logs the new session id and its configuration to the database
+        self._begin_status_change()
+        try:
+            self.put(table="Session", tuple=session_key, items=items, priority=1,
+                     validate=True, block=True)
+        finally:
+            self.status_synced.set()
 
         self.logger_timer.start()  # Start session time
+        # the wall clock time of time 0, to map the session timestamps back to wall time
+        self.put(table="Session.Epoch", priority=1,
+                 tuple={**self.trial_key, "epoch_us": self.logger_timer.epoch_ns // 1000})
+        self.first_trial_pending = True
+        SESSION_START_SECONDS.set(time.perf_counter() - PROCESS_START, "log_session")
 
-    def _init_session_params(self, params: Dict[str, Any]) -> None:
+    def _init_session_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Initializes session parameters and logs the session start.
+        Initializes session parameters and returns the session key.
 
         This method initializes the session parameters by setting the total reward to zero
         and creating a trial key with the animal ID, trial index set to zero, and the session
         number incremented by one from the last session. It logs the trial key and creates a
         session key by merging the trial key with the provided session parameters, setup
-        information, and a default or provided user name. The session key is then logged and
-        stored in the database.
+        information, and a default or provided user name.
 
         Args:
             params (Dict[str, Any]): A dictionary containing parameters for initializing the
             session. This includes any additional information that should be merged into the
             session key.
+
+        Returns:
+            Dict[str, Any]: The session key to be logged in the Session table.
         """
         self.total_reward = 0
-        self.trial_key = {"animal_id": self.get_setup_info("animal_id"),
+        animal_id = self.get_setup_info("animal_id")
+        self.trial_key = {"animal_id": animal_id,
                           "trial_idx": 0,
-                          "session": self._get_last_session() + 1}
+                          "session": self._get_last_session(animal_id) + 1}
         logging.info("\n%s\n%s\n%s", "#" * 70, self.trial_key, "#" * 70)
         # Creates a session key by merging trial key with session parameters.
         # TODO: Read the user name from the Control Table
         session_key = {**self.trial_key, **params, "setup": self.setup,
                        "user_name": params.get("user_name", "bot")}
         logging.info("session_key:\n%s", pprint.pformat(session_key))
-        # Logs the new session id to the database
-        self.put(table="Session", tuple=session_key, priority=1, validate=True, block=True)
+        return session_key
 
     @staticmethod
     def get_inner_classes_list(outer_class):
@@ -651,9 +1695,9 @@ class Logger:
         inner_classes = [value for value in outer_class_dict_values if isinstance(value, type)]
         return [outer_class.__name__+'.'+cls.__name__ for cls in inner_classes]
 
-    def _log_session_configs(self, params) -> None:
+    def _log_session_configs(self, params) -> List[Dict[str, Any]]:
         """
-        Logs the parameters of a session into the appropriate schema tables.
+        Returns the items that log the parameters of a session into the appropriate schema tables.
 
         This method performs several key operations to ensure that the configuration of a session,
         including behavior and stimulus settings, is accurately logged into the database.It involves
@@ -666,6 +1710,9 @@ class Logger:
         4. Creates a dictionary mapping each schema to its respective Configuration class's
         inner classes.
         5. Calls a helper method to log the configuration of sub-tables for each schema.
+
+        Returns:
+            List[Dict[str, Any]]: The fields of the items to be put with the session.
         """
         # modules that have a Configuration classes
         _modules = ['core.Interface']
@@ -674,8 +1721,7 @@ class Logger:
         _schema = "interface"
 
         # Logs the session and animal_id in configuration tables of behavior/stimulus.
-        self.put(table="Configuration", tuple=self.trial_key, schema=_schema, priority=2,
-                 validate=True, block=True,)
+        items = [dict(table="Configuration", tuple=dict(self.trial_key), schema=_schema)]
 
         # create a dict with the configuration as key and the subclasses as values
         conf_table_schema = {}
@@ -686,38 +1732,60 @@ class Logger:
 
         # update the sub tables of Configuration table
         for schema, config_tables in conf_table_schema.items():
-            self._log_sub_tables_config(params, config_tables, schema)
+            items += self._log_sub_tables_config(params, config_tables, schema)
+        return items
+
+    def prefetch_setup_configuration(self, setup_conf_idx: int) -> None:
+        """
+        Reads the SetupConfiguration table and all its part tables for a setup_conf_idx in
+        the cache, so that the interface, behavior and stimulus setup read them from memory.
+
+        Args:
+            setup_conf_idx (int): The index of the setup configuration.
+        """
+        setup_conf = importlib.import_module("core.Interface").SetupConfiguration
+        key = {"setup_conf_idx": setup_conf_idx}
+        for table in ["SetupConfiguration"] + self.get_inner_classes_list(setup_conf):
+            restriction = self.cache.restriction(public_backend, "interface", table, key)
+            if restriction is not None:
+                rows = public_backend.fetch("interface", table, key, as_dict=True)
+                self.cache.put("interface", table, restriction, rows)
 
     def _log_sub_tables_config(
         self, params: Dict[str, Any], config_tables: List, schema: str
-    ) -> None:
+    ) -> List[Dict[str, Any]]:
         """
         This method iterates over a list of configuration tables, retrieves the configuration data
-        for each table based on the provided parameters, and then logs this data into the respective
-        table within the given schema.
+        for each table based on the provided parameters from the prefetched setup configuration,
+        and returns the items that log this data into the respective table within the given
+        schema.
 
         Args:
             params (Dict[str, Any]): Parameters for the setup conf.
             config_table (str): The part table to be recorded (e.g., Port, Screen).
             schema (str): The schema for the configuration.
+
+        Returns:
+            List[Dict[str, Any]]: The fields of the items with the configuration data.
         """
+        items = []
         for config_table in config_tables:
-            configuration_data = (
-                getattr(interface.SetupConfiguration, config_table.split('.')[1])
-                & {"setup_conf_idx": params["setup_conf_idx"]}
-            ).fetch(as_dict=True)
+            configuration_data = self.get(
+                schema="interface",
+                table="SetupConfiguration." + config_table.split('.')[1],
+                key={"setup_conf_idx": params["setup_conf_idx"]},
+                as_dict=True,
+            )
             # put the configuration data in the configuration table
             # it can be a list of configurations (e.g have two ports with different ids)
-            for conf in configuration_data:
-                self.put(
-                    table=config_table,
-                    tuple={**conf, **self.trial_key},
-                    schema=schema,
-                )
+            if len(configuration_data):
+                items.append(dict(table=config_table, schema=schema,
+                                  tuple=[{**conf, **self.trial_key} for conf in configuration_data]))
+        return items
 
-    def _init_control_table(self, params: Dict[str, Any]) -> None:
+    def _init_control_table(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Set the control table informations for the setup.
+        Set the control table informations for the setup and return the item that updates them.
 
         This method sets various parameters related to the session setup, including
         session ID, number of trials, total liquid, difficulty level, and state. It also
@@ -730,6 +1798,9 @@ class Logger:
         Args:
             params (Dict[str, Any]): A dictionary containing parameters for the session setup.
                 This may include 'start_time' and 'stop_time' among other setup parameters.
+
+        Returns:
+            Dict[str, Any]: The fields of the update item of the Control table.
         """
         key = {
             "session": self.trial_key["session"],
@@ -755,7 +1826,11 @@ class Logger:
                 }
             )
 
-        self.update_setup_info({**key, "status": self.setup_info["status"]})
+        info = {**key, "status": self.setup_info["status"]}
+        self.setup_info.update(info)
+        self.setup_status = info["status"]
+        self.control_ping = {}  # the next ping writes all its fields over the new session
+        return dict(table="Control", tuple={"setup": self.setup, **info}, update=True)
 
     def check_connection(self, host="8.8.8.8", port=53, timeout=0.1):
         """
@@ -783,13 +1858,14 @@ class Logger:
         """
         This method updates the setup information in Control table with the provided info and key.
 
-        It first fetches the existing setup information from the experiment's Control table,
-        then updates it with the provided info. If 'status' is in the provided info, it blocks
-        and validates the update operation.
+        Only the attributes in the provided info are updated in the Control table and in the
+        setup_info. If 'status' is in the provided info, it blocks until the update is committed
+        in the database. While the database is not connected it does not block, the Control
+        sync waits until the queued status is committed after the reconnection.
 
         Args:
             info (dict): The information to update the setup with.
-            key (dict, optional): Additional keys to fetch the setup information with.
+            key (dict, optional): Additional attributes of the row to update.
             Defaults to an empty dict.
 
         Side Effects:
@@ -797,56 +1873,65 @@ class Logger:
             Updates the setup_status attribute with the new status.
         """
         if self.thread_exception:
-            self.thread_exception = None
-            raise Exception("Thread exception occurred: %s", self.thread_exception)
+            exception, self.thread_exception = self.thread_exception, None
+            raise Exception("Thread exception occurred: %s" % exception) from exception
         if key is None:
             key = dict()
 
-        if not public_conn.is_connected:
-            set_connection()
-
         block = True if "status" in info else False
+        offline = block and not self.supervisor.connected.is_set()
         if block:
-            self.update_status.set()
-            caller = inspect.stack()[1]
-            caller_info = (f"Function called by {caller.function} "
-                           f"in {caller.filename} at line {caller.lineno}")
-            logging.info("Update status is set %s\n%s", info['status'], caller_info)
-
-        self.setup_info = {**(experiment.Control() & {**{"setup": self.setup}, **key}).fetch1(),
-                           **info}
+            self._begin_status_change()
+            caller = sys._getframe(1)  # pylint: disable=W0212
+            logging.info("Update status is set %s\nFunction called by %s in %s at line %d",
+                         info['status'], caller.f_code.co_name, caller.f_code.co_filename,
+                         caller.f_lineno)
 
         if 'notes' in info and len(info['notes']) > 255:
             info['notes'] = info['notes'][:255]
 
-        self.put(
-            table="Control",
-            tuple=self.setup_info,
-            replace=True,
-            priority=1,
-            block=block,
-            validate=block,
-        )
-        self.setup_status = self.setup_info["status"]
-        self.update_status.clear()
+        self.setup_info.update(info)
+        future = None
+        try:
+            future = self.put(
+                table="Control",
+                tuple={"setup": self.setup, **key, **info},
+                update=True,
+                priority=1,
+                block=block and not offline,
+                validate=block,
+            )
+            if "status" in info:
+                self.setup_status = info["status"]
+        finally:
+            if offline and future is not None:
+                version = self.status_version
+                future.add_done_callback(lambda _: self._end_status_change(version))
+            else:
+                self.status_synced.set()
+
+    def _begin_status_change(self) -> None:
+        """Pauses the Control sync until the status change is committed."""
+        self.status_version += 1
+        self.status_synced.clear()
 
-    def _log_protocol_details(self) -> None:
+    def _end_status_change(self, version: int) -> None:
+        """Resumes the Control sync after a queued status change, unless a newer one is pending."""
+        if version == self.status_version:
+            self.status_synced.set()
+
+    def _log_protocol_details(self) -> Dict[str, Any]:
         """
-        Save the protocol file,name and the git_hash in the database.
+        Returns the item that saves the protocol file, name and the git_hash in the database.
         """
-        git_hash = (
-            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
-            .decode("ascii")
-            .strip()
-        )
-        logging.info("Git hash: %s", git_hash)
-        self.put(
+        logging.info("Git hash: %s", git_hash())
+        return dict(
             table="Session.Task",
             tuple={
                 **self.trial_key,
                 "task_name": self.protocol_path,
                 "task_file": np.fromfile(self.protocol_path, dtype=np.int8),
-                "git_hash": git_hash,
+                "git_hash": git_hash(),
             },
         )
 
@@ -858,9 +1943,13 @@ class Logger:
             field: The name of the field to fetch from the experiment control setup.
 
         Returns:
-            The value of the specified field from the experiment control setup.
+            The value of the specified field from the experiment control setup, the last
+            synced value while the database is not connected.
         """
-        return (experiment.Control() & dict(setup=self.setup)).fetch1(field)
+        supervisor = getattr(self, "supervisor", None)  # not yet created while it starts
+        if supervisor and not supervisor.connected.is_set() and field in self.setup_info:
+            return self.setup_info[field]
+        return public_backend.fetch1("experiment", "Control", dict(setup=self.setup), [field])
 
     def get(self, schema='experiment', table='Control',
             fields: Optional[List] = None, key: Optional[Dict] = None,
@@ -868,6 +1957,13 @@ class Logger:
         """
         Fetches data from a specified table in a schema.
 
+        Reads of Lookup and Part tables that return fields or dicts are served from the
+        cache. Reads of a session of the overlay tables are served from the overlay, which
+        includes the rows that are still queued. A read that was prefetched returns the
+        result of the prefetch. The other reads always query the database. While the
+        database is not connected the reads are served from the cache, including expired
+        rows, and the reads that are not cached raise a ConnectionError without waiting.
+
         Args:
             schema (str): The schema to fetch data from. Defaults to "experiment".
             table (str): The table to fetch data from. Defaults to "Control".
@@ -878,15 +1974,145 @@ class Logger:
         Returns:
             The fetched data.
         """
+        future = self._take_prefetched(schema, table, fields, key, **kwargs)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as error:
+                logging.warning("Prefetch of %s.%s failed, reading it again: %s",
+                                schema, table, error)
+        return self._get(public_backend, schema, table, fields, key, **kwargs)
+
+    def _get(self, backend: Union[DataJointBackend, SQLiteBackend], schema: str, table: str,
+             fields: Optional[List] = None, key: Optional[Dict] = None, **kwargs):
+        """
+        Fetches data like get on the connection of the backend, the connection errors are
+        reported to the supervisor.
+        """
+        try:
+            return self._fetch(backend, schema, table, fields, key, **kwargs)
+        except Exception as error:
+            if is_transient(error) and self.supervisor.connected.is_set():
+                self.supervisor.report_lost(backend)
+            raise
+
+    def _fetch(self, backend: Union[DataJointBackend, SQLiteBackend], schema: str, table: str,
+               fields: Optional[List] = None, key: Optional[Dict] = None, **kwargs):
+        """Fetches data from the cache, the session overlay or the backend."""
         if key is None:
             key = dict()
         if fields is None:
             fields = []
-        table = rgetattr(eval(schema), table)
-        return (table() & key).fetch(*fields, **kwargs)
+        offline = not self.supervisor.connected.is_set()
+        restriction = None
+        session = self.overlay.session(schema, table, key)
+        if session is not None and LookupCache.can_format(fields, **kwargs):
+            if not self.overlay.is_loaded(schema, table, session):
+                self._check_connected(offline, schema, table)
+                session_key = dict(zip(SessionOverlay.session_fields, session))
+                self.overlay.load(schema, table, session, backend.fetch(
+                    schema, table, session_key, as_dict=True))
+            return LookupCache.format(self.overlay.get(schema, table, key), fields, **kwargs)
+        if LookupCache.can_format(fields, **kwargs):
+            restriction = self.cache.restriction(None if offline else backend,
+                                                 schema, table, key)
+        if restriction is None:
+            self._check_connected(offline, schema, table)
+            return backend.fetch(schema, table, key, fields, **kwargs)
+        rows = self.cache.get(schema, table, restriction, stale=offline)
+        if rows is None:
+            self._check_connected(offline, schema, table)
+            rows = backend.fetch(schema, table, key, as_dict=True)
+            self.cache.put(schema, table, restriction, rows)
+        return LookupCache.format(rows, fields, **kwargs)
+
+    @staticmethod
+    def _check_connected(offline: bool, schema: str, table: str) -> None:
+        """Raises a ConnectionError for a read of the database while it is not connected."""
+        if offline:
+            raise ConnectionError(f"Cannot read {schema}.{table}, the database is not "
+                                  "connected")
+
+    def get_async(self, schema='experiment', table='Control',
+                  fields: Optional[List] = None, key: Optional[Dict] = None,
+                  **kwargs) -> Future:
+        """
+        Fetches data like get in a thread of the read pool without blocking the caller.
+
+        Args:
+            schema (str): The schema to fetch data from. Defaults to "experiment".
+            table (str): The table to fetch data from. Defaults to "Control".
+            fields (list): The fields to fetch.
+            key (dict): The key used to fetch data.
+            **kwargs: Additional keyword arguments of the fetch.
+
+        Returns:
+            Future: Resolves to the fetched data or to the exception of the read.
+        """
+        return self.read_pool.submit(self._read, schema, table, fields, key, kwargs)
+
+    def _read(self, schema: str, table: str, fields: Optional[List], key: Optional[Dict],
+              kwargs: Dict[str, Any]):
+        """Fetches data in a thread of the read pool on the connection of the thread."""
+        backend = getattr(self.read_backends, "backend", None)
+        if backend is None:
+            backend = self.read_backends.backend = self._connect_backend()
+            self.supervisor.add(backend)
+        return self._get(backend, schema, table, fields, key, **kwargs)
+
+    def prefetch(self, requests: List[Dict[str, Any]]) -> List[Future]:
+        """
+        Starts reads in the read pool so that a later get with the same arguments returns
+        their result without waiting for the database, e.g. the clips of the condition of the
+        next trial during the InterTrial.
+
+        The fields of the key that are not in the table are ignored when a get is matched
+        with a prefetched read, as they are by the fetch. Only the newest prefetch_limit
+        reads that are not taken by a get are kept. Nothing is read unless "prefetch" is set
+        in local_conf.
+
+        Args:
+            requests (list): The keyword arguments of get of each read, e.g.
+                [dict(schema='stimulus', table='Movie.Clip', key=cond, fields=['clip'])].
+
+        Returns:
+            list: The futures of the reads, empty if prefetch is not enabled.
+        """
+        futures = []
+        if not self.prefetch_enabled:
+            return futures
+        for request in requests:
+            signature = self._read_signature(**request)
+            with self.prefetch_lock:
+                future = self.prefetched.pop(signature, None)
+                if future is None:
+                    future = self.get_async(**request)
+                self.prefetched[signature] = future
+                while len(self.prefetched) > self.prefetch_limit:
+                    self.prefetched.pop(next(iter(self.prefetched)))
+            futures.append(future)
+        return futures
+
+    def _take_prefetched(self, schema: str, table: str, fields: Optional[List] = None,
+                         key: Optional[Dict] = None, **kwargs) -> Optional[Future]:
+        """Removes and returns the prefetched read of a get, None if it is not prefetched."""
+        if not self.prefetched:
+            return None
+        signature = self._read_signature(schema, table, fields, key, **kwargs)
+        with self.prefetch_lock:
+            return self.prefetched.pop(signature, None)
+
+    def _read_signature(self, schema='experiment', table='Control',
+                        fields: Optional[List] = None, key: Optional[Dict] = None,
+                        **kwargs) -> str:
+        """Returns the hash of the arguments of a read, the key is restricted to the table."""
+        if isinstance(key, dict):
+            heading = self.get_table_keys(schema, table)
+            key = {name: value for name, value in key.items() if name in heading}
+        return make_hash([schema, table, list(fields or []), key or {}, kwargs])
 
     def get_table_keys(self, schema='experiment', table='Control', 
-                       key: Optional[Dict] = None, key_type=Optional[str]):
+                       key: Optional[Dict] = None, key_type: Optional[str] = None):
         """
         Retrieve the primary key of a specified table within a given schema.
 
@@ -898,12 +2124,13 @@ class Logger:
         Returns:
             list: The primary key of the specified table.
         """
-        if key is None:
-            key = []
-        table = rgetattr(eval(schema), table)
-        if key_type == 'primary':
-            return (table() & key).primary_key
-        return (table() & key).heading.names
+        cache_key = (schema, table, key_type == 'primary')
+        if cache_key not in self._table_keys:
+            if key_type == 'primary':
+                self._table_keys[cache_key] = public_backend.primary_key(schema, table)
+            else:
+                self._table_keys[cache_key] = public_backend.heading(schema, table)
+        return list(self._table_keys[cache_key])
 
     def update_trial_idx(self, trial_idx):
         """
@@ -913,27 +2140,128 @@ class Logger:
         Args:
             trial_idx (int): The new trial index to be updated.
         """
+        self.end_trial()  # the rows that were logged after the end of the previous trial
         self.trial_key['trial_idx'] = trial_idx
         logging.info("\nTrial idx: %s",  self.trial_key['trial_idx'])
+        if self.first_trial_pending:
+            self.first_trial_pending = False
+            cold_start = time.perf_counter() - PROCESS_START
+            SESSION_START_SECONDS.set(cold_start, "first_trial")
+            logging.info("First trial started %.3f s after the start of the process", cold_start)
         if self.thread_exception:
-            self.thread_exception = None
-            raise Exception("Thread exception occurred: %s", self.thread_exception)
-
-    def cleanup(self):
-        """
-        Waits for the logging queue to be empty and signals the logging thread to end.
+            exception, self.thread_exception = self.thread_exception, None
+            raise Exception("Thread exception occurred: %s" % exception) from exception
+
+    def _queue_depths(self) -> Dict[Tuple, int]:
+        """Returns the number of queued items per priority, spilled items have priority -1."""
+        depths = {}
+        queues = {id(queue): queue for queue in [self.queue] + [w.queue for w in self.workers]}
+        for queue in queues.values():
+            with queue.mutex:
+                priorities = [item.priority for item in queue.queue]
+            for priority in priorities:
+                depths[(priority,)] = depths.get((priority,), 0) + 1
+        if self.journal and self.journal.spilled:
+            depths[(-1,)] = self.journal.spilled
+        return depths
+
+    def _writer_backlog(self) -> Dict[Tuple, int]:
+        """Returns the number of values in the queues of the HDF5 writers."""
+        writers = list(self.datasets.values()) + list(self.closing_datasets)
+        return {(): sum(writer.queue.qsize() for writer in writers)}
+
+    def queue_size(self) -> int:
+        """
+        Returns the number of items that are not yet inserted in the database, in the queue,
+        in the queues of the inserter workers, waiting to be retried and kept only in the
+        journal.
+        """
+        size = self.queue.qsize() + (self.journal.spilled if self.journal else 0)
+        size += len(self.retry_items)
+        if len(self.workers) > 1:
+            size += sum(worker.queue.qsize() for worker in self.workers)
+        return size
+
+    def cleanup(self, deadline: Optional[float] = None):
+        """
+        Drains the logging queue and the datasets and signals the logging thread to end.
+
+        The datasets are closed first, so their writers drain and copy their files in the
+        background while the inserter drains the logging queue. The progress is reported
+        every second. It waits at most `deadline` seconds for the queue and the rows of the hot
+        store, and then for the inserter, its workers and the hot store sync to end. The items
+        that are not inserted by then stay in the journal and are inserted at the next start,
+        or without the journal they are written to the dead-letter file. The rows of the hot
+        store that are left are synced at the next start. It returns once the writers of the
+        datasets have finished.
 
-        This method checks if the logging queue is empty, and if not, it waits until it
-        becomes empty. Once the queue is empty, it sets the thread_end event to signal
-        the logging thread to terminate.
-        """
-        while not self.queue.empty() and not self.thread_end.is_set():
-            logging.info('Waiting for empty queue... qsize: %d', self.queue.qsize())
-            time.sleep(1)
+        Args:
+            deadline (float): Seconds to wait for the queue, shutdown_deadline if None.
+        """
+        deadline = self.shutdown_deadline if deadline is None else deadline
+        self.end_trial()
+        self._recover_backpressure(force=True)
+        self.closeDatasets(timeout=0)
+        start, report = time.monotonic(), 0
+        while self.queue_size() and not self.thread_end.is_set():
+            elapsed = time.monotonic() - start
+            if elapsed >= deadline:
+                break
+            if elapsed >= report:
+                report += 1
+                logging.info('Waiting for empty queue... qsize: %d, values to write: %d',
+                             self.queue_size(), self._writer_backlog()[()])
+            time.sleep(0.05)
+        while self.hot_store and not self.thread_end.is_set():
+            if time.monotonic() - start >= deadline or not self.hot_store.pending():
+                break
+            self.hot_sync_request.set()
+            time.sleep(0.05)
         self.thread_end.set()
-
-        if not self.queue.empty():
-            logging.warning('Clean up finished but queue size is: %d', self.queue.qsize())
+        threads = [self.inserter_thread] + [worker.thread for worker in self.workers]
+        threads += [self.hot_sync_thread] if self.hot_store else []
+        for thread in threads:
+            if thread:
+                thread.join(timeout=max(0.0, deadline - (time.monotonic() - start)))
+        self.supervisor.stop()
+        self.read_pool.shutdown(wait=False, cancel_futures=True)
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+
+        if self.queue_size() and self.journal:
+            logging.warning('Clean up finished but queue size is: %d, the items are kept in '
+                            'the journal', self.queue_size())
+        elif self.queue_size():
+            logging.warning('Clean up finished but queue size is: %d, the items are written '
+                            'to %s', self.queue_size(), self.dead_letters.filename)
+            self._dead_letter_queued(TimeoutError("Not inserted before the shutdown deadline"))
+        if self.hot_store and self.hot_store.pending():
+            logging.warning('Clean up finished but %d rows of the hot store are not synced, '
+                            'they are kept in %s', self.hot_store.pending(),
+                            self.hot_store.local.filename)
+        self.closeDatasets()
+
+    def _dead_letter_queued(self, error: Exception) -> None:
+        """Writes the items of the queues and the items that wait to be retried to the
+        dead-letter file."""
+        with self.retry_lock:
+            items = [item for _, _, item in self.retry_items]
+            self.retry_items = []
+        queues = {id(queue): queue for queue in [self.queue] + [w.queue for w in self.workers]}
+        for queue in queues.values():
+            while True:
+                try:
+                    items.append(queue.get_nowait())
+                except Empty:
+                    break
+                queue.task_done()
+        for item in items:
+            try:
+                self.dead_letters.append(item.journal_fields(), error)
+            except Exception as exception:
+                logging.error("Failed to write the dead-letter file: %s", exception)
+                return
 
     def createDataset(
                     self,
@@ -1001,10 +2329,13 @@ class Logger:
         """
         Logs a new recording entry with an incremented recording index.
 
-        This method retrieves the current recordings associated with the trial,
+        This method retrieves the current recordings associated with the session,
         calculates the next recording index (rec_idx) by finding the maximum
         recording index and adding one, and logs the new recording entry with
         the provided recording key (rec_key) and the calculated recording index.
+        The recordings are read from the overlay, so the ones that are still queued are
+        counted, and the last index of the session is kept for the tables that are not in the
+        overlay. The lock keeps concurrent calls from taking the same index.
 
         Args:
         - rec_key (dict): A dictionary containing the key information for the recording entry.
@@ -1012,24 +2343,35 @@ class Logger:
         The method assumes the existence of a `get` method to retrieve existing recordings
         and a `log` method to log the new recording entry.
         """
-        recs = self.get(
-            schema="recording",
-            table="Recording",
-            key=self.trial_key,
-            fields=["rec_idx"],
-        )
-        rec_idx = 1 if not recs else max(recs) + 1
-        self.log('Recording', data={**rec_key, 'rec_idx': rec_idx}, schema='recording')
+        key = {k: self.trial_key[k] for k in SessionOverlay.session_fields}
+        with self.recording_lock:
+            recs = self.get(schema="recording", table="Recording", key=key, fields=["rec_idx"])
+            rec_idx = 1 if np.size(recs) == 0 else int(np.max(recs)) + 1
+            rec_idx = max(rec_idx, self.last_rec_idx.get(tuple(key.values()), 0) + 1)
+            self.last_rec_idx[tuple(key.values())] = rec_idx
+            self.log('Recording', data={**rec_key, 'rec_idx': rec_idx}, schema='recording')
 
-    def closeDatasets(self):
+    def closeDatasets(self, timeout: Optional[float] = None):
         """
         Closes all datasets managed by this instance.
 
-        Iterates through the datasets dictionary, calling the `exit` method on each dataset
-        object to properly close them.
+        All the datasets are closed at once, so their writers write the remaining values and
+        copy the files to the target path in parallel in their own threads.
+
+        Args:
+            timeout (float): Seconds to wait for all the writers to finish, None waits until
+            they finish and 0 returns at once.
         """
-        for _, dataset in self.datasets.items():
-            dataset.exit()
+        self.closing_datasets += self.datasets.values()
+        self.datasets = {}
+        self.diverted = {}
+        for dataset in self.closing_datasets:
+            dataset.exit(timeout=0)
+        start = time.monotonic()
+        for dataset in list(self.closing_datasets):
+            remaining = None if timeout is None else max(0, timeout - (time.monotonic() - start))
+            if dataset.exit(timeout=remaining):
+                self.closing_datasets.remove(dataset)
 
     @staticmethod
     def get_ip():
@@ -1054,6 +2396,50 @@ class Logger:
         return ip
 
 
+@dataclass
+class DegradedPeriod:
+    """
+    A period in which the rows of a table are shed because of the backlog of the Logger.
+
+    Attributes:
+        key (Dict[str, Any]): The animal_id and session of the period.
+        policy (str): "sample", "divert" or "drop".
+        start_time (int): Time from the session start in milliseconds.
+        items (int): Items of the table that were put in the period.
+        rows (int): Rows of these items.
+        kept (int): Rows that went to the queue.
+        filename (str): The HDF5 file of the diverted rows.
+    """
+
+    key: Dict[str, Any]
+    policy: str
+    start_time: int
+    items: int = 0
+    rows: int = 0
+    kept: int = 0
+    filename: Optional[str] = None
+
+
+@dataclass
+class InserterWorker:
+    """
+    An inserter worker with its queue, storage backend and lock.
+
+    Attributes:
+        queue (LaneQueue): The items routed to the worker.
+        backend (DataJointBackend|SQLiteBackend): The storage backend of the worker.
+        lock (Lock): Lock that is held while the worker inserts a batch.
+        pending (Dict[str, int]): Number of routed items per table that are not yet inserted.
+        thread (Thread): The thread of the worker.
+    """
+
+    queue: "LaneQueue"
+    backend: Any
+    lock: Any
+    pending: Dict[str, int] = datafield(default_factory=dict)
+    thread: Optional[threading.Thread] = None
+
+
 @dataclass(order=True)
 class PrioritizedItem:
     table: str = datafield(compare=False)
@@ -1062,8 +2448,108 @@ class PrioritizedItem:
     value: Any = datafield(compare=False, default='')
     schema: str = datafield(compare=False, default='experiment')
     replace: bool = datafield(compare=False, default=False)
+    update: bool = datafield(compare=False, default=False)
     block: bool = datafield(compare=False, default=False)
     validate: bool = datafield(compare=False, default=False)
     priority: int = datafield(default=50)
+    sequence: int = datafield(default=None, repr=False)
     error: bool = datafield(compare=False, default=False)
     ignore_extra_fields: bool = datafield(compare=False, default=True)
+    retries: int = datafield(compare=False, default=0)
+    items: List[Dict[str, Any]] = datafield(compare=False, default=None)
+    journal_id: int = datafield(compare=False, default=None)
+    superseded: List[int] = datafield(compare=False, default=None, repr=False)
+    coalesce_key: Tuple = datafield(compare=False, default=None, repr=False)
+    future: Future = datafield(compare=False, default=None, repr=False)
+
+    @property
+    def rows(self) -> List[Dict[str, Any]]:
+        """The rows of the item, a tuple can be a single row or a list of rows."""
+        return self.tuple if isinstance(self.tuple, list) else [self.tuple]
+
+    @property
+    def journal_ids(self) -> List[int]:
+        """The journal records of the item and of the items that were merged into it."""
+        return [self.journal_id] + (self.superseded or [])
+
+    def journal_fields(self) -> Dict[str, Any]:
+        """Returns the fields of the item that are stored in the journal."""
+        return {
+            f.name: getattr(self, f.name)
+            for f in datafields(self)
+            if f.name not in ("sequence", "journal_id", "superseded", "coalesce_key", "future")
+        }
+
+    def merge(self, item: "PrioritizedItem") -> None:
+        """
+        Merges an item of the same row into this pending item. The newer row replaces the
+        older one, or with update items the newer values are applied over the older ones.
+        The item resolves with this item and its journal records are acknowledged with it.
+        """
+        older, newer = (item, self) if item.sequence < self.sequence else (self, item)
+        self.tuple = newer.tuple if self.replace else {**older.tuple, **newer.tuple}
+        self.superseded = (self.superseded or []) + item.journal_ids
+        self.retries = max(self.retries, item.retries)
+        if item.future and item.future is not self.future:
+            self.future.add_done_callback(functools.partial(_copy_future, item.future))
+
+
+def _copy_future(target: Future, source: Future) -> None:
+    """Resolves a future with the result or the exception of another future."""
+    if target.done():
+        return
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(None)
+
+
+class LaneQueue(PriorityQueue):
+    """
+    A queue of PrioritizedItems with one lane per priority.
+
+    The items leave the queue by priority and in the order they were put within the same
+    priority: each lane numbers its items with a sequence, and an item that is put again
+    (e.g. a retried item) keeps its place. With coalesce, an item with a coalesce_key is merged
+    into the pending item of the same lane and key, so only the newest row is written.
+    """
+
+    def __init__(self, maxsize: int = 0, coalesce: bool = False):
+        self.coalesce = coalesce
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.sequences = {}  # the sequence of each lane by priority
+        self.pending = {}  # the pending items by lane and coalesce key
+        self.merged = []  # the items merged into a pending item, their task is done after put
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        with self.mutex:
+            merged, self.merged = self.merged, []
+        for _ in merged:
+            self.task_done()  # the item leaves with the pending item it was merged into
+
+    def _put(self, item):
+        if item.sequence is None:
+            lane = self.sequences.setdefault(item.priority, itertools.count())
+            item.sequence = next(lane)
+        if self.coalesce and item.coalesce_key is not None:
+            key = (item.priority, item.coalesce_key)
+            pending = self.pending.get(key)
+            if pending is not None:
+                pending.merge(item)
+                COALESCED_ITEMS.inc(item.coalesce_key[0])
+                self.merged.append(item)
+                return
+            self.pending[key] = item
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if item.coalesce_key is not None:
+            key = (item.priority, item.coalesce_key)
+            if self.pending.get(key) is item:
+                del self.pending[key]
+        return item
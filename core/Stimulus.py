@@ -38,6 +38,10 @@ class Stimulus:
         self.curr_cond = curr_cond if stim_period == '' else curr_cond[stim_period]
         self.period = stim_period
 
+    def prefetch(self, curr_cond, stim_period=''):
+        """starts reading the data that prepare needs for a condition, e.g. of the next trial during the intertrial"""
+        pass
+
     def start(self):
         """start stimulus"""
         self.in_operation = True
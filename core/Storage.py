@@ -0,0 +1,1247 @@
+"""
+This module defines the storage backends used by the Logger to save and read data.
+
+DataJointBackend stores the data in the DataJoint (MySQL) database. SQLiteBackend maps the
+DataJoint table definitions of the experiment, behavior, stimulus, interface and recording
+schemas onto a local SQLite file, so that sessions can run without a database server. Sessions
+that were stored locally can be pushed to the DataJoint database later with `upload_session`.
+
+Both backends expose the same methods (insert, update, fetch, fetch1, exists, heading,
+primary_key, tier, full_name, parents, transaction, add_schema, ping, reconnect), which are the
+only way the Logger accesses the data.
+ConnectionSupervisor checks the connections of the backends and reopens them in the background.
+HotStore keeps the rows of the high-rate tables of a setup in a local SQLite file and moves them
+to the central database in large batches in the background.
+LookupCache keeps the rows of the Lookup and Part tables that the Logger reads repeatedly.
+SessionOverlay keeps the rows of the session-scoped tables that the Logger writes, so that reads
+of the session see the rows that are still queued.
+"""
+import copy
+import logging
+import numbers
+import os
+import pickle
+import random
+import re
+import sqlite3
+import threading
+import time as systime
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import datajoint as dj
+import numpy as np
+
+from utils.helper_functions import rgetattr
+
+
+def to_column(values: List[Any]) -> np.ndarray:
+    """Returns a list of fetched values as an array, like DataJoint fetch of a field."""
+    if all(isinstance(value, numbers.Number) and not isinstance(value, bool)
+           for value in values):
+        return np.array(values)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class DataJointBackend:
+    """
+    Storage backend that reads and writes the tables of the DataJoint virtual modules.
+
+    Attributes:
+        modules (Dict[str, dj.VirtualModule]): The virtual modules of the schemas.
+        connection (dj.Connection): The connection of the virtual modules.
+    """
+
+    def __init__(self, modules: Dict[str, Any], connection: dj.Connection):
+        self.modules = modules
+        self.connection = connection
+
+    @property
+    def is_connected(self) -> bool:
+        """bool: True if the connection to the database is open."""
+        return self.connection.is_connected
+
+    def ping(self) -> None:
+        """Raises an exception if the connection to the database is lost."""
+        self.connection.ping()
+
+    def reconnect(self) -> None:
+        """Reopens the connection in place, the virtual modules stay bound to it."""
+        try:
+            self.connection.close()
+        except Exception as error:
+            logging.debug("Failed to close the lost connection: %s", error)
+        self.connection.connect()
+
+    def table(self, schema: str, table: str):
+        """Returns the table class of a table in a schema (e.g. 'Trial.StateOnset')."""
+        return rgetattr(self.modules[schema], table)
+
+    @contextmanager
+    def transaction(self):
+        """Context manager that commits all the inserts in its block in one transaction."""
+        with self.connection.transaction:
+            yield
+
+    def insert(self, schema: str, table: str, rows: List[Dict], replace: bool = False,
+               ignore_extra_fields: bool = True) -> None:
+        """
+        Inserts rows in a table, duplicates are skipped unless replace is True.
+
+        Args:
+            schema (str): The schema of the table.
+            table (str): The name of the table.
+            rows (List[Dict]): The rows to insert.
+            replace (bool): Replace the rows that already exist.
+            ignore_extra_fields (bool): Ignore the fields that are not in the table.
+        """
+        self.table(schema, table).insert(
+            rows,
+            ignore_extra_fields=ignore_extra_fields,
+            skip_duplicates=False if replace else True,
+            replace=replace,
+        )
+
+    def update(self, schema: str, table: str, key: Dict, values: Dict) -> None:
+        """
+        Updates attributes of an existing row in place.
+
+        Args:
+            schema (str): The schema of the table.
+            table (str): The name of the table.
+            key (Dict): The primary key of the row.
+            values (Dict): The attributes to update and their new values.
+        """
+        self.table(schema, table)().update1({**key, **values})
+
+    def fetch(self, schema: str, table: str, key=None, fields=(), **kwargs):
+        """Fetches data from a table restricted by key, like DataJoint fetch."""
+        return (self.table(schema, table)() & (key if key is not None else {})).fetch(
+            *fields, **kwargs
+        )
+
+    def fetch1(self, schema: str, table: str, key=None, fields=(), **kwargs):
+        """Fetches the single row of a table restricted by key, like DataJoint fetch1."""
+        return (self.table(schema, table)() & (key if key is not None else {})).fetch1(
+            *fields, **kwargs
+        )
+
+    def exists(self, schema: str, table: str, key: Dict) -> bool:
+        """Returns True if the table has rows that match the key."""
+        return len(self.table(schema, table)() & key) > 0
+
+    def heading(self, schema: str, table: str) -> List[str]:
+        """Returns the attribute names of a table."""
+        return self.table(schema, table)().heading.names
+
+    def primary_key(self, schema: str, table: str) -> List[str]:
+        """Returns the primary key attributes of a table."""
+        return self.table(schema, table)().primary_key
+
+    def full_name(self, schema: str, table: str) -> str:
+        """Returns the full name of a table in the database (e.g. `lab_experiments`.`trial`)."""
+        return self.table(schema, table)().full_table_name
+
+    def parents(self, schema: str, table: str) -> List[str]:
+        """Returns the full names of the tables that a table references."""
+        self.connection.dependencies.load(force=False)
+        return [name for name in self.table(schema, table)().parents() if not name.isdigit()]
+
+    def tier(self, schema: str, table: str) -> str:
+        """Returns the tier of a table: 'part', 'lookup', 'manual' or 'computed'."""
+        table_class = self.table(schema, table)
+        if issubclass(table_class, dj.Part):
+            return "part"
+        if issubclass(table_class, dj.Lookup):
+            return "lookup"
+        if issubclass(table_class, dj.Manual):
+            return "manual"
+        return "computed"
+
+    def add_schema(self, schema: str, database: str, create: bool = False) -> Any:
+        """
+        Adds a schema to the backend.
+
+        Args:
+            schema (str): The name of the schema (e.g. 'experiment').
+            database (str): The name of the database of the schema.
+            create (bool): Create the schema and its tables if they do not exist.
+
+        Returns:
+            The virtual module of the schema.
+        """
+        self.modules[schema] = dj.create_virtual_module(
+            schema, database, create_tables=create, create_schema=create,
+            connection=self.connection,
+        )
+        return self.modules[schema]
+
+
+class LocalTable:
+    """
+    Definition of a table of the SQLite backend parsed from a DataJoint definition.
+
+    Attributes:
+        name (str): Name of the SQLite table, 'schema.Table' or 'schema.Table.Part'.
+        attributes (Dict[str, str]): The attribute names and their DataJoint types in order.
+        primary_key (List[str]): The primary key attributes.
+        parents (List[str]): The names of the tables that this table references.
+        tier (str): 'lookup', 'manual' or 'part', None for tables without definition.
+    """
+
+    ATTRIBUTE_REGEXP = re.compile(
+        r"^(?P<name>[a-z][a-z\d_]*)\s*(=\s*(?P<default>\S+(\s+\S+)*?)\s*)?:"
+        r"\s*(?P<type>\S.*?)\s*(#.*)?$"
+    )
+
+    def __init__(self, name: str, tier: Optional[str] = None):
+        self.name = name
+        self.tier = tier
+        self.attributes = {}
+        self.defaults = {}
+        self.nullable = set()
+        self.primary_key = []
+        self.parents = []
+
+    @property
+    def blobs(self) -> List[str]:
+        """List[str]: The attributes with a blob type, stored pickled."""
+        return [name for name, dtype in self.attributes.items() if "blob" in dtype]
+
+    def add_attribute(self, name: str, dtype: str, primary: bool, default=None,
+                      nullable=False) -> None:
+        """Adds an attribute to the table if it is not already defined."""
+        if name in self.attributes:
+            return
+        self.attributes[name] = dtype
+        if primary:
+            self.primary_key.append(name)
+        if default is not None:
+            self.defaults[name] = default
+        if nullable:
+            self.nullable.add(name)
+
+    def parse(self, definition: str, resolve) -> None:
+        """
+        Parses a DataJoint definition.
+
+        Args:
+            definition (str): The DataJoint definition of the table.
+            resolve (Callable): Returns the LocalTable of a referenced table name.
+        """
+        primary = True
+        for line in definition.split("\n"):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if re.match(r"^(---+|___+)", line):
+                primary = False
+                continue
+            if line.startswith("->"):
+                parent = resolve(line[2:].split("#")[0].strip())
+                self.parents.append(parent.name)
+                for attr in parent.primary_key:
+                    self.add_attribute(attr, parent.attributes[attr], primary)
+                continue
+            match = self.ATTRIBUTE_REGEXP.match(line)
+            if not match:
+                logging.warning("Cannot parse line '%s' of table %s", line, self.name)
+                continue
+            default = match.group("default")
+            nullable = default is not None and default.lower() == "null"
+            self.add_attribute(
+                match.group("name"), match.group("type"), primary,
+                default=None if nullable else default, nullable=nullable,
+            )
+
+    def sql_type(self, name: str) -> str:
+        """Returns the SQLite type of an attribute."""
+        dtype = self.attributes[name].lower()
+        if "blob" in dtype:
+            return "BLOB"
+        if "int" in dtype.split("(")[0]:
+            return "INTEGER"
+        if dtype.startswith(("float", "double", "decimal", "numeric")):
+            return "REAL"
+        return "TEXT"
+
+    def create_sql(self) -> str:
+        """Returns the CREATE TABLE statement of the table."""
+        columns = []
+        for name in self.attributes:
+            column = f'"{name}" {self.sql_type(name)}'
+            default = self.defaults.get(name)
+            if default is not None:
+                if default.upper() == "CURRENT_TIMESTAMP":
+                    column += " DEFAULT CURRENT_TIMESTAMP"
+                elif default[0] in "'\"":
+                    column += " DEFAULT '%s'" % default[1:-1].replace("'", "''")
+                else:
+                    column += f" DEFAULT {default}"
+            elif name not in self.nullable:
+                column += " NOT NULL"
+            columns.append(column)
+        if self.primary_key:
+            columns.append(
+                "PRIMARY KEY (%s)" % ", ".join(f'"{name}"' for name in self.primary_key)
+            )
+        return f'CREATE TABLE IF NOT EXISTS "{self.name}" ({", ".join(columns)})'
+
+
+class LocalModule:
+    """
+    Stands in for a DataJoint virtual module with the SQLiteBackend.
+
+    The table classes decorated with `schema` are declared in the SQLite file and are
+    available as attributes of the module, like in a virtual module.
+    """
+
+    def __init__(self, name: str, database: str, backend: "SQLiteBackend"):
+        self.__name__ = name
+        self.database = database
+        self._backend = backend
+
+    def schema(self, table_class, context=None):
+        """Decorator that declares a DataJoint table class in the SQLite file."""
+        self._backend.declare(self.__name__, table_class)
+        setattr(self, table_class.__name__, table_class)
+        return table_class
+
+
+class SQLiteBackend:
+    """
+    Storage backend that stores the tables in a local SQLite file.
+
+    The tables are declared from the definitions of the DataJoint table classes, blobs are
+    stored pickled and the contents of Lookup tables are inserted when they are declared.
+    Tables without a definition (e.g. the tables of the recording schema) are created on their
+    first insert with the fields of the inserted rows. Foreign keys are kept only as metadata,
+    so rows can be inserted in any order.
+
+    Attributes:
+        filename (str): The SQLite file.
+        modules (Dict[str, LocalModule]): The modules of the schemas.
+        tables (Dict[str, LocalTable]): The declared tables in declaration order.
+    """
+
+    TABLES = "~tables"  # table with the tier, primary key and parents of the declared tables
+
+    def __init__(self, filename: str, schemata: Dict[str, str]):
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.TABLES}" '
+            "(name TEXT PRIMARY KEY, tier TEXT, primary_key TEXT, parents TEXT)"
+        )
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self.tables = {}
+        self.modules = {}
+        for schema, database in schemata.items():
+            self.add_schema(schema, database)
+        # tables of previous runs, in the order they were created
+        for (name,) in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' ORDER BY rowid"
+        ).fetchall():
+            if name != self.TABLES:
+                self.tables[name] = self._read_table(name)
+
+    @property
+    def is_connected(self) -> bool:
+        """bool: The SQLite file is always available."""
+        return True
+
+    def ping(self) -> None:
+        """The SQLite file is always available."""
+
+    def reconnect(self) -> None:
+        """The SQLite file is always available."""
+
+    def add_schema(self, schema: str, database: str, create: bool = False) -> LocalModule:
+        """Adds a schema to the backend and returns its module."""
+        if schema not in self.modules:
+            self.modules[schema] = LocalModule(schema, database, self)
+        return self.modules[schema]
+
+    def _read_table(self, name: str) -> LocalTable:
+        """Creates the LocalTable of a table that exists in the file."""
+        info = self.connection.execute(
+            f'SELECT tier, parents FROM "{self.TABLES}" WHERE name = ?', (name,)
+        ).fetchone()
+        table = LocalTable(name, info[0] if info else None)
+        if info and info[1]:
+            table.parents = info[1].split(",")
+        for _, column, dtype, _, _, pk in sorted(
+            self.connection.execute(f'PRAGMA table_info("{name}")').fetchall(),
+            key=lambda column_info: column_info[0],
+        ):
+            table.add_attribute(column, "blob" if dtype == "BLOB" else dtype.lower(),
+                                primary=bool(pk))
+        return table
+
+    def _resolve(self, schema: str, reference: str, master: Optional[str] = None) -> LocalTable:
+        """
+        Finds the LocalTable of a table referenced in a definition.
+
+        The reference can be a table of the same schema (e.g. 'Session'), the master of a part
+        table, or a table of another schema (e.g. 'experiment.Trial').
+        """
+        names = [f"{schema}.{reference}"]
+        if master:
+            names.insert(0, f"{schema}.{master}.{reference}")
+        names.append(reference)
+        for name in names:
+            if name in self.tables:
+                return self.tables[name]
+        raise KeyError(f"Table {reference} referenced in schema {schema} is not declared")
+
+    def declare(self, schema: str, table_class, master: Optional[str] = None) -> None:
+        """
+        Declares a DataJoint table class and its part tables in the SQLite file.
+
+        Args:
+            schema (str): The schema of the table.
+            table_class: The DataJoint table class.
+            master (str): The name of the master table if table_class is a part table.
+        """
+        class_name = f"{master}.{table_class.__name__}" if master else table_class.__name__
+        name = f"{schema}.{class_name}"
+        if not hasattr(table_class, "definition") and name in self.tables:
+            # a declared master that is decorated again to add part tables
+            for part in table_class.__dict__.values():
+                if isinstance(part, type) and issubclass(part, dj.Part):
+                    self.declare(schema, part, master=class_name)
+            return
+        if issubclass(table_class, dj.Part):
+            tier = "part"
+        elif issubclass(table_class, dj.Lookup):
+            tier = "lookup"
+        else:
+            tier = "manual"
+        table = LocalTable(name, tier)
+        table.parse(table_class.definition,
+                    lambda reference: self._resolve(schema, reference, master))
+        with self._lock:
+            self.connection.execute(table.create_sql())
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO "{self.TABLES}" VALUES (?, ?, ?, ?)',
+                (name, tier, ",".join(table.primary_key), ",".join(table.parents)),
+            )
+            self.tables.pop(name, None)  # keep the declaration order
+            self.tables[name] = table
+        contents = getattr(table_class, "contents", None)
+        if (issubclass(table_class, dj.Lookup) and contents is not None
+                and not isinstance(contents, property)):
+            rows = [row if isinstance(row, dict) else dict(zip(table.attributes, row))
+                    for row in contents]
+            self._insert(table, rows)
+        for part in table_class.__dict__.values():
+            if isinstance(part, type) and issubclass(part, dj.Part):
+                self.declare(schema, part, master=class_name)
+
+    def table(self, schema: str, table: str) -> LocalTable:
+        """Returns the LocalTable of a table, an empty one if it was never declared."""
+        return self.tables.get(f"{schema}.{table}", LocalTable(f"{schema}.{table}"))
+
+    @contextmanager
+    def transaction(self):
+        """Context manager that commits all the inserts in its block in one transaction."""
+        with self._lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield
+                finally:
+                    self._transaction_depth -= 1
+                return
+            self.connection.execute("BEGIN")
+            self._transaction_depth = 1
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+            finally:
+                self._transaction_depth = 0
+
+    @staticmethod
+    def _to_sql(value, blob: bool):
+        """Converts a value to a type that SQLite can store."""
+        if blob:
+            return None if value is None else pickle.dumps(value)
+        if isinstance(value, np.generic):
+            return value.item()
+        if value is None or isinstance(value, (int, float, str, bytes)):
+            return value
+        if isinstance(value, (datetime, date, time, timedelta)):
+            return str(value)
+        return str(value)
+
+    def _insert(self, table: LocalTable, rows: List[Dict], replace: bool = False) -> None:
+        """
+        Inserts rows in a declared table (called with the lock). Rows with the key of an
+        existing row replace it or are skipped, like skip_duplicates, the other constraint
+        violations (e.g. a missing attribute) raise.
+        """
+        blobs = set(table.blobs)
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row), []).append(row)
+        with self.transaction():
+            for names, group in groups.items():
+                self.connection.executemany(
+                    '%s INTO "%s" (%s) VALUES (%s)%s' % (
+                        "INSERT OR REPLACE" if replace else "INSERT", table.name,
+                        ", ".join(f'"{name}"' for name in names), ", ".join("?" * len(names)),
+                        "" if replace else " ON CONFLICT DO NOTHING",
+                    ),
+                    [[self._to_sql(row[name], name in blobs) for name in names]
+                     for row in group],
+                )
+
+    def insert(self, schema: str, table: str, rows: List[Dict], replace: bool = False,
+               ignore_extra_fields: bool = True) -> None:
+        """
+        Inserts rows in a table, duplicates are skipped unless replace is True.
+
+        Args:
+            schema (str): The schema of the table.
+            table (str): The name of the table.
+            rows (List[Dict]): The rows to insert.
+            replace (bool): Replace the rows that already exist.
+            ignore_extra_fields (bool): Ignore the fields that are not in the table.
+        """
+        name = f"{schema}.{table}"
+        with self._lock:
+            local_table = self.tables.get(name)
+            if local_table is None or local_table.tier is None:
+                local_table = self._extend_table(name, rows)
+            selected = []
+            for row in rows:
+                extra = set(row) - set(local_table.attributes)
+                if extra and not ignore_extra_fields:
+                    raise KeyError(f"`{extra.pop()}` is not in the table heading")
+                selected.append({k: v for k, v in row.items() if k in local_table.attributes})
+            self._insert(local_table, selected, replace=replace)
+
+    def update(self, schema: str, table: str, key: Dict, values: Dict) -> None:
+        """
+        Updates attributes of an existing row in place.
+
+        Args:
+            schema (str): The schema of the table.
+            table (str): The name of the table.
+            key (Dict): The primary key of the row.
+            values (Dict): The attributes to update and their new values.
+        """
+        local_table = self.table(schema, table)
+        if local_table.name not in self.tables:
+            raise dj.DataJointError(f"Table {local_table.name} is not declared")
+        blobs = set(local_table.blobs)
+        where, where_values = self._where(local_table, key)
+        assignments = ", ".join(f'"{name}" = ?' for name in values)
+        with self._lock:
+            self.connection.execute(
+                f'UPDATE "{local_table.name}" SET {assignments}{where}',
+                [self._to_sql(value, name in blobs) for name, value in values.items()]
+                + where_values,
+            )
+
+    def _extend_table(self, name: str, rows: List[Dict]) -> LocalTable:
+        """Creates or adds columns to a table without definition from the fields of rows."""
+        table = self.tables.setdefault(name, LocalTable(name))
+        for row in rows:
+            for field, value in row.items():
+                if field in table.attributes:
+                    continue
+                blob = isinstance(value, (np.ndarray, list, tuple, dict))
+                table.add_attribute(field, "blob" if blob else "", primary=False)
+                if len(table.attributes) == 1:
+                    self.connection.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" ("{field}" '
+                        f'{"BLOB" if blob else ""})'
+                    )
+                else:
+                    self.connection.execute(
+                        f'ALTER TABLE "{name}" ADD COLUMN "{field}" {"BLOB" if blob else ""}'
+                    )
+        return table
+
+    def _where(self, table: LocalTable, key) -> Tuple[str, List]:
+        """Translates a DataJoint restriction (dict, list of dicts or SQL string) to SQL."""
+        if key is None:
+            return "", []
+        if isinstance(key, str):
+            return f" WHERE {key}", []
+        if isinstance(key, dict):
+            key = [key]
+        if not isinstance(key, (list, tuple)):
+            raise TypeError(f"Restriction {type(key)} is not supported by the SQLite backend")
+        if not key:
+            return " WHERE 0", []
+        blobs = set(table.blobs)
+        conditions, values = [], []
+        for restriction in key:
+            names = [name for name in restriction
+                     if name in table.attributes and name not in blobs]
+            if not names:
+                return "", []
+            conditions.append(" AND ".join(f'"{name}" = ?' for name in names))
+            values += [self._to_sql(restriction[name], False) for name in names]
+        return " WHERE " + " OR ".join(f"({condition})" for condition in conditions), values
+
+    def _select(self, schema: str, table: str, key, fields, order_by=None, limit=None,
+                offset=None) -> Tuple[List[str], List[Dict]]:
+        """Selects rows of a table and returns the fetched fields and the rows as dicts."""
+        local_table = self.table(schema, table)
+        fields = list(fields) or list(local_table.attributes)
+        if local_table.name not in self.tables:
+            return fields, []
+        where, values = self._where(local_table, key)
+        sql = 'SELECT %s FROM "%s"%s' % (
+            ", ".join(f'"{field}"' for field in fields), local_table.name, where)
+        if order_by:
+            order_by = [order_by] if isinstance(order_by, str) else list(order_by)
+            order_by = [", ".join(local_table.primary_key) if item == "KEY" else item
+                        for item in order_by]
+            sql += " ORDER BY " + ", ".join(order_by)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+            if offset:
+                sql += f" OFFSET {int(offset)}"
+        with self._lock:
+            result = self.connection.execute(sql, values).fetchall()
+        blobs = set(local_table.blobs)
+        rows = [{field: pickle.loads(value) if field in blobs and value is not None else value
+                 for field, value in zip(fields, row)} for row in result]
+        return fields, rows
+
+    def fetch(self, schema: str, table: str, key=None, fields=(), as_dict=False,
+              order_by=None, limit=None, offset=None, **kwargs):
+        """
+        Fetches data from a table restricted by key, like DataJoint fetch.
+
+        Returns:
+            A list of dicts if as_dict is True, an array for a single field, a tuple of arrays
+            for multiple fields, or a structured array with all the fields.
+        """
+        names, rows = self._select(schema, table, key, fields, order_by, limit, offset)
+        if as_dict:
+            return rows
+        if fields:
+            columns = tuple(to_column([row[field] for row in rows]) for field in names)
+            return columns[0] if len(columns) == 1 else columns
+        result = np.empty(len(rows), dtype=[(name, object) for name in names])
+        for idx, row in enumerate(rows):
+            result[idx] = tuple(row[name] for name in names)
+        return result
+
+    def fetch1(self, schema: str, table: str, key=None, fields=(), **kwargs):
+        """Fetches the single row of a table restricted by key, like DataJoint fetch1."""
+        names, rows = self._select(schema, table, key, fields)
+        if len(rows) != 1:
+            raise dj.DataJointError(
+                f"fetch1 should only return one tuple. {len(rows)} tuples found"
+            )
+        if not fields:
+            return rows[0]
+        values = tuple(rows[0][name] for name in names)
+        return values[0] if len(values) == 1 else values
+
+    def exists(self, schema: str, table: str, key: Dict) -> bool:
+        """Returns True if the table has rows that match the key."""
+        return bool(self._select(schema, table, key, [], limit=1)[1])
+
+    def heading(self, schema: str, table: str) -> List[str]:
+        """Returns the attribute names of a table."""
+        return list(self.table(schema, table).attributes)
+
+    def primary_key(self, schema: str, table: str) -> List[str]:
+        """Returns the primary key attributes of a table."""
+        return list(self.table(schema, table).primary_key)
+
+    def full_name(self, schema: str, table: str) -> str:
+        """Returns the name of the SQLite table of a table."""
+        return f"{schema}.{table}"
+
+    def parents(self, schema: str, table: str) -> List[str]:
+        """Returns the names of the tables that a table references."""
+        return list(self.table(schema, table).parents)
+
+    def tier(self, schema: str, table: str) -> Optional[str]:
+        """Returns the tier of a table: 'part', 'lookup', 'manual' or None if undeclared."""
+        return self.table(schema, table).tier
+
+    def upload(self, target: DataJointBackend, key: Dict[str, Any],
+               batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Pushes the rows of a session into the DataJoint database.
+
+        Tables are uploaded in declaration order, so parents are inserted before the tables
+        that reference them. Tables with the session attributes are restricted to the session,
+        the rest (e.g. the condition tables) are uploaded whole. Lookup tables are skipped,
+        because the DataJoint database is where they are configured. Existing rows are skipped.
+
+        Args:
+            target (DataJointBackend): The backend of the DataJoint database.
+            key (Dict[str, Any]): The key of the session (e.g. animal_id and session).
+            batch_size (int): The number of rows inserted in each transaction.
+
+        Returns:
+            Dict[str, int]: The number of uploaded rows of each table.
+        """
+        uploaded = {}
+        for name, table in list(self.tables.items()):
+            if table.tier == "lookup" or (table.tier == "part" and self._is_lookup_part(name)):
+                continue
+            schema, table_name = name.split(".", 1)
+            try:
+                target.table(schema, table_name)
+            except (AttributeError, KeyError):
+                logging.warning("Table %s does not exist in the database, not uploaded", name)
+                continue
+            restriction = {k: v for k, v in key.items() if k in table.attributes}
+            rows = self.fetch(schema, table_name, restriction or None, as_dict=True)
+            for idx in range(0, len(rows), batch_size):
+                with target.transaction():
+                    target.insert(schema, table_name, rows[idx:idx + batch_size])
+            uploaded[name] = len(rows)
+            logging.info("Uploaded %d rows of %s", len(rows), name)
+        return uploaded
+
+    def count(self, name: str) -> int:
+        """Returns the number of rows of a table."""
+        with self._lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+
+    def take(self, name: str, limit: int) -> Tuple[List[int], List[Dict]]:
+        """Returns the rowids and the first rows of a table in insertion order."""
+        table = self.tables[name]
+        fields, blobs = list(table.attributes), set(table.blobs)
+        with self._lock:
+            result = self.connection.execute(
+                'SELECT rowid, %s FROM "%s" ORDER BY rowid LIMIT ?' % (
+                    ", ".join(f'"{field}"' for field in fields), name), (limit,)
+            ).fetchall()
+        rows = [{field: pickle.loads(value) if field in blobs and value is not None else value
+                 for field, value in zip(fields, row[1:])} for row in result]
+        return [row[0] for row in result], rows
+
+    def discard(self, name: str, rowid: int) -> None:
+        """Deletes the rows of a table up to a rowid."""
+        with self._lock:
+            self.connection.execute(f'DELETE FROM "{name}" WHERE rowid <= ?', (rowid,))
+
+    def _is_lookup_part(self, name: str) -> bool:
+        """Returns True if a part table belongs to a Lookup master table."""
+        master = self.tables.get(name.rsplit(".", 1)[0])
+        return master is not None and master.tier == "lookup"
+
+
+def upload_session(filename: str, schemata: Dict[str, str], key: Dict[str, Any],
+                   batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Pushes a session stored in a SQLite file into the DataJoint database.
+
+    Args:
+        filename (str): The SQLite file of the session.
+        schemata (Dict[str, str]): The schema names and their databases.
+        key (Dict[str, Any]): The key of the session (e.g. animal_id and session).
+        batch_size (int): The number of rows inserted in each transaction.
+
+    Returns:
+        Dict[str, int]: The number of uploaded rows of each table.
+    """
+    from utils.helper_functions import create_virtual_modules
+
+    modules, connection = create_virtual_modules(schemata, create_tables=False,
+                                                 create_schema=False)
+    local = SQLiteBackend(filename, schemata)
+    return local.upload(DataJointBackend(modules, connection), key, batch_size)
+
+
+class ConnectionSupervisor:
+    """
+    Checks the connections of the backends and reopens them in the background.
+
+    The probe backend is pinged every `check_period` seconds and when a user of the backends
+    reports a connection error. When it is lost, `connected` is cleared and the supervisor
+    thread tries to reopen the probe with exponential backoff and jitter. Once the probe is
+    open again, the connections of all the added backends are reopened in place, so the
+    virtual modules that use them stay bound to them, and `connected` is set. The threads that
+    use the backends check `connected` instead of waiting for the database.
+    While the probe is connected the added backends are checked too: the backends that have a
+    lock are pinged when their lock is free, and a backend whose user reported an error is
+    pinged at once. A backend that does not answer is reopened alone, and if it cannot be
+    reopened the database is treated as lost.
+
+    Attributes:
+        probe: The backend that is pinged, it is not used for anything else.
+        check_period (float): Seconds between the checks of the connection.
+        retry_delay (float): Seconds before the first reconnection attempt.
+        retry_max_delay (float): Maximum seconds between reconnection attempts.
+        on_reconnect (Callable): Called in the supervisor thread after a reconnection.
+        connected (threading.Event): Set while the database is reachable.
+    """
+
+    def __init__(self, probe, check_period: float = 5, retry_delay: float = 1,
+                 retry_max_delay: float = 60, on_reconnect=None):
+        self.probe = probe
+        self.check_period = check_period
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.on_reconnect = on_reconnect
+        self.connected = threading.Event()
+        self.connected.set()
+        self._backends = []  # (backend, lock that is held while it is reopened)
+        self._reported = []  # backends whose user reported a connection error
+        self._lock = threading.Lock()
+        self._check_request = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, backend, lock=None) -> None:
+        """
+        Adds a backend whose connection is reopened after a reconnection.
+
+        Args:
+            backend: The backend.
+            lock: A lock that its user holds while it uses the backend, it is held while the
+                connection is reopened.
+        """
+        with self._lock:
+            if all(backend is not added for added, _ in self._backends):
+                self._backends.append((backend, lock))
+
+    def report_lost(self, backend=None) -> None:
+        """
+        Requests a check of the connections, e.g. after a query failed with a lost connection.
+
+        Args:
+            backend: The backend of the query that failed, it is pinged and reopened if needed.
+        """
+        if backend is not None:
+            with self._lock:
+                if all(backend is not reported for reported in self._reported):
+                    self._reported.append(backend)
+        self._check_request.set()
+
+    def start(self) -> None:
+        """Starts the supervisor thread."""
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the supervisor thread."""
+        self._stop.set()
+        self._check_request.set()
+
+    def _run(self) -> None:
+        delay, lost_time = self.retry_delay, None
+        while not self._stop.is_set():
+            if self.connected.is_set():
+                self._check_request.wait(self.check_period)
+                self._check_request.clear()
+                if self._stop.is_set() or self._check():
+                    continue
+                self.connected.clear()
+                delay, lost_time = self.retry_delay, systime.monotonic()
+                logging.warning("The connection to the database is lost, reconnecting in the "
+                                "background")
+            elif not self._stop.wait(delay / 2 + random.uniform(0, delay / 2)):
+                if self._reconnect():
+                    self.connected.set()
+                    logging.info("Reconnected to the database after %.1f s",
+                                 systime.monotonic() - lost_time)
+                    if self.on_reconnect:
+                        self.on_reconnect()
+                else:
+                    delay = min(self.retry_max_delay, delay * 2)
+
+    def _check(self) -> bool:
+        """
+        Pings the probe and the backends that can be checked, reopens the backends that do not
+        answer, and returns True if the probe and all of them are connected.
+        """
+        try:
+            self.probe.ping()
+        except Exception as error:
+            logging.debug("Ping of the database failed: %s", error)
+            return False
+        with self._lock:
+            backends, reported, self._reported = list(self._backends), self._reported, []
+        for backend, lock in backends:
+            if any(backend is reported_backend for reported_backend in reported):
+                with lock or nullcontext():
+                    checked = self._check_backend(backend)
+            elif lock is not None and lock.acquire(blocking=False):
+                try:
+                    checked = self._check_backend(backend)
+                finally:
+                    lock.release()
+            else:
+                continue  # it is in use or has no lock, its user reports the errors
+            if not checked:
+                return False
+        return True
+
+    @staticmethod
+    def _check_backend(backend) -> bool:
+        """Pings a backend and reopens its connection if it is lost, True if it is connected."""
+        try:
+            backend.ping()
+        except Exception as error:
+            logging.warning("A connection to the database is lost, reopening it: %s", error)
+            try:
+                backend.reconnect()
+                backend.ping()
+            except Exception as reconnect_error:
+                logging.debug("Reopening the connection failed: %s", reconnect_error)
+                return False
+        return True
+
+    def _reconnect(self) -> bool:
+        """Reopens the probe and then the connections of the backends, True on success."""
+        try:
+            self.probe.reconnect()
+            self.probe.ping()
+            with self._lock:
+                backends = list(self._backends)
+            for backend, lock in backends:
+                with lock or nullcontext():
+                    backend.reconnect()
+        except Exception as error:
+            logging.debug("Reconnection to the database failed: %s", error)
+            return False
+        return True
+
+
+class HotStore:
+    """
+    Local store of the high-rate tables of a setup that are synced to the central database.
+
+    Inserting in the local SQLite file takes a fraction of a millisecond and does not wait for
+    the network. sync moves the rows to the target backend in large batches, table by table
+    in the order the tables were created, so that master tables (e.g. Activity) come before
+    their part tables, and deletes them from the file once they are committed. The rows of an
+    interrupted sync that were already committed are skipped as duplicates, the rows that are
+    left in the file are synced at the next start.
+
+    Attributes:
+        local (SQLiteBackend): The local file.
+    """
+
+    def __init__(self, filename: str, schemata: Dict[str, str]):
+        self.local = SQLiteBackend(filename, schemata)
+        self._sync_lock = threading.Lock()
+
+    def insert(self, schema: str, table: str, rows: List[Dict],
+               ignore_extra_fields: bool = True) -> None:
+        """Inserts rows in the local file."""
+        self.local.insert(schema, table, rows, ignore_extra_fields=ignore_extra_fields)
+
+    def pending(self) -> int:
+        """Returns the number of rows that are not yet synced."""
+        return sum(self.local.count(name) for name in list(self.local.tables))
+
+    def sync(self, target: DataJointBackend, batch_size: int = 5000,
+             ready: Optional[Callable[[Dict], bool]] = None) -> int:
+        """
+        Moves the rows of the local file to the target backend.
+
+        Args:
+            target (DataJointBackend): The backend of the central database.
+            batch_size (int): The number of rows inserted in each transaction.
+            ready (Callable, optional): Checks if a row can be synced (e.g. its trial is
+                committed), the rows of a table from the first row that is not ready on stay
+                in the file until the next sync.
+
+        Returns:
+            int: The number of synced rows.
+        """
+        synced = 0
+        with self._sync_lock:
+            for name in list(self.local.tables):
+                schema, table = name.split(".", 1)
+                while True:
+                    rowids, rows = self.local.take(name, batch_size)
+                    if ready is not None:
+                        count = next((n for n, row in enumerate(rows) if not ready(row)), len(rows))
+                        rowids, rows = rowids[:count], rows[:count]
+                    if not rows:
+                        break
+                    with target.transaction():
+                        target.insert(schema, table, rows)
+                    self.local.discard(name, rowids[-1])
+                    synced += len(rows)
+                    if len(rows) < batch_size:
+                        break
+        return synced
+
+
+class LookupCache:
+    """
+    Cache of the rows of Lookup and Part tables read through the Logger.
+
+    The rows of a table are cached per restriction, a restriction is a string or the items of
+    a dict key that are attributes of the table (DataJoint ignores the rest). A cached
+    restriction also serves the restrictions that extend it with more attribute values, so
+    the rows of a whole configuration (e.g. setup_conf_idx=0) that are prefetched serve the
+    reads of the individual ports. Cached rows expire after `ttl` seconds, but are still
+    served while the database cannot be read, and the rows of a table are dropped when the
+    Logger inserts in it.
+
+    Attributes:
+        ttl (float): Time in seconds that cached rows are valid.
+        exclude (List[str]): Tables ('schema.Table') that are never cached.
+    """
+
+    TIERS = ("lookup", "part")
+    ORDER_BY_REGEXP = re.compile(r"^(?P<field>[a-z][a-z\d_]*)(\s+(?P<order>asc|desc))?$", re.I)
+
+    def __init__(self, ttl: float, exclude: Optional[List[str]] = None):
+        self.ttl = ttl
+        self.exclude = set(exclude or [])
+        self._lock = threading.Lock()
+        self._rows = {}  # (schema, table) -> {restriction: (fetch time, rows)}
+        self._info = {}  # (schema, table) -> (is cacheable, attribute names)
+
+    def _table_info(self, backend, schema: str, table: str) -> Tuple[bool, List[str]]:
+        """
+        Returns if a table can be cached and its attributes, read once per table. Without a
+        backend a table that was not read before cannot be cached.
+        """
+        if (schema, table) not in self._info:
+            if backend is None:
+                return False, []
+            cacheable = (
+                self.ttl > 0
+                and f"{schema}.{table}" not in self.exclude
+                and backend.tier(schema, table) in self.TIERS
+            )
+            heading = backend.heading(schema, table) if cacheable else []
+            self._info[(schema, table)] = (cacheable, heading)
+        return self._info[(schema, table)]
+
+    def restriction(self, backend, schema: str, table: str, key) -> Optional[Any]:
+        """
+        Returns the hashable restriction of a key, None if the read cannot be cached.
+
+        Args:
+            backend: The backend of the table, None if the database cannot be read.
+            schema (str): The schema of the table.
+            table (str): The name of the table.
+            key: The restriction of the read, a dict or a string.
+        """
+        cacheable, heading = self._table_info(backend, schema, table)
+        if not cacheable:
+            return None
+        if isinstance(key, str):
+            return key
+        if not isinstance(key, dict):
+            return None
+        restriction = frozenset((k, v) for k, v in key.items() if k in heading)
+        try:
+            hash(restriction)
+        except TypeError:
+            return None
+        return restriction
+
+    def get(self, schema: str, table: str, restriction,
+            stale: bool = False) -> Optional[List[Dict]]:
+        """
+        Returns the cached rows of a restriction, None if they are not cached.
+
+        A dict restriction is also served from a cached restriction that is a subset of it,
+        by filtering the cached rows with the remaining numeric or string values. Expired
+        rows are kept until they are replaced and only served if stale is True, e.g. while the
+        database cannot be read.
+        """
+        now = systime.time()
+        with self._lock:
+            entries = {cached: entry
+                       for cached, entry in self._rows.get((schema, table), {}).items()
+                       if stale or now - entry[0] <= self.ttl}
+            if restriction in entries:
+                return entries[restriction][1]
+            if isinstance(restriction, str):
+                return None
+            for cached, (_, rows) in entries.items():
+                if isinstance(cached, str) or not cached <= restriction:
+                    continue
+                residual = restriction - cached
+                if all(isinstance(v, (numbers.Number, str)) for _, v in residual):
+                    return [row for row in rows if all(row[k] == v for k, v in residual)]
+        return None
+
+    def put(self, schema: str, table: str, restriction, rows: List[Dict]) -> None:
+        """Caches the rows of a restriction."""
+        with self._lock:
+            self._rows.setdefault((schema, table), {})[restriction] = (systime.time(), rows)
+
+    def invalidate(self, schema: Optional[str] = None, table: Optional[str] = None) -> None:
+        """
+        Drops the cached rows of a table, of all the tables of a schema or of all the tables.
+
+        Args:
+            schema (str): The schema of the table, None for all the schemas.
+            table (str): The name of the table, None for all the tables of the schema.
+        """
+        with self._lock:
+            if schema is None:
+                self._rows.clear()
+            elif table is None:
+                for name in [name for name in self._rows if name[0] == schema]:
+                    del self._rows[name]
+            else:
+                self._rows.pop((schema, table), None)
+
+    @classmethod
+    def can_format(cls, fields, as_dict: bool = False, order_by=None, **kwargs) -> bool:
+        """Returns True if `format` can produce the output of a fetch with these arguments."""
+        if kwargs or not (fields or as_dict):
+            return False  # structured arrays, limits etc. are fetched from the database
+        if order_by is None:
+            return True
+        order_by = [order_by] if isinstance(order_by, str) else list(order_by)
+        return all(cls.ORDER_BY_REGEXP.match(item) and item.upper() != "KEY"
+                   for item in order_by)
+
+    @classmethod
+    def format(cls, rows: List[Dict], fields, as_dict: bool = False, order_by=None):
+        """
+        Formats cached rows like DataJoint fetch.
+
+        Returns:
+            A list of dicts if as_dict is True, an array for a single field or a tuple of
+            arrays for multiple fields. The values are copies of the cached values.
+        """
+        if order_by is not None:
+            order_by = [order_by] if isinstance(order_by, str) else list(order_by)
+            for item in reversed(order_by):
+                match = cls.ORDER_BY_REGEXP.match(item)
+                rows = sorted(rows, key=lambda row: row[match["field"]],
+                              reverse=(match["order"] or "").lower() == "desc")
+        names = list(fields) or (list(rows[0]) if rows else [])
+        if as_dict:
+            return [{name: copy.deepcopy(row[name]) for name in names} for row in rows]
+        columns = tuple(to_column([copy.deepcopy(row[name]) for row in rows])
+                        for name in names)
+        return columns[0] if len(columns) == 1 else columns
+
+
+class SessionOverlay:
+    """
+    The rows of the session-scoped tables that the Logger writes, by session.
+
+    The rows of a table and session are read once from the database, then every row that the
+    Logger puts in the table is applied here when it is queued. The reads of the session are
+    served from memory and see the rows that are still in the queue, e.g. the rec_idx of the
+    recordings of the session. Rows are stored with the attributes of the table only.
+
+    Attributes:
+        session_fields (Tuple[str]): The attributes that identify a session.
+    """
+
+    session_fields = ("animal_id", "session")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}  # (schema, table) -> (attribute names, primary key)
+        self._rows = {}  # (schema, table, session) -> {primary key values: row}
+        self._queued = {}  # the rows of the sessions that are not yet loaded
+
+    @property
+    def tables(self) -> List[Tuple[str, str]]:
+        """The tables of the overlay as (schema, table)."""
+        return list(self._tables)
+
+    def add_table(self, schema: str, table: str, heading: List[str],
+                  primary_key: List[str]) -> bool:
+        """
+        Adds a table to the overlay if its primary key has the session_fields.
+
+        Returns:
+            bool: True if the table was added.
+        """
+        if not set(self.session_fields) <= set(primary_key):
+            return False
+        self._tables[(schema, table)] = (list(heading), list(primary_key))
+        return True
+
+    def session(self, schema: str, table: str, key) -> Optional[Tuple]:
+        """Returns the session of a dict key of a table of the overlay, None otherwise."""
+        if (schema, table) not in self._tables or not isinstance(key, dict):
+            return None
+        if not all(field in key for field in self.session_fields):
+            return None
+        return tuple(key[field] for field in self.session_fields)
+
+    def is_loaded(self, schema: str, table: str, session: Tuple) -> bool:
+        """Returns True if the rows of a session were read from the database."""
+        return (schema, table, session) in self._rows
+
+    def load(self, schema: str, table: str, session: Tuple, rows: List[Dict]) -> None:
+        """Sets the rows of a session that are in the database, before the queued rows."""
+        heading, primary_key = self._tables[(schema, table)]
+        loaded = {tuple(row[k] for k in primary_key): {k: row[k] for k in heading if k in row}
+                  for row in rows}
+        with self._lock:
+            loaded.update(self._queued.pop((schema, table, session), {}))
+            self._rows[(schema, table, session)] = loaded
+
+    def apply(self, schema: str, table: str, rows: List[Dict], replace: bool = False,
+              update: bool = False) -> None:
+        """
+        Applies rows that are put in a table of the overlay, like the database will when they
+        are inserted: existing rows are kept unless replace, update items change the given
+        attributes. Rows of a session that is not yet loaded are kept until it is.
+        """
+        if (schema, table) not in self._tables:
+            return
+        heading, primary_key = self._tables[(schema, table)]
+        with self._lock:
+            for row in rows:
+                session = self.session(schema, table, row)
+                if session is None or not all(k in row for k in primary_key):
+                    continue
+                session_rows = self._rows.get((schema, table, session))
+                if session_rows is None:
+                    session_rows = self._queued.setdefault((schema, table, session), {})
+                pk = tuple(row[k] for k in primary_key)
+                values = {k: row[k] for k in heading if k in row}
+                if update:
+                    if pk in session_rows:
+                        session_rows[pk] = {**session_rows[pk], **values}
+                elif replace or pk not in session_rows:
+                    session_rows[pk] = values
+
+    def get(self, schema: str, table: str, key: Dict) -> Optional[List[Dict]]:
+        """Returns the rows of a loaded session that match a dict key, None if not loaded."""
+        session = self.session(schema, table, key)
+        if session is None:
+            return None
+        heading = self._tables[(schema, table)][0]
+        restriction = {k: v for k, v in key.items() if k in heading}
+        with self._lock:
+            rows = self._rows.get((schema, table, session))
+            if rows is None:
+                return None
+            return [row for row in rows.values()
+                    if all(row.get(k) == v for k, v in restriction.items())]
+
+    def clear(self) -> None:
+        """Drops the rows of all the sessions."""
+        with self._lock:
+            self._rows.clear()
+            self._queued.clear()
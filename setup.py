@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='EthoPy',
     version='0.1',
-    install_requires=['datajoint', 'pygame', 'panda3D', 'numpy', 'scipy'],
+    install_requires=['datajoint>=0.14,<0.15', 'pygame', 'panda3D', 'numpy', 'scipy'],
     url='https://github.com/ef-lab/EthoPy',
     license='',
     author='Emmanouil Froudarakis',
@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+import tempfile
+
+import datajoint as dj
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.Storage import SQLiteBackend  # noqa: E402
+
+SCHEMATA = {"experiment": "lab_experiments"}
+
+# the Logger reads local_conf.json and the conf folder from the working directory when it is
+# imported, the tests store the data in a temporary SQLite file
+WORKDIR = tempfile.mkdtemp(prefix="ethopy-tests-")
+with open(os.path.join(WORKDIR, "local_conf.json"), "w", encoding="utf-8") as conf_file:
+    json.dump({
+        "dj_local_conf": {"datajoint.loglevel": "WARNING"},
+        "SCHEMATA": {"experiment": "lab_experiments", "behavior": "lab_behavior",
+                     "stimulus": "lab_stimuli", "interface": "lab_interface",
+                     "recording": "lab_recordings", "mice": "lab_mice"},
+        "source_path": os.path.join(WORKDIR, "source/"),
+        "target_path": False,
+        "log_level": "WARNING",
+        "storage": "sqlite",
+        "sqlite_path": os.path.join(WORKDIR, "ethopy.sqlite"),
+    }, conf_file)
+os.symlink(os.path.join(ROOT, "conf"), os.path.join(WORKDIR, "conf"))
+os.chdir(WORKDIR)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "ethopy.sqlite"), SCHEMATA)
+    schema = backend.modules["experiment"].schema
+
+    @schema
+    class Session(dj.Manual):
+        definition = """
+        animal_id            : int
+        session              : smallint
+        ---
+        experiment_type      : varchar(128)
+        notes=null           : varchar(256)
+        """
+
+        class Task(dj.Part):
+            definition = """
+            -> Session
+            ---
+            task_name            : varchar(256)
+            """
+
+    @schema
+    class Port(dj.Lookup):
+        definition = """
+        port                 : tinyint
+        setup_conf_idx       : tinyint
+        ---
+        position             : varchar(16)
+        """
+        contents = [[1, 0, "left"], [2, 0, "right"], [1, 1, "center"]]
+
+    @schema
+    class Clip(dj.Manual):
+        definition = """
+        clip_idx             : int
+        ---
+        clip                 : longblob
+        """
+
+    return backend
+
+
+@pytest.fixture
+def logger_config(tmp_path, monkeypatch):
+    """The config of the Logger module, with the files of the Logger in tmp_path."""
+    from core import Logger
+
+    monkeypatch.setitem(Logger.config, "source_path", str(tmp_path) + "/")
+    monkeypatch.setitem(Logger.config, "insert_permanent_retries", 0)
+    return Logger.config
+
+
+@pytest.fixture
+def logger(logger_config):
+    from core.Logger import Logger
+
+    logger = Logger()
+    yield logger
+    logger.cleanup(deadline=1)
+
+
+@pytest.fixture
+def make_logger(logger_config, monkeypatch):
+    """Creates Loggers with the given config, they are cleaned up after the test."""
+    from core.Logger import Logger
+
+    loggers = []
+
+    def make(**config):
+        for name, value in config.items():
+            monkeypatch.setitem(logger_config, name, value)
+        loggers.append(Logger())
+        return loggers[-1]
+
+    yield make
+    for logger in loggers:
+        logger.cleanup(deadline=1)
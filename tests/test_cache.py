@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from core.Storage import LookupCache
+
+
+def test_cache_serves_subsets_of_cached_restrictions(backend):
+    cache = LookupCache(ttl=60)
+    restriction = cache.restriction(backend, "experiment", "Port", dict(setup_conf_idx=0))
+    cache.put("experiment", "Port", restriction,
+              backend.fetch("experiment", "Port", dict(setup_conf_idx=0), as_dict=True))
+    port = cache.restriction(backend, "experiment", "Port",
+                             dict(setup_conf_idx=0, port=2, animal_id=5))
+    assert cache.get("experiment", "Port", port) == [
+        dict(port=2, setup_conf_idx=0, position="right")]
+    assert cache.restriction(backend, "experiment", "Session", dict(animal_id=1)) is None
+
+
+def test_expired_rows_are_not_served(backend):
+    cache = LookupCache(ttl=0.01)
+    restriction = cache.restriction(backend, "experiment", "Port", dict(setup_conf_idx=1))
+    cache.put("experiment", "Port", restriction, [dict(port=1)])
+    assert cache.get("experiment", "Port", restriction) == [dict(port=1)]
+    time.sleep(0.02)
+    assert cache.get("experiment", "Port", restriction) is None
+
+
+def test_cache_invalidation(backend):
+    cache = LookupCache(ttl=60)
+    restriction = cache.restriction(backend, "experiment", "Port", dict(setup_conf_idx=1))
+    cache.put("experiment", "Port", restriction, [dict(port=1)])
+    cache.invalidate("experiment", "Port")
+    assert cache.get("experiment", "Port", restriction) is None
+
+
+def test_cache_format_matches_fetch(backend):
+    rows = backend.fetch("experiment", "Port", as_dict=True)
+    for kwargs in (dict(fields=["position"]), dict(fields=["port", "position"]),
+                   dict(fields=[], as_dict=True), dict(fields=["port"], order_by="port desc")):
+        expected = backend.fetch("experiment", "Port", **kwargs)
+        formatted = LookupCache.format(rows, **kwargs)
+        if isinstance(expected, tuple):
+            for column, expected_column in zip(formatted, expected):
+                np.testing.assert_array_equal(column, expected_column)
+        elif kwargs.get("as_dict"):
+            assert formatted == expected
+        else:
+            np.testing.assert_array_equal(formatted, expected)
+    assert not LookupCache.can_format([], limit=1)
+    assert not LookupCache.can_format(["port"], order_by="KEY")
+
+
+def test_expired_rows_are_only_served_stale(backend):
+    cache = LookupCache(ttl=0.01)
+    restriction = cache.restriction(backend, "experiment", "Port", dict(setup_conf_idx=1))
+    cache.put("experiment", "Port", restriction, [dict(port=1)])
+    time.sleep(0.02)
+    assert cache.get("experiment", "Port", restriction) is None
+    assert cache.get("experiment", "Port", restriction, stale=True) == [dict(port=1)]
+    assert cache.restriction(None, "experiment", "Port", dict(port=1)) is not None
+    assert cache.restriction(None, "experiment", "Clip", dict(clip_idx=1)) is None
+
+
@@ -0,0 +1,82 @@
+import itertools
+
+from core.Experiment import ExperimentClass
+from utils.helper_functions import factorize
+
+
+def test_conditions_can_be_pushed_from_a_generator():
+    exp = ExperimentClass()
+    exp.params = dict()
+    conditions = [dict(difficulty=difficulty, response_port=port) for difficulty in (1, 2) for port in (1, 2)]
+    exp.push_conditions(cond for cond in conditions)
+    assert exp.conditions == conditions
+    assert len(exp.choices) == 4
+    assert exp.curr_cond in conditions[:2]
+
+
+class TrialLogger:
+    def __init__(self, enabled):
+        self.trial_transactions = self.hot_store = self.prefetch_enabled = enabled
+        self.calls = []
+
+    def end_trial(self):
+        self.calls.append("end_trial")
+
+    def sync_hot_store(self):
+        self.calls.append("sync_hot_store")
+
+
+def test_trial_end_runs_only_the_enabled_features(monkeypatch):
+    exp = ExperimentClass()
+    monkeypatch.setattr(exp, "prefetch_next_trial", lambda: exp.logger.calls.append("prefetch"))
+    exp.logger = TrialLogger(enabled=False)
+    exp.end_trial()
+    assert exp.logger.calls == []
+
+    exp.logger = TrialLogger(enabled=True)
+    exp.end_trial()
+    assert exp.logger.calls == ["end_trial", "sync_hot_store", "prefetch"]
+
+
+class PeriodStim:
+    @staticmethod
+    def name():
+        return "PeriodStim"
+
+    def init(self, exp):
+        pass
+
+    def make_conditions(self, conditions):
+        return conditions
+
+
+class Behavior:
+    def make_conditions(self, conditions):
+        return dict(conditions=conditions)
+
+
+def baseline_period_conditions(conditions, stim_periods):
+    """The stim_periods conditions of the former make_conditions, without its repeated combinations."""
+    conditions = dict(conditions)
+    combs = list(itertools.product(*[factorize(conditions[period]) for period in stim_periods]))
+    for i, period in enumerate(stim_periods):
+        conditions[period] = [comb[i] for comb in combs]
+    unique = []
+    for cond in factorize(conditions):
+        if cond not in unique:
+            unique.append(cond)
+    return unique
+
+
+def test_period_conditions_keep_the_baseline_order(monkeypatch):
+    exp = ExperimentClass()
+    exp.stims, exp.params, exp.default_key, exp.required_fields = dict(), dict(), dict(), []
+    exp.cond_tables, exp.conditions_chunk, exp.beh = ["Stub"], 5, Behavior()
+    monkeypatch.setattr(exp, "log_conditions", lambda conditions, **kwargs: list(conditions))
+    conditions = dict(difficulty=[1, 2], Cue=dict(size=[1, 2], color=(0, 0)),
+                      trial_duration=[100, 200], Response=dict(size=[3, 4, 5]))
+    expected = baseline_period_conditions({**conditions, "stimulus_class": "PeriodStim"}, ["Cue", "Response"])
+
+    generated = list(exp.make_conditions(PeriodStim(), conditions, stim_periods=["Cue", "Response"]))
+    assert len(generated) == exp.count_conditions(conditions, ["Cue", "Response"]) == 24
+    assert [{k: cond[k] for k in expected[0]} for cond in generated] == expected
@@ -0,0 +1,69 @@
+import base64
+import hashlib
+
+import numpy as np
+import pytest
+
+from utils.helper_functions import hash_changes, legacy_make_hash, make_hash
+
+
+def baseline_make_hash(cond):
+    """make_hash as it was before numpy arrays were encoded."""
+    def make_hashable(cond):
+        if isinstance(cond, (tuple, list)):
+            return tuple((make_hashable(e) for e in cond))
+        if isinstance(cond, dict):
+            return tuple(sorted((k, make_hashable(v)) for k, v in cond.items()))
+        if isinstance(cond, (set, frozenset)):
+            return tuple(sorted(make_hashable(e) for e in cond))
+        return cond
+
+    hasher = hashlib.md5()
+    hasher.update(repr(make_hashable(cond)).encode())
+    return base64.b64encode(hasher.digest()).decode()
+
+
+CONDITIONS = [
+    {},
+    {"difficulty": 1},
+    {"difficulty": 1, "stimulus_class": "Grating", "trial_selection": "staircase"},
+    {"reward_port": 1, "response_port": 1, "reward_amount": 8.5, "noresponse": None,
+     "flag": True, "ports": [1, 2, 3], "delays": (100,), "names": {"b", "a"}},
+    {"Cue": {"theta": 0, "contrast": 100}, "Response": {"theta": [0, 90], "duration": 500.0}},
+    {"nested": [[1, 2], (3, {"x": "y"})], "empty": [], "single": [7]},
+    [1, "a", 2.5, None],
+    ("a",),
+    "cond",
+    3,
+]
+
+
+@pytest.mark.parametrize("cond", CONDITIONS)
+def test_hash_of_conditions_without_arrays_is_unchanged(cond):
+    assert make_hash(cond) == baseline_make_hash(cond) == legacy_make_hash(cond)
+
+
+def test_memo_gives_the_same_hashes():
+    shared = {"theta": [0, 90]}
+    conditions = [{"difficulty": n, "Cue": shared} for n in range(3)]
+    memo = {}
+    assert [make_hash(cond, memo) for cond in conditions] == \
+        [baseline_make_hash(cond) for cond in conditions]
+    assert hash_changes(conditions) == []
+
+
+def test_arrays_are_hashed_by_content():
+    array = np.arange(10000, dtype=np.float64)
+    changed = array.copy()
+    changed[5000] += 1
+    assert make_hash({"a": array}) == make_hash({"a": array.copy()})
+    assert make_hash({"a": array}) != make_hash({"a": changed})
+    assert make_hash({"a": array}) != make_hash({"a": array.astype(np.float32)})
+    assert make_hash({"a": array}) != make_hash({"a": array.reshape(100, 100)})
+    assert make_hash({"a": array[::2]}) == make_hash({"a": np.ascontiguousarray(array[::2])})
+
+
+def test_hash_changes_lists_the_conditions_with_arrays():
+    conditions = [{"a": 1}, {"a": np.arange(5000)}]
+    changes = hash_changes(conditions)
+    assert changes == [(legacy_make_hash(conditions[1]), make_hash(conditions[1]))]
@@ -0,0 +1,148 @@
+import random
+import time
+
+import pytest
+
+import core.Experiment  # noqa: F401, declares the tables of the experiment schema
+
+
+class FailingBackend:
+    """A backend whose inserts of some tables fail with the next errors of the table."""
+
+    def __init__(self, backend, inserts=None, errors=None, delay=0):
+        self.backend = backend
+        self.inserts = [] if inserts is None else inserts  # (table, rows) of the inserts
+        self.errors = errors or {}
+        self.delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def insert(self, schema, table, rows, **kwargs):
+        if self.errors.get(table):
+            raise self.errors[table].pop(0)
+        time.sleep(self.delay)
+        self.backend.insert(schema, table, rows, **kwargs)
+        self.inserts.append((table, list(rows)))
+
+
+def trial_key():
+    return dict(animal_id=random.randint(1, 60000), session=1)
+
+
+def trial(key, trial_idx):
+    return dict(key, trial_idx=trial_idx, cond_hash="a", time=trial_idx)
+
+
+def state_onset(key, trial_idx):
+    return dict(key, trial_idx=trial_idx, time=trial_idx, state="Trial")
+
+
+def insert_trials(logger, count):
+    """Puts the Trial and StateOnset rows of count trials and returns the order of their inserts."""
+    inserts = []
+    for n, worker in enumerate(logger.workers):
+        worker.backend = FailingBackend(worker.backend, inserts, delay=0.002 * n)
+    key, futures = trial_key(), []
+    for trial_idx in range(1, count + 1):
+        futures.append(logger.put(table="Trial", tuple=trial(key, trial_idx)))
+        futures.append(logger.put(table="Trial.StateOnset", tuple=state_onset(key, trial_idx)))
+    for future in futures:
+        future.result(timeout=10)
+    return [(table, row["trial_idx"]) for table, rows in inserts for row in rows]
+
+
+def assert_parents_first(order, count):
+    assert [trial_idx for table, trial_idx in order if table == "Trial"] == list(range(1, count + 1))
+    for trial_idx in range(1, count + 1):
+        assert order.index(("Trial", trial_idx)) < order.index(("Trial.StateOnset", trial_idx))
+
+
+def test_batch_inserts_parent_rows_first(make_logger):
+    logger = make_logger(insert_batch_linger=100)
+    inserts, key = [], trial_key()
+    logger.workers[0].backend = FailingBackend(logger.workers[0].backend, inserts)
+    logger.put(table="Trial", tuple=trial(key, 1)).result(timeout=10)
+    # the next batch starts with a row of a child table
+    futures = [logger.put(table="Trial.StateOnset", tuple=state_onset(key, 1))]
+    for trial_idx in (2, 3):
+        futures.append(logger.put(table="Trial", tuple=trial(key, trial_idx)))
+        futures.append(logger.put(table="Trial.StateOnset", tuple=state_onset(key, trial_idx)))
+    for future in futures:
+        future.result(timeout=10)
+    order = [(table, row["trial_idx"]) for table, rows in inserts for row in rows]
+    assert_parents_first(order, 3)
+
+
+def test_workers_keep_the_order_of_tables_and_parents(make_logger):
+    logger = make_logger(inserter_workers=3)
+    assert_parents_first(insert_trials(logger, 30), 30)
+
+
+def test_transient_errors_are_retried_with_backoff(make_logger):
+    logger = make_logger(insert_retry_delay=20)
+    errors = {"Trial": [ConnectionError("lost connection")] * 2}
+    logger.workers[0].backend = FailingBackend(logger.workers[0].backend, errors=errors)
+    key = trial_key()
+    start = time.monotonic()
+    logger.put(table="Trial", tuple=trial(key, 1)).result(timeout=10)
+    assert time.monotonic() - start >= 0.02  # half of 20 ms and of 40 ms at least
+    assert not errors["Trial"]
+    assert list(logger.get(table="Trial", key=key, fields=["trial_idx"])) == [1]
+    assert not logger.dead_letters.count
+
+
+def test_permanent_errors_are_dead_lettered_after_the_retries(make_logger):
+    logger = make_logger(insert_retry_delay=1, insert_permanent_retries=2)
+    errors = {"Trial": [ValueError("bad row")] * 5}
+    logger.workers[0].backend = FailingBackend(logger.workers[0].backend, errors=errors)
+    row = trial(trial_key(), 1)
+    with pytest.raises(ValueError):
+        logger.put(table="Trial", tuple=row).result(timeout=10)
+    assert len(errors["Trial"]) == 2  # inserted once and retried twice
+    records = list(logger.dead_letters.read())
+    assert [record["item"]["tuple"] for record in records] == [row]
+    assert "bad row" in records[0]["exception"]
+
+
+def test_abort_policy_ends_the_session(make_logger):
+    logger = make_logger(insert_failure_policy="abort")
+    errors = {"Trial": [ValueError("bad row")]}
+    logger.workers[0].backend = FailingBackend(logger.workers[0].backend, errors=errors)
+    with pytest.raises(ValueError):
+        logger.put(table="Trial", tuple=trial(trial_key(), 1)).result(timeout=10)
+    with pytest.raises(Exception, match="bad row"):
+        logger.update_trial_idx(2)
+
+
+def put_state_onsets(logger, count):
+    key = trial_key()
+    logger.put(table="Trial", tuple=trial(key, 1)).result(timeout=10)
+    futures = [logger.put(table="Trial.StateOnset", tuple=dict(state_onset(key, 1), time=time_))
+               for time_ in range(count)]
+    for future in futures:
+        future.result(timeout=10)
+    return len(logger.get(table="Trial.StateOnset", key=key, fields=["time"]))
+
+
+def test_tables_are_not_shed_by_default(make_logger):
+    assert put_state_onsets(make_logger(backpressure_watermark=0), 6) == 6
+
+
+def test_configured_tables_are_sampled_above_the_watermark(make_logger):
+    logger = make_logger(backpressure_watermark=0,
+                         backpressure={"experiment.Trial.StateOnset": {"policy": "sample", "keep": 3}})
+    assert put_state_onsets(logger, 6) == 2
+
+
+def test_cleanup_without_journal_dead_letters_what_is_left(make_logger):
+    logger = make_logger(journal=False, insert_retry_delay=10)
+    errors = {"Trial": [ConnectionError("lost connection")] * 1000}
+    logger.workers[0].backend = FailingBackend(logger.workers[0].backend, errors=errors)
+    key = trial_key()
+    logger.put(table="Trial", tuple=trial(key, 1))
+    start = time.monotonic()
+    logger.cleanup(deadline=0.3)
+    assert time.monotonic() - start < 1
+    assert not logger.queue_size()
+    assert [record["item"]["tuple"] for record in logger.dead_letters.read()] == [trial(key, 1)]
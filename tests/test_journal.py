@@ -0,0 +1,121 @@
+import os
+import pickle
+
+from utils.Journal import ACK, PUT, DeadLetters, Journal
+
+
+def item(n):
+    return {"table": "Trial", "schema": "experiment", "tuple": {"trial_idx": n}}
+
+
+def trial_indices(items):
+    return [fields["tuple"]["trial_idx"] for _, fields in items]
+
+
+def test_pending_items_are_replayed_in_order(tmp_path):
+    journal = Journal(str(tmp_path))
+    ids = [journal.append(item(n)) for n in range(5)]
+    journal.ack([ids[1], ids[3]])
+    journal.sync(force=True)  # crash, the file is not closed
+
+    replayed = Journal(str(tmp_path)).replay()
+    assert trial_indices(replayed) == [0, 2, 4]
+
+
+def test_checkpoint_truncates_the_journal(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.ack([journal.append(item(n)) for n in range(3)])
+    journal.close()
+    assert os.path.getsize(journal.filename) == 0
+    assert Journal(str(tmp_path)).replay() == []
+
+
+def test_crash_during_replay_loses_and_repeats_nothing(tmp_path):
+    journal = Journal(str(tmp_path))
+    for n in range(4):
+        journal.append(item(n))
+    journal.sync(force=True)
+
+    # the next run commits two of the replayed items and a new one, then crashes
+    journal = Journal(str(tmp_path))
+    replayed = journal.replay()
+    journal.ack([replayed[0][0], replayed[2][0]])
+    journal.ack([journal.append(item(10))])
+    journal.append(item(11))
+    journal.sync(force=True)
+
+    assert trial_indices(Journal(str(tmp_path)).replay()) == [1, 3, 11]
+
+
+def test_crash_before_the_replay_keeps_the_items(tmp_path):
+    journal = Journal(str(tmp_path))
+    for n in range(3):
+        journal.append(item(n))
+    journal.sync(force=True)
+
+    Journal(str(tmp_path))  # crashes before replay is called
+    assert trial_indices(Journal(str(tmp_path)).replay()) == [0, 1, 2]
+
+
+def test_replay_file_of_an_interrupted_replay_is_recovered(tmp_path):
+    # a replay that crashed kept the previous journal aside and journaled one item again
+    previous = str(tmp_path / (Journal.FILENAME + Journal.REPLAY_SUFFIX))
+    with open(previous, "wb") as f:
+        for n in range(3):
+            pickle.dump((PUT, n, pickle.dumps(item(n))), f)
+        pickle.dump((ACK, None, [1]), f)
+    with open(str(tmp_path / Journal.FILENAME), "wb") as f:
+        pickle.dump((PUT, 0, pickle.dumps(item(7))), f)
+
+    journal = Journal(str(tmp_path))
+    assert not os.path.exists(previous)
+    assert trial_indices(journal.replay()) == [0, 2, 7]
+
+
+def test_truncated_record_ends_the_replay(tmp_path):
+    journal = Journal(str(tmp_path))
+    for n in range(3):
+        journal.append(item(n))
+    journal.close()
+    with open(journal.filename, "r+b") as f:
+        f.truncate(os.path.getsize(journal.filename) - 5)
+
+    assert trial_indices(Journal(str(tmp_path)).replay()) == [0, 1]
+
+
+def test_spilled_items_are_read_back(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.append(item(0))
+    spilled = [journal.append(item(n), spill=True) for n in (1, 2)]
+    assert journal.spilled == 2
+    assert [journal_id for journal_id, _ in journal.unspill(10)] == spilled
+    assert journal.spilled == 0
+
+
+def test_replayed_items_can_be_spilled(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.append(item(0))
+    journal.sync(force=True)
+
+    journal = Journal(str(tmp_path))
+    (journal_id, _), = journal.replay()
+    journal.spill(journal_id)
+    assert trial_indices(journal.unspill(10)) == [0]
+
+
+def test_compaction_keeps_the_pending_items(tmp_path):
+    journal = Journal(str(tmp_path), compact_size=1)
+    ids = [journal.append(item(n)) for n in range(4)]
+    journal.ack(ids[:2])
+    journal.sync(force=True)
+
+    assert trial_indices(Journal(str(tmp_path)).replay()) == [2, 3]
+
+
+def test_dead_letters_are_read_back(tmp_path):
+    dead_letters = DeadLetters(str(tmp_path / "dead_letters.pkl"))
+    dead_letters.append(item(0), ValueError("bad row"))
+    records = list(dead_letters.read())
+    assert dead_letters.count == 1
+    assert records[0]["item"] == item(0)
+    assert "bad row" in records[0]["exception"]
@@ -0,0 +1,98 @@
+import os
+import random
+import time
+
+import pytest
+
+import core.Behavior  # noqa: F401, declares the tables of the behavior schema
+import core.Experiment  # noqa: F401, declares the tables of the experiment schema
+from utils.Journal import Journal
+
+
+def session_rows(count):
+    animal_id = random.randint(1, 60000)
+    return [dict(animal_id=animal_id, session=session, user_name="bot",
+                 experiment_type="Passive") for session in range(1, count + 1)]
+
+
+def test_bad_row_of_a_list_item_is_isolated(logger):
+    rows = session_rows(5)
+    del rows[3]["experiment_type"]
+    future = logger.put(table="Session", tuple=rows, priority=2)
+    with pytest.raises(Exception):
+        future.result(timeout=10)
+
+    key = dict(animal_id=rows[0]["animal_id"])
+    assert sorted(logger.get(table="Session", key=key, fields=["session"])) == [1, 2, 3, 5]
+    dead = [record["item"]["tuple"] for record in logger.dead_letters.read()]
+    assert dead == [[rows[3]]]
+
+
+def test_replayed_rows_are_not_shed(logger_config, monkeypatch):
+    from core.Logger import Logger
+
+    animal_id = random.randint(1, 60000)
+    row = dict(animal_id=animal_id, session=1, trial_idx=1, port=1, time=10, in_position=1)
+    journal = Journal(os.path.join(logger_config["source_path"], "journal"))
+    journal.append(dict(table="Activity.Proximity", tuple=row, schema="behavior", priority=50))
+    journal.sync(force=True)
+
+    monkeypatch.setitem(logger_config, "backpressure", {"behavior.Activity.Proximity": "divert"})
+    monkeypatch.setitem(logger_config, "backpressure_watermark", 0)
+    logger = Logger()
+    try:
+        key, times = dict(animal_id=animal_id), []
+        deadline = time.monotonic() + 10
+        while not times and time.monotonic() < deadline:
+            time.sleep(0.05)
+            times = list(logger.get(schema="behavior", table="Activity.Proximity", key=key, fields=["time"]))
+        assert times == [10]
+    finally:
+        logger.cleanup(deadline=1)
+
+
+def test_hot_rows_wait_for_their_trial(logger_config, monkeypatch):
+    from core.Logger import Logger
+
+    monkeypatch.setitem(logger_config, "hot_store", True)
+    logger = Logger()
+    try:
+        logger.trial_key = dict(animal_id=random.randint(1, 60000), session=1, trial_idx=1)
+        activity = [{**logger.trial_key, "trial_idx": trial_idx, "port": 1, "time": 10, "in_position": 1}
+                    for trial_idx in (1, 2)]
+        assert not logger._is_hot_row_ready(activity[0])
+        logger.put(table="Trial", tuple=dict(logger.trial_key, cond_hash="a", time=0)).result(timeout=10)
+        deadline = time.monotonic() + 1  # the callbacks of the future run after result returns
+        while not logger._is_hot_row_ready(activity[0]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [logger._is_hot_row_ready(row) for row in activity] == [True, False]
+    finally:
+        logger.cleanup(deadline=1)
+
+
+def test_logger_from_a_task_id(logger_config):
+    from core.Logger import Logger, public_backend
+
+    task = next(row for row in public_backend.fetch("experiment", "Task", as_dict=True) if row["task_idx"])
+    logger = Logger(protocol=str(task["task_idx"]))
+    try:
+        assert logger.task_idx == task["task_idx"]
+        assert os.path.basename(logger.protocol_path) == task["task"]
+        assert logger.manual_run
+    finally:
+        logger.cleanup(deadline=1)
+
+
+def test_heartbeat_writes_only_the_changed_fields(logger, monkeypatch):
+    pings = []
+    monkeypatch.setattr(logger, "keepalive_period", 60000)
+    monkeypatch.setattr(logger, "put", lambda **fields: pings.append(set(fields["tuple"]) - {"setup"}))
+    full = {"queue_size", "trials", "total_liquid", "state", "last_ping"}
+
+    logger._update_setup_info(0)
+    logger.trial_key["trial_idx"] += 1
+    logger._update_setup_info(0)
+    logger._update_setup_info(0)  # nothing has changed
+    logger._on_reconnect()
+    logger._update_setup_info(0)
+    assert pings == [full, {"trials", "last_ping"}, full]
@@ -0,0 +1,22 @@
+from core.Storage import SessionOverlay
+
+
+def test_overlay_serves_loaded_and_queued_rows():
+    overlay = SessionOverlay()
+    assert not overlay.add_table("experiment", "Port", ["port"], ["port"])
+    assert overlay.add_table("recording", "Recording", ["animal_id", "session", "rec_idx", "file"],
+                             ["animal_id", "session", "rec_idx"])
+    session = dict(animal_id=1, session=2)
+    overlay.apply("recording", "Recording", [{**session, "rec_idx": 2, "file": "b"}])
+    assert overlay.get("recording", "Recording", session) is None
+    overlay.load("recording", "Recording", (1, 2), [{**session, "rec_idx": 1, "file": "a"}])
+    assert [row["rec_idx"] for row in overlay.get("recording", "Recording", session)] == [1, 2]
+
+    overlay.apply("recording", "Recording", [{**session, "rec_idx": 1, "file": "c"}])
+    overlay.apply("recording", "Recording", [{**session, "rec_idx": 2, "file": "d"}],
+                  replace=True)
+    overlay.apply("recording", "Recording", [{**session, "rec_idx": 3, "file": "e"}],
+                  update=True)
+    assert [row["file"] for row in overlay.get("recording", "Recording", session)] == ["a", "d"]
+    overlay.clear()
+    assert not overlay.is_loaded("recording", "Recording", (1, 2))
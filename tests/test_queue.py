@@ -0,0 +1,61 @@
+from concurrent.futures import Future
+
+from core.Logger import LaneQueue, PrioritizedItem
+
+
+def item(n, priority=50, key=None, **fields):
+    return PrioritizedItem(table="Trial", tuple={"trial_idx": n, **fields}, priority=priority,
+                           journal_id=n, coalesce_key=key, future=Future())
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get())
+        queue.task_done()
+    return items
+
+
+def test_items_leave_by_priority_and_in_order():
+    queue = LaneQueue()
+    for n, priority in enumerate([5, 1, 5, 1, 5]):
+        queue.put(item(n, priority))
+    assert [i.tuple["trial_idx"] for i in drain(queue)] == [1, 3, 0, 2, 4]
+
+
+def test_retried_items_keep_their_place():
+    queue = LaneQueue()
+    first, second = item(0), item(1)
+    queue.put(first)
+    queue.put(second)
+    queue.get()
+    queue.put(first)  # retried
+    assert [i.tuple["trial_idx"] for i in drain(queue)] == [0, 1]
+
+
+def test_items_of_the_same_key_are_coalesced():
+    queue = LaneQueue(coalesce=True)
+    older, newer, other = item(0, key=("Position", 1), x=1), item(1, key=("Position", 1), y=2), item(2)
+    for i in (older, newer, other):
+        queue.put(i)
+    assert queue.unfinished_tasks == 2 and not queue.merged
+    merged, left = drain(queue)
+    assert merged is older and left is other
+    assert merged.tuple == {"trial_idx": 1, "x": 1, "y": 2}
+    assert merged.journal_ids == [0, 1]
+    assert queue.unfinished_tasks == 0
+
+    merged.future.set_result(None)
+    assert newer.future.done()
+
+
+def test_items_are_not_coalesced_without_coalesce_or_across_lanes():
+    queue = LaneQueue()
+    queue.put(item(0, key=("Position", 1)))
+    queue.put(item(1, key=("Position", 1)))
+    assert len(drain(queue)) == 2
+
+    queue = LaneQueue(coalesce=True)
+    queue.put(item(0, priority=1, key=("Position", 1)))
+    queue.put(item(1, priority=2, key=("Position", 1)))
+    assert len(drain(queue)) == 2
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+import core.Experiment  # noqa: F401, declares the tables of the experiment schema
+
+
+class FailingReads:
+    """A backend whose reads fail with a lost connection."""
+
+    def __init__(self):
+        from core.Logger import public_backend
+
+        self.backend = public_backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def fetch(self, *args, **kwargs):
+        raise ConnectionError("lost connection")
+
+
+def insert_session(logger, key, session):
+    logger.put(table="Session", tuple=dict(key, session=session, user_name="bot", experiment_type="Passive"),
+               block=True)
+
+
+@pytest.fixture
+def key():
+    return dict(animal_id=random.randint(1, 60000))
+
+
+def test_get_async_reads_in_the_pool(make_logger, key):
+    logger = make_logger()
+    insert_session(logger, key, 1)
+    assert list(logger.get_async(table="Session", key=key, fields=["session"]).result(timeout=10)) == [1]
+
+
+def test_get_takes_the_prefetched_read(make_logger, key):
+    logger = make_logger(prefetch=True)
+    insert_session(logger, key, 1)
+    request = dict(table="Session", key=key, fields=["session"])
+    future, = logger.prefetch([request])
+    future.result(timeout=10)
+    insert_session(logger, key, 2)
+
+    assert list(logger.get(**request)) == [1]  # the prefetched result
+    assert list(logger.get(**request)) == [1, 2]  # read again
+
+
+def test_prefetch_is_disabled_by_default(make_logger, key):
+    assert make_logger().prefetch([dict(table="Session", key=key)]) == []
+
+
+def test_failed_prefetch_is_read_again(make_logger, key, monkeypatch):
+    logger = make_logger(prefetch=True)
+    insert_session(logger, key, 1)
+    monkeypatch.setattr(logger, "_connect_backend", FailingReads)  # the connections of the read pool
+    request = dict(table="Session", key=key, fields=["session"])
+    future, = logger.prefetch([request])
+    with pytest.raises(ConnectionError):
+        future.result(timeout=10)
+    assert list(logger.get(**request)) == [1]
+    assert logger.supervisor.connected.is_set()
+
+
+def test_read_connections_are_bounded(make_logger):
+    assert make_logger(read_connections=100).read_connections == 2
@@ -0,0 +1,109 @@
+import inspect
+import re
+
+import datajoint as dj
+import pytest
+from datajoint.heading import Heading
+
+from utils.helper_functions import CachedSchema
+
+
+class Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = len(rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class Connection:
+    """A connection to a server with the tables of one database."""
+
+    conn_info = dict(host="server")
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+
+    def query(self, sql, *args, **kwargs):
+        self.queries.append(sql)
+        if sql.startswith("SELECT schema_name"):
+            return Cursor([("lab",)])
+        if sql.startswith("SHOW TABLES"):
+            like = re.search('LIKE "(.*)"', sql)
+            return Cursor([(table,) for table in self.tables if not like or table == like.group(1)])
+        raise AssertionError("Unexpected query: " + sql)
+
+    def register(self, schema):
+        pass
+
+
+def make_animal():
+    class Animal(dj.Manual):
+        definition = """
+        animal_id: int
+        """
+
+        class Note(dj.Part):
+            definition = """
+            -> master
+            note: varchar(16)
+            """
+    return Animal
+
+
+def bound_attributes(cls):
+    """The attributes that a schema assigns to a table class, comparable across classes."""
+    def comparable(value):
+        if inspect.isclass(value):
+            return value.__name__
+        if isinstance(value, dict):
+            return sorted(value)
+        if isinstance(value, Heading):
+            return {k: comparable(v) for k, v in value.table_info.items() if k != "conn"}
+        return value
+    return {name: comparable(value) for name, value in vars(cls).items()
+            if name not in ("__module__", "__qualname__", "__dict__", "__weakref__")}
+
+
+@pytest.fixture
+def connection():
+    return Connection(["animal", "animal__note", "#session"])
+
+
+def test_unchanged_tables_are_bound_as_by_datajoint(connection, tmp_path):
+    expected = dj.Schema("lab", connection=connection, create_tables=False)(make_animal(), context=dict(dj=dj))
+    schema = CachedSchema("lab", connection=connection, create_tables=False,
+                          cache_path=str(tmp_path / "schema_cache.json"))
+    checked = schema(make_animal(), context=dict(dj=dj))  # checked by datajoint and its hash kept
+    queries = len(connection.queries)
+    cached = schema(make_animal(), context=dict(dj=dj))
+    assert len(connection.queries) == queries
+    for cls in (checked, cached):
+        assert bound_attributes(cls) == bound_attributes(expected)
+        assert bound_attributes(cls.Note) == bound_attributes(expected.Note)
+
+
+def test_changed_tables_are_checked_again(connection, tmp_path):
+    schema = CachedSchema("lab", connection=connection, create_tables=False,
+                          cache_path=str(tmp_path / "schema_cache.json"))
+    schema(make_animal(), context=dict(dj=dj))
+    changed = make_animal()
+    changed.Note.definition += "    date: date\n"
+    queries = len(connection.queries)
+    schema(changed, context=dict(dj=dj))
+    assert connection.queries[queries:] == ['SHOW TABLES in `lab` LIKE "animal"',
+                                            'SHOW TABLES in `lab` LIKE "animal__note"']
+
+
+def test_spawned_classes_match_datajoint(connection):
+    expected, spawned = {}, {}
+    dj.Schema("lab", connection=connection).spawn_missing_classes(context=expected)
+    queries = len(connection.queries)
+    CachedSchema("lab", connection=connection).spawn_missing_classes(context=spawned)
+    assert len(connection.queries) - queries < queries
+    assert sorted(spawned) == sorted(expected) == ["Animal", "Session"]
+    for name in expected:
+        assert bound_attributes(spawned[name]) == bound_attributes(expected[name])
+    assert bound_attributes(spawned["Animal"].Note) == bound_attributes(expected["Animal"].Note)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from core.Storage import HotStore, SQLiteBackend
+
+SCHEMATA = {"experiment": "lab_experiments"}
+
+
+def test_insert_and_fetch(backend):
+    backend.insert("experiment", "Session", [
+        dict(animal_id=1, session=1, experiment_type="A"),
+        dict(animal_id=1, session=2, experiment_type="B", notes="x")])
+    assert backend.fetch1("experiment", "Session", dict(session=2), ["experiment_type"]) == "B"
+    assert list(backend.fetch("experiment", "Session", dict(animal_id=1), ["session"])) == [1, 2]
+    assert backend.exists("experiment", "Session", dict(animal_id=1, session=1))
+
+
+def test_duplicates_are_skipped_or_replaced(backend):
+    key = dict(animal_id=1, session=1)
+    backend.insert("experiment", "Session", [{**key, "experiment_type": "A"}])
+    backend.insert("experiment", "Session", [{**key, "experiment_type": "B"}])
+    assert backend.fetch1("experiment", "Session", key, ["experiment_type"]) == "A"
+    backend.insert("experiment", "Session", [{**key, "experiment_type": "B"}], replace=True)
+    assert backend.fetch1("experiment", "Session", key, ["experiment_type"]) == "B"
+
+
+def test_missing_attribute_raises(backend):
+    with pytest.raises(Exception):
+        backend.insert("experiment", "Session", [dict(animal_id=1, session=1)])
+    assert not backend.exists("experiment", "Session", dict(animal_id=1))
+
+
+def test_failed_transaction_is_rolled_back(backend):
+    with pytest.raises(Exception):
+        with backend.transaction():
+            backend.insert("experiment", "Session.Task",
+                           [dict(animal_id=1, session=1, task_name="t")])
+            backend.insert("experiment", "Session", [dict(animal_id=1, session=1)])
+    assert not backend.exists("experiment", "Session.Task", dict(animal_id=1))
+
+
+def test_extra_fields(backend):
+    row = dict(animal_id=1, session=1, experiment_type="A", trial_idx=3)
+    backend.insert("experiment", "Session", [row])
+    with pytest.raises(KeyError):
+        backend.insert("experiment", "Session", [row], ignore_extra_fields=False)
+
+
+def test_part_tables_and_lookup_contents(backend):
+    assert backend.tier("experiment", "Session.Task") == "part"
+    assert backend.parents("experiment", "Session.Task") == ["experiment.Session"]
+    assert backend.primary_key("experiment", "Session.Task") == ["animal_id", "session"]
+    assert backend.tier("experiment", "Port") == "lookup"
+    assert list(backend.fetch("experiment", "Port", dict(setup_conf_idx=0), ["position"],
+                              order_by="port")) == ["left", "right"]
+
+
+def test_blobs_round_trip(backend):
+    clip = np.arange(6, dtype=np.uint8).reshape(2, 3)
+    backend.insert("experiment", "Clip", [dict(clip_idx=1, clip=clip)])
+    fetched = backend.fetch1("experiment", "Clip", dict(clip_idx=1), ["clip"])
+    np.testing.assert_array_equal(fetched, clip)
+
+
+def test_undeclared_tables_are_created_from_the_rows(backend):
+    backend.insert("experiment", "Recording", [dict(animal_id=1, rec_idx=1, file="a.h5")])
+    assert backend.fetch("experiment", "Recording", as_dict=True) == [
+        dict(animal_id=1, rec_idx=1, file="a.h5")]
+
+
+def test_tables_are_read_back_from_the_file(backend):
+    backend.insert("experiment", "Session", [dict(animal_id=1, session=1, experiment_type="A")])
+    reopened = SQLiteBackend(backend.filename, SCHEMATA)
+    assert reopened.fetch1("experiment", "Session", dict(animal_id=1), ["experiment_type"]) == "A"
+    assert reopened.tier("experiment", "Session.Task") == "part"
+
+
+def sessions(numbers):
+    return [dict(animal_id=1, session=n, experiment_type="A") for n in numbers]
+
+
+def test_hot_store_moves_rows_to_the_target(backend, tmp_path):
+    hot_store = HotStore(str(tmp_path / "hot_store.sqlite"), SCHEMATA)
+    hot_store.insert("experiment", "Session", sessions(range(5)))
+    assert hot_store.pending() == 5
+    assert hot_store.sync(backend, batch_size=2) == 5
+    assert hot_store.pending() == 0
+    assert len(backend.fetch("experiment", "Session", as_dict=True)) == 5
+
+
+def test_hot_store_syncs_only_the_ready_rows(backend, tmp_path):
+    hot_store = HotStore(str(tmp_path / "hot_store.sqlite"), SCHEMATA)
+    hot_store.insert("experiment", "Session", sessions(range(5)))
+    assert hot_store.sync(backend, batch_size=2, ready=lambda row: row["session"] < 3) == 3
+    assert hot_store.pending() == 2
+    assert hot_store.sync(backend, batch_size=2) == 2
+    assert list(backend.fetch("experiment", "Session", dict(animal_id=1), ["session"])) == [0, 1, 2, 3, 4]
+
+
+def test_hot_store_skips_the_rows_of_an_interrupted_sync(backend, tmp_path):
+    hot_store = HotStore(str(tmp_path / "hot_store.sqlite"), SCHEMATA)
+    backend.insert("experiment", "Session", [dict(animal_id=1, session=0, experiment_type="B")])
+    hot_store.insert("experiment", "Session", sessions(range(2)))
+    assert hot_store.sync(backend) == 2
+    assert backend.fetch1("experiment", "Session", dict(animal_id=1, session=0), ["experiment_type"]) == "B"
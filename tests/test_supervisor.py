@@ -0,0 +1,73 @@
+import threading
+import time
+
+from core.Storage import ConnectionSupervisor
+
+
+class Backend:
+    def __init__(self, reachable=True):
+        self.alive, self.reachable, self.reconnects = True, reachable, 0
+
+    def ping(self):
+        if not self.alive:
+            raise ConnectionError("lost connection")
+
+    def reconnect(self):
+        self.reconnects += 1
+        self.alive = self.reachable
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def supervisor_of(*backends):
+    supervisor = ConnectionSupervisor(Backend(), check_period=0.01, retry_delay=0.01)
+    for backend, lock in backends:
+        supervisor.add(backend, lock)
+    supervisor.start()
+    return supervisor
+
+
+def test_lost_backend_is_reopened_while_the_probe_is_connected():
+    backend, idle = Backend(), Backend()
+    supervisor = supervisor_of((backend, threading.Lock()), (idle, None))
+    try:
+        backend.alive = idle.alive = False
+        assert wait_for(lambda: backend.alive)
+        assert supervisor.connected.is_set()
+        assert idle.reconnects == 0  # it has no lock, its user reports its errors
+
+        supervisor.report_lost(idle)
+        assert wait_for(lambda: idle.alive)
+    finally:
+        supervisor.stop()
+
+
+def test_backend_in_use_is_not_pinged():
+    backend, lock = Backend(), threading.Lock()
+    supervisor = supervisor_of((backend, lock))
+    try:
+        with lock:
+            backend.alive = False
+            time.sleep(0.1)
+            assert backend.reconnects == 0
+        assert wait_for(lambda: backend.alive)
+    finally:
+        supervisor.stop()
+
+
+def test_backend_that_cannot_be_reopened_is_a_lost_connection():
+    backend = Backend(reachable=False)
+    supervisor = supervisor_of((backend, threading.Lock()))
+    try:
+        backend.alive = False
+        assert wait_for(lambda: not supervisor.connected.is_set())
+        backend.reachable = True
+        assert wait_for(supervisor.connected.is_set)
+        assert backend.alive
+    finally:
+        supervisor.stop()
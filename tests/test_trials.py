@@ -0,0 +1,58 @@
+import random
+import time
+
+import pytest
+
+import core.Experiment  # noqa: F401, declares the tables of the experiment schema
+
+
+def start_trial(logger, trial_idx):
+    logger.trial_key["trial_idx"] = trial_idx
+    logger.log("Trial", dict(cond_hash="a"), priority=3)
+
+
+def fetch(logger, table, key):
+    return list(logger.get(table=table, key=key, fields=["trial_idx"]))
+
+
+@pytest.fixture
+def logger(make_logger):
+    logger = make_logger(trial_transactions=True)
+    logger.trial_key = dict(animal_id=random.randint(1, 60000), session=1, trial_idx=0)
+    return logger
+
+
+def test_rows_of_a_trial_are_committed_at_its_end(logger):
+    key = dict(animal_id=logger.trial_key["animal_id"])
+    start_trial(logger, 1)
+    logger.log("Trial.StateOnset", dict(state="Trial"))
+    assert logger.trial_buffer and not fetch(logger, "Trial", key)
+
+    logger.end_trial().result(timeout=10)
+    assert not logger.trial_buffer
+    assert fetch(logger, "Trial", key) == [1]
+    assert fetch(logger, "Trial.StateOnset", key) == [1]
+    assert logger.end_trial() is None
+
+
+def test_failed_trial_is_rolled_back(logger):
+    key = dict(animal_id=logger.trial_key["animal_id"])
+    start_trial(logger, 1)
+    logger.log("Trial.StateOnset", dict(state="Trial"))
+    logger.log("Trial.StateOnset", dict(state=None))  # state is required
+    with pytest.raises(Exception):
+        logger.end_trial().result(timeout=10)
+    assert not fetch(logger, "Trial", key)
+    assert not fetch(logger, "Trial.StateOnset", key)
+    assert logger.dead_letters.count == 1
+
+
+def test_next_trial_commits_the_rows_of_the_previous_one(logger):
+    key = dict(animal_id=logger.trial_key["animal_id"])
+    start_trial(logger, 1)
+    logger.update_trial_idx(2)
+    assert not logger.trial_buffer
+    deadline = time.monotonic() + 10
+    while not fetch(logger, "Trial", key) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert fetch(logger, "Trial", key) == [1]
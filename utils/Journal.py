@@ -0,0 +1,304 @@
+"""
+This module defines a Journal class used as a durable write-ahead log for the Logger queue.
+
+Every item that is put in the Logger queue is appended to the journal file before it is
+enqueued and it is acknowledged once it is committed in the database. Items that were not
+acknowledged when the process stopped are replayed the next time the Logger starts, they stay
+in the journal file until they are acknowledged, so a crash during the replay loses nothing.
+
+It also defines the DeadLetters file, where the items that cannot be inserted are kept.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Tuple
+
+PUT, ACK = 0, 1
+
+
+class Journal:
+    """
+    Append-only on-disk journal of the items in the Logger queue.
+
+    Records are pickled one after the other in a single file, so writes are sequential.
+    The file is flushed to the operating system on every append and synced to the disk
+    every `fsync_period` seconds from the inserter thread. When all the journaled items
+    are acknowledged the file is truncated (checkpoint). At construction the file of the
+    previous run is rewritten atomically with only its pending items, which are returned by
+    `replay` with their journal ids.
+
+    Items can also be spilled: they are kept only on disk and are read back with `unspill`
+    when there is room in the in-memory queue, so memory stays flat when the database is
+    not reachable for a long time.
+
+    Attributes:
+        filename (str): Path of the journal file.
+        fsync_period (float): Time in seconds between two syncs of the file to the disk.
+        compact_size (int): Size in bytes above which the file is rewritten with only the
+        pending items.
+    """
+
+    FILENAME = "journal.log"
+    REPLAY_SUFFIX = ".replay"  # the previous journal, kept aside during the replay by old versions
+
+    def __init__(self, path: str, fsync_period: float = 1.0, compact_size: int = 64 * 2**20):
+        os.makedirs(path, exist_ok=True)
+        self.filename = os.path.join(path, self.FILENAME)
+        self.fsync_period = fsync_period
+        self.compact_size = compact_size
+        self._lock = threading.Lock()
+        self._pending = {}  # journal id -> file offset of the put record
+        self._spilled = deque()  # journal ids of the spilled items in put order
+        self._next_id = 0
+        self._last_sync = time.time()
+        self._dirty = False
+        self._replayed = []  # journal ids of the pending items of the previous run
+        previous = [filename for filename in (self.filename + self.REPLAY_SUFFIX, self.filename)
+                    if os.path.isfile(filename) and os.path.getsize(filename) > 0]
+        if previous:
+            self._recover(previous)
+        self._file = open(self.filename, "ab")
+
+    @staticmethod
+    def _read_records(filename: str) -> Iterator[Tuple[int, int, Any, int]]:
+        """
+        Reads the records of a journal file.
+
+        A record that was not completely written (e.g. power loss) ends the reading.
+
+        Yields:
+            Tuple[int, int, Any, int]: The kind, journal id, payload and offset of each record.
+        """
+        with open(filename, "rb") as f:
+            while True:
+                offset = f.tell()
+                try:
+                    kind, journal_id, payload = pickle.load(f)
+                except EOFError:
+                    return
+                except Exception:
+                    logging.warning("Journal %s is truncated at byte %d", filename, offset)
+                    return
+                yield kind, journal_id, payload, offset
+
+    def _recover(self, filenames: List[str]) -> None:
+        """
+        Rewrites the journal file with the pending items of the journal files of the previous
+        run, in the order of the files and of the items, and keeps their ids for `replay`.
+
+        The new file replaces the journal file atomically, so a crash at any point leaves
+        either the previous files or the new one.
+        """
+        payloads = []
+        for filename in filenames:
+            pending = {}
+            for kind, journal_id, payload, _ in self._read_records(filename):
+                if kind == PUT:
+                    pending[journal_id] = payload
+                else:
+                    for acked_id in payload:
+                        pending.pop(acked_id, None)
+            payloads.extend(pending.values())
+        recovered_filename = self.filename + ".recover"
+        with open(recovered_filename, "wb") as f:
+            for payload in payloads:
+                self._pending[self._next_id] = f.tell()
+                pickle.dump((PUT, self._next_id, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+                self._replayed.append(self._next_id)
+                self._next_id += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(recovered_filename, self.filename)
+        for filename in filenames:
+            if filename != self.filename:
+                os.remove(filename)
+
+    def replay(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Returns the items of the previous run that were never acknowledged. They are already
+        in the journal, so they must not be appended again.
+
+        Returns:
+            List[Tuple[int, Dict[str, Any]]]: The journal id and the fields of each item in the
+            order they were put.
+        """
+        items = []
+        with self._lock:
+            self._file.flush()
+            with open(self.filename, "rb") as f:
+                for journal_id in self._replayed:
+                    if journal_id not in self._pending:
+                        continue
+                    f.seek(self._pending[journal_id])
+                    _, _, payload = pickle.load(f)
+                    items.append((journal_id, pickle.loads(payload)))
+            self._replayed = []
+        logging.info("Replaying %d items from the journal", len(items))
+        return items
+
+    def spill(self, journal_id: int) -> None:
+        """Keeps an item that is already journaled only in the journal until `unspill`."""
+        with self._lock:
+            self._spilled.append(journal_id)
+
+    def append(self, fields: Dict[str, Any], spill: bool = False) -> int:
+        """
+        Appends an item to the journal.
+
+        Args:
+            fields (Dict[str, Any]): The fields of the item.
+            spill (bool): If True the item is kept only in the journal until `unspill`.
+
+        Returns:
+            int: The journal id of the item.
+        """
+        payload = pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            journal_id = self._next_id
+            self._next_id += 1
+            record = pickle.dumps((PUT, journal_id, payload), protocol=pickle.HIGHEST_PROTOCOL)
+            self._pending[journal_id] = self._file.tell()
+            self._file.write(record)
+            self._file.flush()
+            self._dirty = True
+            if spill:
+                self._spilled.append(journal_id)
+        return journal_id
+
+    def ack(self, journal_ids: List[int]) -> None:
+        """
+        Acknowledges items that are committed in the database.
+
+        Args:
+            journal_ids (List[int]): The journal ids of the committed items.
+        """
+        journal_ids = [journal_id for journal_id in journal_ids if journal_id is not None]
+        if not journal_ids:
+            return
+        with self._lock:
+            for journal_id in journal_ids:
+                self._pending.pop(journal_id, None)
+            if not self._pending:
+                # checkpoint, everything in the journal is in the database
+                self._file.truncate(0)
+                self._file.seek(0)
+            else:
+                self._file.write(pickle.dumps((ACK, None, journal_ids)))
+                self._file.flush()
+                if self._file.tell() > self.compact_size:
+                    self._compact()
+            self._dirty = True
+
+    def _compact(self) -> None:
+        """Rewrites the journal file with only the pending items (called with the lock)."""
+        self._file.close()
+        compact_filename = self.filename + ".compact"
+        offsets = {}
+        with open(self.filename, "rb") as source, open(compact_filename, "wb") as target:
+            for journal_id, offset in sorted(self._pending.items(), key=lambda x: x[1]):
+                source.seek(offset)
+                record = pickle.load(source)
+                offsets[journal_id] = target.tell()
+                pickle.dump(record, target, protocol=pickle.HIGHEST_PROTOCOL)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(compact_filename, self.filename)
+        self._pending = offsets
+        self._file = open(self.filename, "ab")
+
+    def sync(self, force: bool = False) -> None:
+        """
+        Syncs the journal file to the disk if `fsync_period` has passed since the last sync.
+
+        Args:
+            force (bool): Sync even if the period has not passed.
+        """
+        if not self._dirty or (not force and time.time() - self._last_sync < self.fsync_period):
+            return
+        with self._lock:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            self._last_sync = time.time()
+
+    @property
+    def spilled(self) -> int:
+        """int: The number of items that are kept only in the journal."""
+        return len(self._spilled)
+
+    def unspill(self, max_items: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Reads back spilled items from the journal.
+
+        Args:
+            max_items (int): The maximum number of items to read.
+
+        Returns:
+            List[Tuple[int, Dict[str, Any]]]: The journal id and the fields of each item.
+        """
+        items = []
+        with self._lock:
+            self._file.flush()
+            with open(self.filename, "rb") as f:
+                while self._spilled and len(items) < max_items:
+                    journal_id = self._spilled.popleft()
+                    if journal_id not in self._pending:
+                        continue
+                    f.seek(self._pending[journal_id])
+                    _, _, payload = pickle.load(f)
+                    items.append((journal_id, pickle.loads(payload)))
+        return items
+
+    def close(self) -> None:
+        """Syncs and closes the journal file."""
+        self.sync(force=True)
+        with self._lock:
+            self._file.close()
+
+
+class DeadLetters:
+    """
+    Append-only file of the items that failed permanently to be inserted in the database.
+
+    Each record is a pickled dict with the time, the exception and the fields of the item
+    (schema, table, tuple, ...), so the rows can be inspected and inserted again with `read`.
+
+    Attributes:
+        filename (str): Path of the dead-letter file.
+        count (int): The number of items written to the file by this process.
+    """
+
+    def __init__(self, filename: str):
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        self.filename = filename
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, fields: Dict[str, Any], error: Exception) -> None:
+        """
+        Appends an item to the file and syncs it to the disk.
+
+        Args:
+            fields (Dict[str, Any]): The fields of the item.
+            error (Exception): The error of the last insert of the item.
+        """
+        record = {"time": time.time(), "exception": repr(error), "item": fields}
+        with self._lock:
+            with open(self.filename, "ab") as f:
+                pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            self.count += 1
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        """Yields the records of the file in the order they were written."""
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
@@ -0,0 +1,212 @@
+"""
+This module defines a small in-process metrics registry for the health of a setup.
+
+Counters, gauges and histograms are kept in memory with a lock per metric, so recording a value
+costs about a microsecond. The registry can be served in the Prometheus text format from a
+local HTTP endpoint with `serve`, e.g. http://setup:8000/metrics.
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    """Formats label names and values as {name="value",...}."""
+    labels = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    Base class of the metrics of the registry.
+
+    Attributes:
+        name (str): The name of the metric.
+        description (str): The help text of the metric.
+        labels (Sequence[str]): The names of the labels of the metric.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self) -> List[str]:
+        """Returns the lines of the samples of the metric in the Prometheus text format."""
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in values.items()]
+
+    def expose(self) -> str:
+        """Returns the metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of retried inserts."""
+
+    kind = "counter"
+
+    def inc(self, *labels, value: float = 1) -> None:
+        """Increases the counter of the label values by value."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, e.g. the size of a queue.
+
+    If a callback is given it is called when the metrics are exposed and returns the values
+    of the gauge by label values.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, description, labels)
+        self.callback = callback
+
+    def set(self, value: float, *labels) -> None:
+        """Sets the value of the gauge for the label values."""
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        if self.callback:
+            try:
+                values = self.callback()
+            except Exception as error:
+                logging.debug("Metric %s callback failed: %s", self.name, error)
+                values = {}
+            with self._lock:
+                self._values = dict(values)
+        return super().samples()
+
+
+class Histogram(Metric):
+    """A distribution of values in cumulative buckets, e.g. the latency of the inserts."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        """Adds a value to the histogram of the label values."""
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket, +Inf, sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[idx] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        lines = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the process by name.
+
+    A metric that is created again with the same name is replaced, so that objects that are
+    created more than once (e.g. the Logger) can register their callbacks again.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        """Creates and registers a Counter."""
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], Dict[Tuple, float]]] = None) -> Gauge:
+        """Creates and registers a Gauge."""
+        return self._register(Gauge(name, description, labels, callback))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """Creates and registers a Histogram."""
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def expose(self) -> str:
+        """Returns all the metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the metrics of the REGISTRY on GET /metrics."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics of the REGISTRY from an HTTP server in a daemon thread.
+
+    Args:
+        port (int): The port of the server.
+        host (str): The address the server listens to, "0.0.0.0" for all the interfaces.
+
+    Returns:
+        ThreadingHTTPServer: The server, call its shutdown method to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -1,8 +1,16 @@
+import time
+
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 import numpy as np
 
+from utils.Metrics import REGISTRY
+
+FLIP_INTERVAL = REGISTRY.histogram("ethopy_flip_interval_seconds", "Time between two screen flips",
+                                   buckets=(0.005, 0.01, 0.0125, 0.0167, 0.02, 0.025, 0.0333,
+                                            0.05, 0.1, 0.25, 1))
+
 
 class Presenter():
 
@@ -47,6 +55,7 @@ class Presenter():
         self.clock = pygame.time.Clock()
         self.set_background_color(background_color)
         self.flip_count = 0
+        self.last_flip = None
         self.phd_size = 0.025  # default photodiode signal size in ratio of the X screen size
 
         self.info = pygame.display.Info()
@@ -127,8 +136,13 @@ class Presenter():
         self.flip_count += 1
         self._encode_photodiode()
         pygame.display.flip()
+        flip_time = time.perf_counter()
+        if self.last_flip is not None:
+            FLIP_INTERVAL.observe(flip_time - self.last_flip)
+        self.last_flip = flip_time
         if self.rec_fliptimes:
-            self.fliptimes_dataset.append('fliptimes', [self.flip_count, self.logger.logger_timer.elapsed_time()])
+            self.fliptimes_dataset.append('fliptimes', [self.flip_count,
+                                                        self.logger.logger_timer.elapsed_us() / 1000])
         for event in pygame.event.get():
             if event.type == QUIT: pygame.quit()
 
@@ -3,19 +3,26 @@ import time
 
 class Timer:
     """ This is a timer that is used for the state system
-    time is in milliseconds
+    time is in milliseconds, it is measured with the monotonic high resolution perf_counter_ns
+    clock so it does not jump when the system clock is adjusted (e.g. by NTP)
     """
 
     def __init__(self):
         self.start_time = 0
-        self.time = time.time
+        self.epoch_ns = 0
+        self.time = time.perf_counter_ns
         self.start()
 
     def start(self):
         self.start_time = self.time()
+        self.epoch_ns = time.time_ns()  # wall clock time of the start in ns since 1970
 
     def elapsed_time(self):
-        return int((self.time() - self.start_time)*1000)
+        return (self.time() - self.start_time) // 1000000
+
+    def elapsed_us(self):
+        """Elapsed time in microseconds."""
+        return (self.time() - self.start_time) // 1000
 
     def add_delay(self, sec):
-        self.start_time += sec
+        self.start_time += int(sec * 1e9)
@@ -1,8 +1,8 @@
 import numpy as np
 from datetime import *
-import time, h5py, threading, os
+import h5py, threading, os
 from shutil import copyfile
-from queue import Queue
+from queue import Empty, Queue
 
 
 class Writer(object):
@@ -25,6 +25,7 @@ class Writer(object):
         self.queue = Queue()
         self.datasets = dict()
         self.thread_end = threading.Event()
+        self.closing = threading.Event()
         self.thread_runner = threading.Thread(target=self.dequeue)
         self.thread_runner.start()
         self.target_path = target_path
@@ -36,25 +37,38 @@ class Writer(object):
         self.queue.put({'dataset': dataset, 'data': data})
 
     def dequeue(self):
+        """Writes the queued values, all the values that are queued are written with one open of the file.
+        After exit it writes the remaining values and copies the file to the target_path."""
         while not self.thread_end.is_set():
-            if not self.queue.empty():
-                values = self.queue.get()
-                with h5py.File(self.datapath, mode='a') as h5f:
-                    dset = h5f[values['dataset']]
+            try:
+                values = [self.queue.get(timeout=.1)]
+            except Empty:
+                if self.closing.is_set():
+                    break
+                continue
+            while not self.queue.empty():
+                values.append(self.queue.get_nowait())
+            with h5py.File(self.datapath, mode='a') as h5f:
+                for value in values:
+                    dset = h5f[value['dataset']]
                     dset.resize((dset.shape[0] + 1), axis=0)
-                    dset[-1:] = np.asarray(tuple([values['data']][0]), dset.dtype)
-                    self.datasets[values['dataset']].i += 1
-                    h5f.flush()
-            else:
-                time.sleep(.1)
-
-    def exit(self):
-        while not self.queue.empty():
-            time.sleep(.1)
-        self.thread_end.set()
-        if self.target_path:
+                    dset[-1:] = np.asarray(tuple([value['data']][0]), dset.dtype)
+                    self.datasets[value['dataset']].i += 1
+                h5f.flush()
+        if self.closing.is_set() and not self.thread_end.is_set() and self.target_path:
             copyfile(self.datapath, self.target_path + os.path.basename(self.datapath))
 
+    def exit(self, timeout=None):
+        """Writes the remaining values and copies the file to the target_path in the writer thread.
+        Params:
+            timeout: seconds to wait for the writer to finish, None waits until it finishes and 0 returns at once
+        Returns:
+            True if the writer has finished
+        """
+        self.closing.set()
+        self.thread_runner.join(timeout)
+        return not self.thread_runner.is_alive()
+
     class h5Dataset():
         def __init__(self, datapath, dataset, shape, dtype=np.uint16, compression="gzip", chunk_len=1):
             with h5py.File(datapath, mode='a') as h5f:
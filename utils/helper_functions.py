@@ -1,18 +1,167 @@
 import base64
 import functools
 import hashlib
+import inspect
+import json
 import logging
 import os
+import threading
+import types
 from datetime import datetime
 from getpass import getpass
-from itertools import product
+from itertools import islice, product
 
 import datajoint as dj
 import numpy as np
+from datajoint.heading import Heading
 from scipy import ndimage
 
 
-def create_virtual_modules(schemata, create_tables=True,  create_schema=True):
+# Definition hashes of the tables checked by the CachedSchemas of the process
+_SCHEMA_LOCK = threading.RLock()
+_DEFINITION_HASHES = {}  # path -> {host/`database`.`table`: definition hash}
+
+
+def _definition_hashes(path):
+    """Returns the definition hashes stored in a file, read once per process."""
+    with _SCHEMA_LOCK:
+        if path not in _DEFINITION_HASHES:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    _DEFINITION_HASHES[path] = json.load(f)
+            except (OSError, ValueError):
+                _DEFINITION_HASHES[path] = {}
+        return _DEFINITION_HASHES[path]
+
+
+def _save_definition_hashes(path):
+    """Writes the definition hashes of the process to a file."""
+    with _SCHEMA_LOCK:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(_DEFINITION_HASHES[path], f, indent=1, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        except OSError as error:
+            logging.warning("Cannot save the schema cache %s: %s", path, error)
+
+
+class CachedSchema(dj.Schema):
+    """
+    A DataJoint schema that does not check again the tables that have not changed.
+
+    Tables are checked, declared and filled with their Lookup contents by dj.Schema. If
+    cache_path is set, the hash of the definition and contents of a table is kept once the
+    table is checked, and a table that exists and has the same hash as when it was last
+    checked is only bound to the schema, so a protocol that imports unchanged modules does not
+    query its tables. The classes that spawn_missing_classes creates for the tables of the
+    database are bound the same way, since their tables exist.
+    """
+
+    def __init__(self, *args, cache_path=None, **kwargs):
+        self.cache_path = cache_path
+        self._tables = None
+        self._spawning = False
+        super().__init__(*args, **kwargs)
+
+    def __call__(self, cls, *, context=None):
+        context = context or self.context or inspect.currentframe().f_back.f_locals
+        if not self.is_activated() or issubclass(cls, dj.Part):
+            return super().__call__(cls, context=context)
+        if self._spawning:
+            self._bind_master(cls, context)
+            return cls
+
+        definition_hash = self._definition_hash(cls)
+        cache = self.cache_path is not None and definition_hash is not None
+        hashes = _definition_hashes(self.cache_path) if cache else {}
+        cache_key = f"{self.connection.conn_info['host']}/`{self.database}`.`{cls.table_name}`"
+        is_declared = cls.table_name in self.declared_tables()
+        if is_declared and cache and hashes.get(cache_key) == definition_hash:
+            self._bind_master(cls, context)  # verified fast path, the table has not changed
+            return cls
+        if is_declared and cache_key in hashes:
+            logging.warning("The definition of %s has changed since it was last checked, "
+                            "the table is not altered", cls.__name__)
+
+        super().__call__(cls, context=context)
+        if not is_declared:
+            self._tables = None  # read again the tables, the table may have been declared
+        if cache and cls.table_name in self.declared_tables():
+            with _SCHEMA_LOCK:
+                hashes[cache_key] = definition_hash
+            _save_definition_hashes(self.cache_path)
+        return cls
+
+    def spawn_missing_classes(self, context=None):
+        """Creates the classes of the tables of the database that are missing from context."""
+        if context is None:
+            context = self.context or inspect.currentframe().f_back.f_locals
+        self._spawning = True
+        try:
+            super().spawn_missing_classes(context=context)
+        finally:
+            self._spawning = False
+
+    def declared_tables(self):
+        """Returns the names of the tables of the database, read with one query."""
+        if self._tables is None:
+            self._tables = {row[0] for row in self.connection.query("SHOW TABLES in `%s`" % self.database)}
+        return self._tables
+
+    @staticmethod
+    def _parts(cls):
+        parts = (getattr(cls, name) for name in dir(cls) if name[0].isupper())
+        return [part for part in parts if inspect.isclass(part) and issubclass(part, dj.Part)]
+
+    @classmethod
+    def _definition_hash(cls, table_class):
+        """Returns the hash of the definitions and contents of a table, None without definition."""
+        definitions = [table.definition for table in [table_class] + cls._parts(table_class)]
+        if not all(isinstance(definition, str) for definition in definitions):
+            return None  # e.g. a master decorated again to add part tables
+        contents = getattr(table_class, "contents", None)
+        if not issubclass(table_class, dj.Lookup) or isinstance(contents, property):
+            contents = None
+        return make_hash([definitions, contents])
+
+    def _bind_master(self, cls, context):
+        """Binds a table and its parts to the schema as dj.Schema does, without checking them."""
+        self._bind(cls, dict(context, self=cls, **{cls.__name__: cls}))
+        for part in self._parts(cls):
+            part._master = cls
+            self._bind(part, dict(context, master=cls, self=part, **{cls.__name__: cls}))
+
+    def _bind(self, table_class, context):
+        """Assigns the schema properties that dj.Schema assigns to a table class."""
+        table_class.database = self.database
+        table_class._connection = self.connection
+        table_class._heading = Heading(table_info=dict(
+            conn=self.connection, database=self.database,
+            table_name=table_class.table_name, context=context))
+        table_class._support = [table_class.full_table_name]
+        table_class.declaration_context = context
+        if isinstance(table_class.definition, str):
+            table_class.__doc__ = ((table_class.__doc__ or "") + "\nTable definition:\n\n"
+                                   + table_class.definition)
+
+
+def create_virtual_modules(schemata, create_tables=True,  create_schema=True, cache_path=None):
+    """
+    Connects to the database and creates a virtual module for each schema.
+
+    The modules are created with CachedSchemas, so the tables that have not changed since they
+    were last checked are not queried again.
+
+    Args:
+        schemata (dict): The names of the modules and their databases.
+        create_tables (bool): Whether the schemas can declare new tables.
+        create_schema (bool): Whether the databases are created if they do not exist.
+        cache_path (str): The file of the definition hashes of the tables that were checked.
+
+    Returns:
+        tuple: The virtual modules by name and the connection.
+    """
     try:
         if dj.config["database.password"] is None:
             dj.config["database.password"] = getpass(prompt="Please enter DataJoint password: ")
@@ -25,18 +174,22 @@ def create_virtual_modules(schemata, create_tables=True,  create_schema=True):
         )
         virtual_modules = {}
         for name, schema in schemata.items():
-            virtual_modules[name] = dj.create_virtual_module(name,
-                                                             schema,
-                                                             create_tables=create_tables,
-                                                             create_schema=create_schema,
-                                                             connection=public_conn)
+            _schema = CachedSchema(schema,
+                                   create_schema=create_schema,
+                                   create_tables=create_tables,
+                                   connection=public_conn,
+                                   cache_path=cache_path)
+            virtual_modules[name] = types.ModuleType(name)
+            virtual_modules[name].__dict__["schema"] = _schema
+            _schema.spawn_missing_classes(context=virtual_modules[name].__dict__)
         return virtual_modules, public_conn
     except Exception as e:
         error_message = (f"Failed to connect to the database due "
                          f"to an internet connection error: {e}")
         logging.error("ERROR %s", error_message)
         raise Exception(error_message) from e
-    
+
+
 def sub2ind(array_shape, rows, cols):
     return rows * array_shape[1] + cols
 
@@ -91,41 +244,120 @@ def reverse_lookup(dictionary, target):
     return next(key for key, value in dictionary.items() if value == target)
 
 
+def ifactorize(cond):
+    """Yields the conditions of the Cartesian product of the list values of cond one by one."""
+    values = [value if isinstance(value, list) else [value] for value in cond.values()]
+    for combination in product(*values):
+        yield {name: tuple(value) if type(value) is list else value
+               for name, value in zip(cond, combination)}
+
+
 def factorize(cond):
-    values = list(cond.values())
-    for i in range(0, len(values)):
-        if not isinstance(values[i], list):
-            values[i] = [values[i]]
-
-    conds = list(dict(zip(cond, x)) for x in product(*values))
-    for icond, cond in enumerate(conds):
-        values = list(cond.values())
-        names = list(cond.keys())
-        for ivalue, value in enumerate(values):
-            if type(value) is list:
-                value = tuple(value)
-            cond.update({names[ivalue]: value})
-        conds[icond] = cond
-
-    return conds
-
-
-def make_hash(cond):
-    def make_hashable(cond):
-        if isinstance(cond, (tuple, list)):
-            return tuple((make_hashable(e) for e in cond))
-        if isinstance(cond, dict):
-            return tuple(sorted((k, make_hashable(v)) for k, v in cond.items()))
-        if isinstance(cond, (set, frozenset)):
-            return tuple(sorted(make_hashable(e) for e in cond))
-        return cond
+    return list(ifactorize(cond))
+
+
+def count_conditions(cond):
+    """Returns the number of conditions that factorize generates from cond."""
+    return int(np.prod([len(value) if isinstance(value, list) else 1 for value in cond.values()]))
+
+
+def chunks(iterable, size):
+    """Yields lists of up to size items of an iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
+def _legacy_hashable(cond):
+    if isinstance(cond, (tuple, list)):
+        return tuple((_legacy_hashable(e) for e in cond))
+    if isinstance(cond, dict):
+        return tuple(sorted((k, _legacy_hashable(v)) for k, v in cond.items()))
+    if isinstance(cond, (set, frozenset)):
+        return tuple(sorted(_legacy_hashable(e) for e in cond))
+    return cond
+
+
+def legacy_make_hash(cond):
+    """Returns the hash of a condition computed from its repr, as before the array encoding."""
     hasher = hashlib.md5()
-    hasher.update(repr(make_hashable(cond)).encode())
+    hasher.update(repr(_legacy_hashable(cond)).encode())
+    return base64.b64encode(hasher.digest()).decode()
 
+
+def _encode(cond, memo):
+    """
+    Returns the canonical encoding of a condition that is fed to the hash.
+
+    The encoding of containers and scalars is the repr of their hashable tuples, so the hashes
+    of conditions without arrays are the same as the ones of legacy_make_hash. Numpy arrays are
+    encoded with their dtype, shape and the digest of their raw bytes instead of their repr,
+    which is truncated for long arrays. The encodings of the containers and arrays are kept in
+    memo by object id, so that values shared by factorized conditions are encoded once.
+    """
+    if isinstance(cond, (tuple, list, dict, set, frozenset, np.ndarray)):
+        cached = memo.get(id(cond))
+        if cached is not None and cached[0] is cond:
+            return cached[1]
+    else:
+        return repr(cond)
+    if isinstance(cond, np.ndarray):
+        if cond.dtype.hasobject:
+            encoded = 'ndarray(%s, %r, %s)' % (cond.dtype.str, cond.shape,
+                                               _encode(cond.ravel().tolist(), memo))
+        else:
+            digest = hashlib.md5(np.ascontiguousarray(cond).tobytes()).hexdigest()
+            encoded = 'ndarray(%s, %r, %s)' % (cond.dtype.str, cond.shape, digest)
+    else:
+        if isinstance(cond, dict):
+            items = ['(%r, %s)' % (k, _encode(cond[k], memo)) for k in sorted(cond)]
+        elif isinstance(cond, (set, frozenset)):
+            items = [_encode(e, memo) for e in sorted(cond, key=_legacy_hashable)]
+        else:
+            items = [_encode(e, memo) for e in cond]
+        encoded = '(' + ', '.join(items) + (',)' if len(items) == 1 else ')')
+    memo[id(cond)] = (cond, encoded)  # the object is kept so that its id is not reused
+    return encoded
+
+
+def make_hash(cond, memo=None):
+    """
+    Returns the 24 character hash of a condition.
+
+    Args:
+        cond: The condition, a dict, list, tuple or set that can contain numpy arrays.
+        memo (dict): Encodings of the values shared between calls, e.g. for all the conditions
+        of a log_conditions call. The values should not be modified while the memo is used.
+
+    Returns:
+        str: The base64 md5 digest of the canonical encoding of the condition.
+    """
+    hasher = hashlib.md5()
+    hasher.update(_encode(cond, {} if memo is None else memo).encode())
     return base64.b64encode(hasher.digest()).decode()
 
 
+def hash_changes(conditions):
+    """
+    Returns the conditions whose hash differs from the legacy hash, for the migration of hashes.
+
+    Args:
+        conditions (list): The conditions as dicts of the hashed fields.
+
+    Returns:
+        list: The (legacy hash, hash) of each condition whose hash changed.
+    """
+    memo, changes = dict(), list()
+    for cond in conditions:
+        new_hash, old_hash = make_hash(cond, memo), legacy_make_hash(cond)
+        if new_hash != old_hash:
+            changes.append((old_hash, new_hash))
+    return changes
+
+
 def rgetattr(obj, attr, *args):
     def _getattr(obj, attr): return getattr(obj, attr, *args)
     return functools.reduce(_getattr, [obj] + attr.split('.'))